@@ -0,0 +1,79 @@
+import re
+import time
+from typing import Iterator, Optional
+
+from botocore.exceptions import ClientError
+
+# 10:25:55 | 1 of 5 OK created table model public.top_buyers.... [SELECT in 1.23s]
+MODEL_CREATED = re.compile(
+    r"OK created (?P<materialization>[\w ]+?) model (?P<relation>\S+?)\.*\s+"
+    r"\[(?P<status>.*) in (?P<seconds>\d+(?:\.\d+)?)s\]"
+)
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def parse_model_timing(message: str) -> Optional[dict]:
+    """Return the model built and its duration from a dbt log line."""
+    match = MODEL_CREATED.search(ANSI_ESCAPE.sub("", message))
+    if not match:
+        return None
+    return {
+        "relation": match.group("relation"),
+        "materialization": match.group("materialization"),
+        "status": match.group("status"),
+        "seconds": float(match.group("seconds")),
+    }
+
+
+class LogTailer:
+    """Reads a CloudWatch log stream incrementally.
+
+    Every call to events() returns what was written since the previous call,
+    following the forward token. The token can be saved and passed back to
+    resume from another process.
+    """
+
+    def __init__(
+        self,
+        client,
+        log_group: str,
+        log_stream: str,
+        token: Optional[str] = None,
+        max_attempts: int = 6,
+    ) -> None:
+        self.client = client
+        self.log_group = log_group
+        self.log_stream = log_stream
+        self.token = token
+        self.max_attempts = max_attempts
+
+    def _get_log_events(self) -> Optional[dict]:
+        kwargs = {
+            "logGroupName": self.log_group,
+            "logStreamName": self.log_stream,
+            "startFromHead": True,
+        }
+        if self.token:
+            kwargs["nextToken"] = self.token
+        for attempt in range(self.max_attempts):
+            try:
+                return self.client.get_log_events(**kwargs)
+            except ClientError as e:
+                code = e.response["Error"]["Code"]
+                if code == "ResourceNotFoundException":
+                    # The stream is created once the container starts
+                    return None
+                if code != "ThrottlingException" or attempt == self.max_attempts - 1:
+                    raise
+                time.sleep(min(0.5 * 2**attempt, 10))
+
+    def events(self) -> Iterator[dict]:
+        while True:
+            response = self._get_log_events()
+            if response is None:
+                return
+            yield from response["events"]
+            # The forward token stays the same once the end is reached
+            if response["nextForwardToken"] == self.token:
+                return
+            self.token = response["nextForwardToken"]
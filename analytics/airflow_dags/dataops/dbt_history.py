@@ -0,0 +1,255 @@
+import io
+import json
+import statistics
+from typing import Dict, List, Optional
+
+from airflow.exceptions import AirflowException
+from airflow.hooks.S3_hook import S3Hook
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+# Written by images/dbt/scripts/upload_artifacts.py:
+# <prefix>/<run id>/<invocation id>/run_results.json
+ARTIFACTS_PREFIX = "dbt_artifacts"
+# One part file per DAG run, <prefix>/<run id>.parquet, so that runs
+# checking their regressions at the same time never write the same key
+HISTORY_PREFIX = f"{ARTIFACTS_PREFIX}/history"
+# Single file of the whole history, written before the part files
+LEGACY_HISTORY_KEY = f"{ARTIFACTS_PREFIX}/history.parquet"
+
+COLUMNS = [
+    "run_id",
+    "invocation_id",
+    "generated_at",
+    "unique_id",
+    "status",
+    "execution_time",
+    "rows_affected",
+]
+
+log = LoggingMixin().log
+
+
+def run_result_rows(run_results: dict, run_id: str) -> List[dict]:
+    metadata = run_results["metadata"]
+    return [
+        {
+            "run_id": run_id,
+            "invocation_id": metadata["invocation_id"],
+            "generated_at": metadata["generated_at"],
+            "unique_id": result["unique_id"],
+            "status": result["status"],
+            "execution_time": result["execution_time"],
+            "rows_affected": (result.get("adapter_response") or {}).get(
+                "rows_affected"
+            ),
+        }
+        for result in run_results["results"]
+    ]
+
+
+def history_key(run_id: str) -> str:
+    return f"{HISTORY_PREFIX}/{run_id}.parquet"
+
+
+def _read_parquet(hook: S3Hook, bucket: str, key: str) -> Dict[str, list]:
+    # pyarrow is only needed when the task runs, keep it out of DAG parsing
+    import pyarrow.parquet as pq
+
+    body = hook.get_key(key, bucket).get()["Body"].read()
+    return pq.read_table(io.BytesIO(body)).to_pydict()
+
+
+def _history_keys(hook: S3Hook, bucket: str) -> List[str]:
+    """The part files, most recently written first, then the legacy file."""
+    paginator = hook.get_conn().get_paginator("list_objects_v2")
+    parts = [
+        obj
+        for page in paginator.paginate(Bucket=bucket, Prefix=f"{HISTORY_PREFIX}/")
+        for obj in page.get("Contents", [])
+    ]
+    # Run ids of the same kind sort by date, for parts written the same second
+    parts.sort(key=lambda obj: (obj["LastModified"], obj["Key"]), reverse=True)
+    keys = [obj["Key"] for obj in parts]
+    if hook.check_for_key(LEGACY_HISTORY_KEY, bucket):
+        keys.append(LEGACY_HISTORY_KEY)
+    return keys
+
+
+def read_history(
+    hook: S3Hook, bucket: str, run_id: Optional[str] = None, window: int = 10
+) -> Dict[str, list]:
+    """The part files of every run, and the legacy single file.
+
+    With run_id, only the newest part files are read: the run's own, then
+    the others until every model the run built has `window` earlier
+    successful builds, all that find_regressions compares it with.
+    """
+    history: Dict[str, list] = {column: [] for column in COLUMNS}
+    keys = _history_keys(hook, bucket)
+    own = history_key(run_id) if run_id is not None else None
+    if own is not None:
+        if own not in keys:
+            return history
+        keys.remove(own)
+        keys.insert(0, own)
+    known = set()
+    needed: Dict[str, int] = {}
+    started = ""
+    for key in keys:
+        part = _read_parquet(hook, bucket, key)
+        rows = [
+            dict(zip(COLUMNS, values))
+            for values in zip(*(part[column] for column in COLUMNS))
+        ]
+        if key == own:
+            built = [row for row in rows if row["status"] == "success"]
+            needed = {row["unique_id"]: window for row in built}
+            started = min((row["generated_at"] for row in built), default="")
+        for row in rows:
+            # A run in the legacy file and in a part file is only read once
+            if (row["invocation_id"], row["unique_id"]) in known:
+                continue
+            known.add((row["invocation_id"], row["unique_id"]))
+            for column in COLUMNS:
+                history[column].append(row[column])
+            if (
+                row["unique_id"] in needed
+                and row["status"] == "success"
+                and row["generated_at"] < started
+            ):
+                needed[row["unique_id"]] -= 1
+                if not needed[row["unique_id"]]:
+                    del needed[row["unique_id"]]
+        if own is not None and not needed:
+            break
+    return history
+
+
+def _write_history(
+    hook: S3Hook, bucket: str, key: str, history: Dict[str, list]
+) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    buffer = io.BytesIO()
+    pq.write_table(
+        pa.table(
+            history,
+            schema=pa.schema(
+                [
+                    ("run_id", pa.string()),
+                    ("invocation_id", pa.string()),
+                    ("generated_at", pa.string()),
+                    ("unique_id", pa.string()),
+                    ("status", pa.string()),
+                    ("execution_time", pa.float64()),
+                    ("rows_affected", pa.int64()),
+                ]
+            ),
+        ),
+        buffer,
+        compression="snappy",
+    )
+    hook.load_bytes(buffer.getvalue(), key, bucket, replace=True)
+
+
+def record_run(hook: S3Hook, bucket: str, run_id: str) -> Dict[str, list]:
+    """Write the run results uploaded by the dbt commands of run_id to the
+    run's part file of the history, and return the rows. Only the run's
+    own artifacts are listed, and a rerun of the task rewrites the same
+    part file with them."""
+    rows: Dict[str, list] = {column: [] for column in COLUMNS}
+    added = 0
+    for key in hook.list_keys(bucket, prefix=f"{ARTIFACTS_PREFIX}/{run_id}/") or []:
+        # Skips the files of the run itself, like <run id>/threads.json
+        parts = key.split("/")
+        if len(parts) != 4 or parts[3] != "run_results.json":
+            continue
+        run_results = json.loads(hook.read_key(key, bucket))
+        for row in run_result_rows(run_results, run_id):
+            for column in COLUMNS:
+                rows[column].append(row[column])
+        added += 1
+    if added:
+        _write_history(hook, bucket, history_key(run_id), rows)
+    log.info("Added %s dbt invocations of %s to the history", added, run_id)
+    return rows
+
+
+def find_regressions(
+    history: Dict[str, list],
+    run_id: str,
+    threshold: float = 2.0,
+    window: int = 10,
+    min_runs: int = 3,
+    min_seconds: float = 1.0,
+) -> List[dict]:
+    """Compare the models built in run_id against the median execution time
+    of their previous `window` successful builds.
+
+    A model regresses when it got `threshold` times slower and at least
+    `min_seconds` slower than its baseline.
+    """
+    rows = sorted(
+        (dict(zip(history, values)) for values in zip(*history.values())),
+        key=lambda row: row["generated_at"],
+    )
+    previous: Dict[str, List[float]] = {}
+    current: Dict[str, dict] = {}
+    for row in rows:
+        if row["status"] != "success":
+            continue
+        if row["run_id"] == run_id:
+            current[row["unique_id"]] = row
+        elif not current:
+            # Only runs before this one make the baseline
+            previous.setdefault(row["unique_id"], []).append(row["execution_time"])
+
+    regressions = []
+    for unique_id, row in sorted(current.items()):
+        times = previous.get(unique_id, [])[-window:]
+        if len(times) < min_runs:
+            continue
+        baseline = statistics.median(times)
+        seconds = row["execution_time"]
+        if seconds >= baseline * threshold and seconds - baseline >= min_seconds:
+            regressions.append(
+                {
+                    "unique_id": unique_id,
+                    "execution_time": seconds,
+                    "baseline": baseline,
+                    "ratio": seconds / baseline if baseline else float("inf"),
+                }
+            )
+    return regressions
+
+
+def check_regressions(
+    bucket: str,
+    threshold: float = 2.0,
+    window: int = 10,
+    fail: bool = False,
+    aws_conn_id: Optional[str] = "aws_default",
+    **context,
+) -> List[dict]:
+    """PythonOperator callable: add this DAG run to the history and warn
+    about (or fail on) its models that got slower."""
+    hook = S3Hook(aws_conn_id=aws_conn_id)
+    record_run(hook, bucket, context["run_id"])
+    history = read_history(hook, bucket, context["run_id"], window)
+    regressions = find_regressions(
+        history, context["run_id"], threshold=threshold, window=window
+    )
+    for regression in regressions:
+        log.warning(
+            "%s took %.2fs, %.1fx its baseline of %.2fs",
+            regression["unique_id"],
+            regression["execution_time"],
+            regression["ratio"],
+            regression["baseline"],
+        )
+    if regressions and fail:
+        raise AirflowException(
+            f"{len(regressions)} dbt models are slower than {threshold}x their baseline"
+        )
+    return regressions
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, List, Optional, Set
+
+# Reduced model graphs are cached on disk by manifest hash, because the
+# scheduler parses each DAG file in a fresh process.
+CACHE_DIR = os.environ.get(
+    "DBT_MANIFEST_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "dbt_manifest_cache"),
+)
+
+_graphs: Dict[str, "DbtGraph"] = {}
+
+
+class DbtGraph:
+    def __init__(self, parents: Dict[str, List[str]]) -> None:
+        # model name -> names of the models it refs
+        self.parents = parents
+
+    @classmethod
+    def from_manifest(cls, manifest: dict) -> "DbtGraph":
+        nodes = manifest["nodes"]
+
+        def is_model(unique_id: str) -> bool:
+            return nodes.get(unique_id, {}).get("resource_type") == "model"
+
+        def built_parents(node: dict) -> Set[str]:
+            # Ephemeral models are inlined into their children and never
+            # built, their children wait on the models they ref instead
+            found = set()
+            for unique_id in node["depends_on"]["nodes"]:
+                if not is_model(unique_id):
+                    continue
+                parent = nodes[unique_id]
+                if parent["config"].get("materialized") == "ephemeral":
+                    found |= built_parents(parent)
+                else:
+                    found.add(parent["name"])
+            return found
+
+        parents = {}
+        for unique_id, node in nodes.items():
+            if (
+                is_model(unique_id)
+                and node["config"].get("materialized") != "ephemeral"
+            ):
+                parents[node["name"]] = sorted(built_parents(node))
+        return cls(parents)
+
+    @property
+    def models(self) -> List[str]:
+        return sorted(self.parents)
+
+    def children(self, model: str) -> List[str]:
+        return sorted(
+            child for child, parents in self.parents.items() if model in parents
+        )
+
+    def layers(self) -> List[List[str]]:
+        # Group models into dependency layers: every model only refs models
+        # from earlier layers, so all models of a layer can run concurrently.
+        remaining = {model: set(parents) for model, parents in self.parents.items()}
+        layers = []
+        while remaining:
+            layer = sorted(model for model, parents in remaining.items() if not parents)
+            if not layer:
+                raise ValueError(f"Cycle in dbt model graph: {sorted(remaining)}")
+            layers.append(layer)
+            for model in layer:
+                del remaining[model]
+            for parents in remaining.values():
+                parents.difference_update(layer)
+        return layers
+
+
+def load_graph(manifest_path: str) -> Optional[DbtGraph]:
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+
+    if digest in _graphs:
+        return _graphs[digest]
+
+    cache_path = os.path.join(CACHE_DIR, f"{digest}.json")
+    try:
+        with open(cache_path) as f:
+            graph = DbtGraph(json.load(f))
+    except (OSError, ValueError):
+        graph = DbtGraph.from_manifest(json.loads(content))
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(graph.parents, f)
+        os.replace(tmp_path, cache_path)
+
+    _graphs[digest] = graph
+    return graph
@@ -0,0 +1,97 @@
+import json
+from typing import List
+
+from airflow.contrib.hooks.redis_hook import RedisHook
+from airflow.exceptions import AirflowException
+from airflow.models import TaskReschedule
+from airflow.sensors.base_sensor_operator import BaseSensorOperator
+from airflow.utils.decorators import apply_defaults
+
+# Keys shared with images/dbt/scripts/dbt_runner.py
+REQUEST_QUEUE = "dbt:runs"
+RESULT_PREFIX = "dbt:results:"
+
+
+class DbtRunnerOperator(BaseSensorOperator):
+    """Runs a dbt command on the long-lived dbt runner service.
+
+    The request is queued in Redis on the first poke, avoiding a Fargate
+    task start per dbt invocation. The operator then runs in reschedule
+    mode, so the worker slot is free while the runners work, and every poke
+    checks whether a runner pushed back the result. It fails when no result
+    came within run_timeout seconds.
+    """
+
+    template_fields = ("full_refresh",)
+    ui_color = "#ff694b"
+
+    @apply_defaults
+    def __init__(
+        self,
+        command: List[str],
+        state_aware: bool = True,
+        full_refresh: str = "false",
+        redis_conn_id: str = "dbt_runner_redis",
+        run_timeout: int = 60 * 60,
+        poke_interval: int = 15,
+        mode: str = "reschedule",
+        *args,
+        **kwargs,
+    ) -> None:
+        super().__init__(
+            poke_interval=poke_interval,
+            timeout=run_timeout,
+            mode=mode,
+            *args,
+            **kwargs,
+        )
+        self.command = command
+        self.state_aware = state_aware
+        self.full_refresh = full_refresh
+        self.redis_conn_id = redis_conn_id
+        self.run_timeout = run_timeout
+
+    def request_id(self, context) -> str:
+        # The same for every poke of a try, a retry queues a new request
+        ti = context["ti"]
+        return f"{context['run_id']}.{self.task_id}.{ti.try_number}"
+
+    def execute(self, context):
+        if not TaskReschedule.find_for_task_instance(context["ti"]):
+            self.queue_request(context)
+        super().execute(context)
+
+    def queue_request(self, context) -> None:
+        request = {
+            "id": self.request_id(context),
+            "command": self.command,
+            "state_aware": self.state_aware,
+            "full_refresh": str(self.full_refresh).lower() == "true",
+            "run_id": context["run_id"],
+        }
+        self.log.info("Queueing dbt run %s: %s", request["id"], request["command"])
+        redis = RedisHook(redis_conn_id=self.redis_conn_id).get_conn()
+        redis.rpush(REQUEST_QUEUE, json.dumps(request))
+
+    def poke(self, context) -> bool:
+        request_id = self.request_id(context)
+        redis = RedisHook(redis_conn_id=self.redis_conn_id).get_conn()
+        item = redis.lindex(RESULT_PREFIX + request_id, 0)
+        if item is None:
+            self.log.info("Waiting for dbt run %s", request_id)
+            return False
+        result = json.loads(item)
+
+        for node in result["results"]:
+            self.log.info(
+                "%s %s in %.2fs",
+                node["unique_id"],
+                node["status"],
+                node["execution_time"],
+            )
+        if not result["success"]:
+            raise AirflowException(
+                f"dbt run {request_id} failed: {result.get('error', '')}"
+            )
+        self.log.info("dbt run finished in %.2fs", result["elapsed"])
+        return True
@@ -0,0 +1,39 @@
+from typing import Any, Callable, List, Tuple
+
+from dataops.dbt_manifest import load_graph
+
+# make_task(task_id, models) -> (first, last) operators running `dbt run`
+# for the given models (all models when the list is empty)
+TaskFactory = Callable[[str, List[str]], Tuple[Any, Any]]
+
+
+def dbt_model_tasks(
+    manifest_path: str, make_task: TaskFactory, per_layer: bool = False
+) -> Tuple[List[Any], List[Any]]:
+    """Create one task per dbt model (or per dependency layer), wired by the
+    ref() graph of the compiled manifest, and return the (root, leaf) tasks.
+
+    Falls back to a single task running every model while no manifest is
+    available.
+    """
+    graph = load_graph(manifest_path)
+    if graph is None:
+        first, last = make_task("dbt_run", [])
+        return [first], [last]
+
+    if per_layer:
+        tasks = [
+            make_task(f"dbt_layer_{i}", layer) for i, layer in enumerate(graph.layers())
+        ]
+        for upstream, downstream in zip(tasks, tasks[1:]):
+            upstream[1] >> downstream[0]
+        return [tasks[0][0]], [tasks[-1][1]]
+
+    tasks = {model: make_task(model, [model]) for model in graph.models}
+    for model, parents in graph.parents.items():
+        for parent in parents:
+            tasks[parent][1] >> tasks[model][0]
+
+    roots = [tasks[model][0] for model in graph.models if not graph.parents[model]]
+    leaves = [tasks[model][1] for model in graph.models if not graph.children(model)]
+    return roots, leaves
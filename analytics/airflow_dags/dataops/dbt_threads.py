@@ -0,0 +1,25 @@
+import json
+from typing import Optional
+
+from airflow.hooks.S3_hook import S3Hook
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+from dataops.dbt_history import ARTIFACTS_PREFIX
+
+log = LoggingMixin().log
+
+
+def run_allowance(
+    context, bucket: Optional[str] = None, aws_conn_id: Optional[str] = "aws_default"
+) -> Optional[int]:
+    """Number of dbt model tasks the DAG run may run at once, as decided by
+    the dbt_threads task of the run (the dbt image's dbt_threads.py --plan),
+    or None when the run has no decision."""
+    if not bucket:
+        return None
+    key = f"{ARTIFACTS_PREFIX}/{context['run_id']}/threads.json"
+    hook = S3Hook(aws_conn_id=aws_conn_id)
+    if not hook.check_for_key(key, bucket):
+        log.info("No thread decision at s3://%s/%s, not limiting", bucket, key)
+        return None
+    return json.loads(hook.read_key(key, bucket))["threads"]
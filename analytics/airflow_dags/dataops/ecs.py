@@ -0,0 +1,340 @@
+import copy
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from airflow.contrib.operators.ecs_operator import ECSOperator
+from airflow.exceptions import AirflowException, AirflowRescheduleException
+from airflow.models import BaseOperator, TaskReschedule, XCom
+from airflow.sensors.base_sensor_operator import BaseSensorOperator
+from airflow.ti_deps.deps.ready_to_reschedule import ReadyToRescheduleDep
+from airflow.utils import timezone
+from airflow.utils.decorators import apply_defaults
+
+from dataops.cloudwatch import LogTailer, parse_model_timing
+from dataops.fargate_cost import COST_KEY, INTERRUPTED_STOP_CODES, task_cost
+
+# XCom keys kept on the run task, sensor XComs are cleared on every reschedule
+LOGS_POSITION_KEY = "ecs_logs_position"
+MODEL_TIMINGS_KEY = "dbt_model_timings"
+ATTEMPTS_KEY = "ecs_task_attempts"
+
+ON_DEMAND = [{"capacityProvider": "FARGATE", "weight": 1}]
+
+
+def capacity_provider_strategy(value: str) -> Optional[List[dict]]:
+    """Parse a capacity provider strategy like "FARGATE:1:1,FARGATE_SPOT:3",
+    as <provider>:<weight>[:<base>] items. Empty for the launch type."""
+    strategy = []
+    for item in filter(None, (item.strip() for item in value.split(","))):
+        provider, weight, *base = item.split(":")
+        entry = {"capacityProvider": provider, "weight": int(weight)}
+        if base:
+            entry["base"] = int(base[0])
+        strategy.append(entry)
+    return strategy or None
+
+
+class EcsRunTaskOperator(ECSOperator):
+    """Starts an ECS task and returns its ARN (pushed to XCom) without
+    waiting for it to stop. Pair it with an EcsTaskSensor.
+
+    With a capacity_provider_strategy, the task is placed by the cluster's
+    capacity providers instead of the launch type. When Fargate Spot has no
+    capacity left, the task starts on on-demand Fargate instead.
+
+    running_limit is called with the context and returns how many tasks of
+    the task definition's family may run in the cluster at once, or None.
+    At the limit, the operator is rescheduled every limit_poke_interval
+    seconds instead of starting its task. Operators checking at the same
+    time may go over it by a few tasks.
+    """
+
+    @apply_defaults
+    def __init__(
+        self,
+        capacity_provider_strategy: Optional[List[dict]] = None,
+        running_limit: Optional[Callable[[dict], Optional[int]]] = None,
+        limit_poke_interval: int = 30,
+        *args,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.capacity_provider_strategy = capacity_provider_strategy
+        self.running_limit = running_limit
+        self.limit_poke_interval = limit_poke_interval
+
+    @property
+    def deps(self):
+        # Honour the reschedule date when waiting for the running limit
+        return BaseOperator.deps.fget(self) | {ReadyToRescheduleDep()}
+
+    def running_tasks(self) -> int:
+        """Number of tasks of the task definition's family in the cluster
+        that are starting or running."""
+        client = self.hook.get_client_type("ecs", region_name=self.region_name)
+        paginator = client.get_paginator("list_tasks")
+        pages = paginator.paginate(
+            cluster=self.cluster,
+            family=self.task_definition.split(":")[0],
+            desiredStatus="RUNNING",
+        )
+        return sum(len(page["taskArns"]) for page in pages)
+
+    def submit(self, context, capacity_provider_strategy=None) -> str:
+        strategy = capacity_provider_strategy or self.capacity_provider_strategy
+        self.log.info(
+            "Running ECS Task - Task definition: %s - on cluster %s",
+            self.task_definition,
+            self.cluster,
+        )
+        self.log.info("ECSOperator overrides: %s", self.overrides)
+        self.client = self.hook.get_client_type("ecs", region_name=self.region_name)
+
+        run_opts = {
+            "cluster": self.cluster,
+            "taskDefinition": self.task_definition,
+            "overrides": self.overrides,
+            "startedBy": self.owner,
+        }
+        if strategy:
+            run_opts["capacityProviderStrategy"] = strategy
+        else:
+            run_opts["launchType"] = self.launch_type
+        if self.launch_type == "FARGATE":
+            run_opts["platformVersion"] = self.platform_version
+        if self.group is not None:
+            run_opts["group"] = self.group
+        if self.placement_constraints is not None:
+            run_opts["placementConstraints"] = self.placement_constraints
+        if self.network_configuration is not None:
+            run_opts["networkConfiguration"] = self.network_configuration
+        if self.tags is not None:
+            run_opts["tags"] = [{"key": k, "value": v} for k, v in self.tags.items()]
+
+        response = self.client.run_task(**run_opts)
+        if response["failures"] and strategy and strategy != ON_DEMAND:
+            self.log.warning(
+                "ECS Task not started on %s: %s, starting it on on-demand capacity",
+                strategy,
+                response["failures"],
+            )
+            run_opts["capacityProviderStrategy"] = ON_DEMAND
+            response = self.client.run_task(**run_opts)
+        if response["failures"]:
+            raise AirflowException(response)
+        self.log.info("ECS Task started: %s", response)
+        self.arn = response["tasks"][0]["taskArn"]
+        return self.arn
+
+    def execute(self, context):
+        limit = self.running_limit(context) if self.running_limit else None
+        if limit is not None:
+            running = self.running_tasks()
+            if running >= limit:
+                self.log.info(
+                    "%s tasks of %s running, the limit is %s, waiting",
+                    running,
+                    self.task_definition,
+                    limit,
+                )
+                raise AirflowRescheduleException(
+                    timezone.utcnow() + timedelta(seconds=self.limit_poke_interval)
+                )
+        return self.submit(context)
+
+    def check(self, arn: str) -> None:
+        """Raise unless the stopped task succeeded, like ECSOperator does once
+        the task stopped. Its logs are tailed by EcsTaskSensor instead."""
+        self.client = self.hook.get_client_type("ecs", region_name=self.region_name)
+        self.arn = arn
+        awslogs_group, self.awslogs_group = self.awslogs_group, None
+        try:
+            self._check_success_task()
+        finally:
+            self.awslogs_group = awslogs_group
+
+
+class EcsTaskSensor(BaseSensorOperator):
+    """Waits for the ECS task started by an EcsRunTaskOperator.
+
+    Runs in reschedule mode, so the worker slot is free between pokes, and
+    doubles the poke interval after every poke up to max_poke_interval. A
+    retry of the sensor starts the task again if the previous one stopped
+    without succeeding.
+
+    Every poke prints the task's new CloudWatch log events and collects the
+    per-model durations reported by dbt, pushed to XCom as dbt_model_timings.
+
+    A task interrupted by Fargate Spot is started again with the capacity
+    provider strategy of the run task, so on Spot again, until it was
+    interrupted max_interruptions times: it is then started on on-demand
+    Fargate. Once the task stopped, the Fargate cost of every task started
+    is pushed to XCom as ecs_task_cost.
+    """
+
+    ui_color = "#ffa347"
+
+    @apply_defaults
+    def __init__(
+        self,
+        run_task_id: str,
+        poke_interval: int = 30,
+        max_poke_interval: int = 5 * 60,
+        max_interruptions: int = 2,
+        mode: str = "reschedule",
+        *args,
+        **kwargs,
+    ) -> None:
+        super().__init__(poke_interval=poke_interval, mode=mode, *args, **kwargs)
+        self.run_task_id = run_task_id
+        self.initial_poke_interval = poke_interval
+        self.max_poke_interval = max_poke_interval
+        self.max_interruptions = max_interruptions
+
+    def execute(self, context):
+        pokes = len(TaskReschedule.find_for_task_instance(context["ti"]))
+        self.poke_interval = min(
+            self.initial_poke_interval * 2**pokes, self.max_poke_interval
+        )
+        if pokes == 0 and context["ti"].try_number > 1:
+            self._resubmit_stopped(context)
+        super().execute(context)
+
+    @property
+    def run_task(self) -> EcsRunTaskOperator:
+        return self.dag.get_task(self.run_task_id)
+
+    def _arn(self, context) -> str:
+        arn = context["ti"].xcom_pull(task_ids=self.run_task_id)
+        if not arn:
+            raise AirflowException(f"No ECS task ARN pushed by {self.run_task_id}")
+        return arn
+
+    def _describe(self, arn: str) -> dict:
+        client = self.run_task.hook.get_client_type(
+            "ecs", region_name=self.run_task.region_name
+        )
+        response = client.describe_tasks(cluster=self.run_task.cluster, tasks=[arn])
+        if response.get("failures"):
+            raise AirflowException(response)
+        return response["tasks"][0]
+
+    def _resubmit_stopped(self, context) -> None:
+        arn = self._arn(context)
+        task = self._describe(arn)
+        if task["lastStatus"] != "STOPPED":
+            return
+        # A task that succeeded while the previous try was lost is kept
+        if task.get("stopCode") == "EssentialContainerExited" and all(
+            container.get("exitCode") == 0 for container in task["containers"]
+        ):
+            return
+        self.log.info("ECS Task %s stopped, starting it again", arn)
+        self._resubmit(context)
+
+    def _resubmit(self, context, capacity_provider_strategy=None) -> None:
+        run_task = copy.deepcopy(self.run_task)
+        run_task.render_template_fields(context)
+        arn = run_task.submit(context, capacity_provider_strategy)
+        # Keep the new ARN where the next pokes look for it
+        self._set_run_task_xcom(context, "return_value", arn)
+
+    def _record_attempt(self, context, task: dict) -> List[dict]:
+        """Add the cost of a stopped task to the tasks started for this run
+        task, kept on its XComs."""
+        attempts = (
+            context["ti"].xcom_pull(task_ids=self.run_task_id, key=ATTEMPTS_KEY) or []
+        )
+        if all(attempt["arn"] != task["taskArn"] for attempt in attempts):
+            attempts.append(task_cost(task))
+            self._set_run_task_xcom(context, ATTEMPTS_KEY, attempts)
+        return attempts
+
+    def _set_run_task_xcom(self, context, key: str, value) -> None:
+        XCom.set(
+            key=key,
+            value=value,
+            execution_date=context["ti"].execution_date,
+            task_id=self.run_task_id,
+            dag_id=self.dag_id,
+        )
+
+    def _tail_logs(self, context, arn: str) -> dict:
+        run_task = self.run_task
+        ti = context["ti"]
+        position = ti.xcom_pull(task_ids=self.run_task_id, key=LOGS_POSITION_KEY)
+        timings = {}
+        token = None
+        if position and position["arn"] == arn:
+            token = position["token"]
+            timings = position["timings"]
+        if not (run_task.awslogs_group and run_task.awslogs_stream_prefix):
+            return timings
+
+        tailer = LogTailer(
+            run_task.get_logs_hook().get_conn(),
+            run_task.awslogs_group,
+            f"{run_task.awslogs_stream_prefix}/{arn.split('/')[-1]}",
+            token,
+        )
+        new_timings = {}
+        for event in tailer.events():
+            dt = datetime.fromtimestamp(event["timestamp"] / 1000.0)
+            self.log.info("[%s] %s", dt.isoformat(), event["message"])
+            timing = parse_model_timing(event["message"])
+            if timing:
+                new_timings[timing.pop("relation")] = timing
+        if new_timings:
+            for relation, timing in new_timings.items():
+                self.log.info(
+                    "dbt model %s built in %.2fs", relation, timing["seconds"]
+                )
+            timings.update(new_timings)
+            self._set_run_task_xcom(context, MODEL_TIMINGS_KEY, timings)
+        self._set_run_task_xcom(
+            context,
+            LOGS_POSITION_KEY,
+            {"arn": arn, "token": tailer.token, "timings": timings},
+        )
+        return timings
+
+    def poke(self, context) -> bool:
+        arn = self._arn(context)
+        task = self._describe(arn)
+        status = task["lastStatus"]
+        self.log.info("ECS Task %s is %s", arn, status)
+        timings = self._tail_logs(context, arn)
+        if status != "STOPPED":
+            return False
+
+        attempts = self._record_attempt(context, task)
+        interruptions = sum(
+            attempt["stop_code"] in INTERRUPTED_STOP_CODES for attempt in attempts
+        )
+        if (
+            task.get("stopCode") in INTERRUPTED_STOP_CODES
+            and interruptions <= self.max_interruptions
+        ):
+            # The run task's strategy until the last interruption allowed
+            strategy = None if interruptions < self.max_interruptions else ON_DEMAND
+            self.log.warning(
+                "ECS Task %s interrupted (%s, %d of %d), starting it %s",
+                arn,
+                task.get("stoppedReason"),
+                interruptions,
+                self.max_interruptions,
+                "again" if strategy is None else "on on-demand capacity",
+            )
+            self._resubmit(context, strategy)
+            return False
+        context["ti"].xcom_push(
+            key=COST_KEY,
+            value={
+                "attempts": attempts,
+                "cost": sum(attempt["cost"] for attempt in attempts),
+            },
+        )
+        self.run_task.check(arn)
+        context["ti"].xcom_push(key=MODEL_TIMINGS_KEY, value=timings)
+        self.log.info("ECS Task has been successfully executed: %s", arn)
+        return True
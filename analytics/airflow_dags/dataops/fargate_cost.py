@@ -0,0 +1,123 @@
+import json
+import math
+import os
+from typing import Dict, List, Optional
+
+from airflow.hooks.S3_hook import S3Hook
+from airflow.models import XCom
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+from dataops.dbt_history import ARTIFACTS_PREFIX
+
+# Linux/x86 prices per hour in us-east-1, override them for other regions.
+# Fargate Spot prices change with the spare capacity, see the pricing page.
+PRICES = {
+    "FARGATE": {
+        "vcpu": float(os.environ.get("FARGATE_VCPU_HOUR", "0.04048")),
+        "gb": float(os.environ.get("FARGATE_GB_HOUR", "0.004445")),
+    },
+    "FARGATE_SPOT": {
+        "vcpu": float(os.environ.get("FARGATE_SPOT_VCPU_HOUR", "0.012144")),
+        "gb": float(os.environ.get("FARGATE_SPOT_GB_HOUR", "0.001334")),
+    },
+}
+# Fargate bills every second from the image pull, with a one minute minimum
+MINIMUM_SECONDS = 60
+# Pushed by dataops.ecs.EcsTaskSensor once its task stopped
+COST_KEY = "ecs_task_cost"
+# Stop codes of tasks that Fargate Spot reclaimed
+INTERRUPTED_STOP_CODES = {"SpotInterruption", "TerminationNotice"}
+
+log = LoggingMixin().log
+
+
+def task_cost(task: dict) -> dict:
+    """Fargate cost of a stopped task, from its ECS DescribeTasks description."""
+    provider = task.get("capacityProviderName") or "FARGATE"
+    started = task.get("pullStartedAt") or task.get("startedAt") or task["createdAt"]
+    seconds = (task["stoppedAt"] - started).total_seconds()
+    seconds = max(math.ceil(seconds), MINIMUM_SECONDS)
+    vcpu = int(task["cpu"]) / 1024
+    gb = int(task["memory"]) / 1024
+    prices = PRICES.get(provider, PRICES["FARGATE"])
+    return {
+        "arn": task["taskArn"],
+        "capacity_provider": provider,
+        "stop_code": task.get("stopCode"),
+        "seconds": seconds,
+        "vcpu": vcpu,
+        "memory_gb": gb,
+        "cost": seconds / 3600 * (vcpu * prices["vcpu"] + gb * prices["gb"]),
+    }
+
+
+def on_demand_cost(attempt: dict) -> float:
+    prices = PRICES["FARGATE"]
+    return (
+        attempt["seconds"]
+        / 3600
+        * (attempt["vcpu"] * prices["vcpu"] + attempt["memory_gb"] * prices["gb"])
+    )
+
+
+def summarize(costs: Dict[str, dict]) -> dict:
+    """Total cost of a DAG run from the costs pushed by its sensors, by
+    task id, and what the same tasks would have cost on on-demand Fargate."""
+    attempts: List[dict] = [
+        attempt for cost in costs.values() for attempt in cost["attempts"]
+    ]
+    total = sum(attempt["cost"] for attempt in attempts)
+    on_demand = sum(on_demand_cost(attempt) for attempt in attempts)
+    return {
+        "tasks": costs,
+        "cost": total,
+        "on_demand_cost": on_demand,
+        "saving": on_demand - total,
+        "interruptions": sum(
+            attempt["stop_code"] in INTERRUPTED_STOP_CODES for attempt in attempts
+        ),
+    }
+
+
+def report_costs(
+    bucket: Optional[str] = None,
+    aws_conn_id: Optional[str] = "aws_default",
+    **context,
+) -> dict:
+    """PythonOperator callable: log the Fargate cost of the ECS tasks of
+    this DAG run and upload it to dbt_artifacts/<run id>/cost.json."""
+    costs = {
+        xcom.task_id: xcom.value
+        for xcom in XCom.get_many(
+            execution_date=context["execution_date"],
+            key=COST_KEY,
+            dag_ids=context["dag"].dag_id,
+            limit=len(context["dag"].tasks),
+        )
+    }
+    summary = summarize(costs)
+    for task_id, cost in sorted(costs.items()):
+        for attempt in cost["attempts"]:
+            log.info(
+                "%s: %ss on %s (%s), $%.5f",
+                task_id,
+                attempt["seconds"],
+                attempt["capacity_provider"],
+                attempt["stop_code"],
+                attempt["cost"],
+            )
+    log.info(
+        "%s ECS tasks cost $%.4f, $%.4f less than on-demand, %s interruptions",
+        len(costs),
+        summary["cost"],
+        summary["saving"],
+        summary["interruptions"],
+    )
+    if bucket:
+        S3Hook(aws_conn_id=aws_conn_id).load_string(
+            json.dumps(summary, indent=2),
+            f"{ARTIFACTS_PREFIX}/{context['run_id']}/cost.json",
+            bucket,
+            replace=True,
+        )
+    return summary
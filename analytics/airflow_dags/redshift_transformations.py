@@ -1,15 +1,38 @@
 import os
 from airflow import DAG
-from airflow.contrib.operators.ecs_operator import ECSOperator
 from airflow.operators.bash_operator import BashOperator
+from airflow.operators.python_operator import PythonOperator
 from airflow.utils.dates import days_ago
 from datetime import timedelta
 
+from dataops.dbt_history import check_regressions
+from dataops.dbt_runner import DbtRunnerOperator
+from dataops.dbt_tasks import dbt_model_tasks
+from dataops.dbt_threads import run_allowance
+from dataops.ecs import EcsRunTaskOperator, EcsTaskSensor, capacity_provider_strategy
+from dataops.fargate_cost import report_costs
+
+# Compiled dbt manifest, uploaded next to the DAGs by the deploy workflow
+DBT_MANIFEST_PATH = os.path.join(os.path.dirname(__file__), "dbt", "manifest.json")
+# Run dbt on the long-lived runner service instead of a Fargate task per run
+DBT_RUNNER_ENABLED = os.environ.get("DBT_RUNNER_ENABLED") == "true"
+# Capacity providers of the dbt tasks, like "FARGATE:1:1,FARGATE_SPOT:3"
+DBT_CAPACITY_PROVIDERS = capacity_provider_strategy(
+    os.environ.get("DBT_CAPACITY_PROVIDERS", "")
+)
+# Trigger with {"full_refresh": true} to rebuild incremental models from scratch
+FULL_REFRESH = (
+    "{{ 'true' if dag_run and dag_run.conf "
+    "and dag_run.conf.get('full_refresh') else 'false' }}"
+)
+
 default_args = {
     "owner": "airflow",
     "depends_on_past": False,
     "start_date": days_ago(2),
-    "retries": 0,
+    # Tasks lost with their worker, like a worker reclaimed by Fargate Spot,
+    # run again on another one
+    "retries": 1,
     "retry_delay": timedelta(minutes=5),
 }
 
@@ -24,29 +47,100 @@ dag = DAG(
 bash_task = BashOperator(task_id="run_bash_echo", bash_command="echo 1", dag=dag)
 post_task = BashOperator(task_id="post_dbt", bash_command="echo 0", dag=dag)
 
-dbt_top_events = ECSOperator(
-    task_id="dbt_top_events",
-    dag=dag,
-    aws_conn_id="aws_ecs",
-    cluster="MyCluster",
-    task_definition="dbt-cdk",
-    launch_type="FARGATE",
-    overrides={
-        "containerOverrides": [
-            {
-                "name": "dbt-cdk-container",
-                "command": ["dbt", "run"],
+
+def dbt_task(task_id, command, running_limit=None):
+    if DBT_RUNNER_ENABLED:
+        task = DbtRunnerOperator(
+            task_id=task_id,
+            dag=dag,
+            command=command,
+            full_refresh=FULL_REFRESH,
+        )
+        return task, task
+
+    # Start the dbt task, then free the worker slot while waiting for it
+    run = EcsRunTaskOperator(
+        task_id=task_id,
+        dag=dag,
+        aws_conn_id="aws_ecs",
+        cluster="MyCluster",
+        task_definition="dbt-cdk",
+        launch_type="FARGATE",
+        capacity_provider_strategy=DBT_CAPACITY_PROVIDERS,
+        running_limit=running_limit,
+        overrides={
+            "containerOverrides": [
+                {
+                    "name": "dbt-cdk-container",
+                    "command": command,
+                    "environment": [
+                        # Only build models modified since the last saved state
+                        {"name": "DBT_STATE_AWARE", "value": "true"},
+                        {"name": "DBT_FULL_REFRESH", "value": FULL_REFRESH},
+                        # Artifacts are uploaded under the DAG run
+                        {"name": "DBT_RUN_ID", "value": "{{ run_id }}"},
+                    ],
+                },
+            ],
+        },
+        network_configuration={
+            "awsvpcConfiguration": {
+                "securityGroups": ["<SECURITY_GROUP_ID>"],
+                "subnets": ["<SUBNET_ID>", "<SUBNET_ID>"],
             },
-        ],
-    },
-    network_configuration={
-        "awsvpcConfiguration": {
-            "securityGroups": ["<SECURITY_GROUP_ID>"],
-            "subnets": ["<SUBNET_ID>", "<SUBNET_ID>"],
         },
+        awslogs_group="/ecs/dbt-cdk",
+        awslogs_stream_prefix="ecs/dbt-cdk-container",
+    )
+    wait = EcsTaskSensor(task_id=f"{task_id}_wait", dag=dag, run_task_id=task_id)
+    run >> wait
+    return run, wait
+
+
+def limit_to_allowance(context):
+    return run_allowance(context, os.environ.get("BUCKET_NAME"))
+
+
+def dbt_run_task(task_id, models):
+    command = ["dbt", "run"]
+    if models:
+        command += ["--models"] + models
+    # As many model tasks at once as the thread allowance of the DAG run
+    return dbt_task(task_id, command, limit_to_allowance)
+
+
+# Decide the dbt thread allowance once for the DAG run, from the Redshift
+# queue wait, before the model tasks share it
+threads_start, threads_end = dbt_task("dbt_threads", ["threads"])
+dbt_roots, dbt_leaves = dbt_model_tasks(DBT_MANIFEST_PATH, dbt_run_task)
+# Persist the manifest once every model is built, as baseline for the next run
+save_state_start, save_state_end = dbt_task("dbt_save_state", ["save-state"])
+# Flag models that got slower than their recent runs
+regression_check = PythonOperator(
+    task_id="dbt_regression_check",
+    dag=dag,
+    python_callable=check_regressions,
+    provide_context=True,
+    # A regression does not go away on retry
+    retries=0,
+    op_kwargs={
+        "bucket": os.environ.get("BUCKET_NAME"),
+        "threshold": float(os.environ.get("DBT_REGRESSION_THRESHOLD", "2.0")),
+        "fail": os.environ.get("DBT_REGRESSION_FAIL") == "true",
     },
-    awslogs_group="/ecs/dbt-cdk",
-    awslogs_stream_prefix="ecs/dbt-cdk-container",
+)
+# Fargate cost of the dbt tasks of this run, whether they succeeded or not
+cost_report = PythonOperator(
+    task_id="dbt_cost_report",
+    dag=dag,
+    python_callable=report_costs,
+    provide_context=True,
+    trigger_rule="all_done",
+    op_kwargs={"bucket": os.environ.get("BUCKET_NAME")},
 )
 
-bash_task >> dbt_top_events >> post_task
+bash_task >> threads_start
+threads_end >> dbt_roots
+dbt_leaves >> save_state_start
+save_state_end >> regression_check >> post_task
+save_state_end >> cost_report
@@ -0,0 +1,286 @@
+"""Benchmark the models of dbt_dags/models/example per TICKIT scale factor.
+
+For every scale factor, loads the generated TICKIT tables (tickit_data.py)
+into their own schema, builds the whole project once, then rebuilds each
+model --repeat times with `dbt run --full-refresh`, in dependency order,
+reading the `tickit` source from that schema (tickit_schema var):
+
+    $ python benchmarks/model_benchmark.py --dsn "host=localhost user=postgres" \\
+        --scale-factors 0.1 1 10 --output results.json
+
+The latency is the execute phase of the model in run_results.json, without
+dbt's start-up. Scan and memory statistics come from the last build: from
+the Redshift system tables (svl_query_metrics_summary, svl_query_summary)
+for the model's queries, or on Postgres from EXPLAIN (ANALYZE, BUFFERS) of
+the compiled model. Without --dsn, runs against the `dev` target and the
+REDSHIFT_* variables of the dbt profile, loading through --s3-uri and
+--iam-role as tickit_data.py does.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+from typing import Dict, List
+
+from psycopg2.extensions import parse_dsn
+
+import tickit_data
+from percentile_modes import connect
+
+PROJECT_DIR = os.path.join(os.path.dirname(__file__), "..", "dbt_dags")
+MODELS_PATH = "models/example"
+
+REDSHIFT_STATS_SQL = """
+WITH queries AS (
+    SELECT query FROM stl_query
+    WHERE userid = (SELECT usesysid FROM pg_user WHERE usename = current_user)
+    AND starttime BETWEEN %s AND %s
+    AND querytxt LIKE %s
+)
+SELECT
+    (SELECT sum(scan_row_count) FROM svl_query_metrics_summary
+     WHERE query IN (SELECT query FROM queries)),
+    (SELECT sum(query_blocks_read) FROM svl_query_metrics_summary
+     WHERE query IN (SELECT query FROM queries)),
+    (SELECT sum(query_temp_blocks_to_disk) FROM svl_query_metrics_summary
+     WHERE query IN (SELECT query FROM queries)),
+    (SELECT max(workmem) FROM svl_query_summary
+     WHERE query IN (SELECT query FROM queries)),
+    (SELECT count(*) FROM svl_query_summary
+     WHERE query IN (SELECT query FROM queries) AND is_diskbased = 't')
+"""
+
+
+def dbt(args: List[str], env: dict) -> None:
+    subprocess.run(
+        ["dbt"] + args + ["--profiles-dir", "config"],
+        cwd=PROJECT_DIR,
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def model_order(manifest: dict) -> List[dict]:
+    """Models under MODELS_PATH, every model after its upstream models."""
+    nodes = {
+        unique_id: node
+        for unique_id, node in manifest["nodes"].items()
+        if node["resource_type"] == "model"
+        and node["original_file_path"].startswith(MODELS_PATH)
+    }
+    ordered: List[dict] = []
+
+    def visit(unique_id: str) -> None:
+        node = nodes[unique_id]
+        if node in ordered:
+            return
+        for parent in node["depends_on"]["nodes"]:
+            if parent in nodes:
+                visit(parent)
+        ordered.append(node)
+
+    for unique_id in sorted(nodes):
+        visit(unique_id)
+    # Ephemeral models are only built inlined into their children
+    return [node for node in ordered if node["config"]["materialized"] != "ephemeral"]
+
+
+def execute_timing(result: dict) -> Dict[str, datetime]:
+    for timing in result["timing"]:
+        if timing["name"] == "execute":
+            return {
+                key: datetime.strptime(timing[key], "%Y-%m-%dT%H:%M:%S.%fZ")
+                for key in ("started_at", "completed_at")
+            }
+    raise ValueError(f"No execute timing for {result['unique_id']}")
+
+
+def plan_stats(plan: dict) -> Dict[str, float]:
+    """Scan and memory statistics of an EXPLAIN (ANALYZE, BUFFERS, FORMAT
+    JSON) plan. Buffer counts of the root node include its children."""
+    stats = {"rows_scanned": 0, "peak_memory_kb": 0, "spilled": False}
+
+    def visit(node: dict) -> None:
+        if node["Node Type"].endswith("Scan"):
+            stats["rows_scanned"] += node["Actual Loops"] * (
+                node["Actual Rows"] + node.get("Rows Removed by Filter", 0)
+            )
+        memory = node.get("Peak Memory Usage", 0)
+        if node.get("Sort Space Type") == "Memory":
+            memory = node["Sort Space Used"]
+        elif node.get("Sort Space Type") == "Disk":
+            stats["spilled"] = True
+        stats["peak_memory_kb"] = max(stats["peak_memory_kb"], memory)
+        for child in node.get("Plans", []):
+            visit(child)
+
+    root = plan["Plan"]
+    visit(root)
+    blocks = root.get("Shared Hit Blocks", 0) + root.get("Shared Read Blocks", 0)
+    temp_blocks = root.get("Temp Written Blocks", 0)
+    stats["scanned_mb"] = blocks * 8192 / 1e6
+    stats["temp_mb"] = temp_blocks * 8192 / 1e6
+    stats["spilled"] = stats["spilled"] or temp_blocks > 0
+    return stats
+
+
+def postgres_stats(cursor, node: dict) -> Dict[str, float]:
+    path = os.path.join(
+        PROJECT_DIR,
+        "target",
+        "compiled",
+        node["package_name"],
+        node["original_file_path"],
+    )
+    with open(path) as f:
+        sql = f.read()
+    cursor.execute("BEGIN")
+    try:
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}")
+        plan = cursor.fetchone()[0]
+    finally:
+        cursor.execute("ROLLBACK")
+    return plan_stats(plan[0] if isinstance(plan, list) else json.loads(plan)[0])
+
+
+def redshift_stats(cursor, node: dict, timing: Dict[str, datetime]) -> Dict[str, float]:
+    cursor.execute(
+        REDSHIFT_STATS_SQL,
+        (timing["started_at"], timing["completed_at"], f"%{node['alias']}%"),
+    )
+    rows, blocks, temp_blocks, workmem, diskbased = cursor.fetchone()
+    # Redshift blocks are 1 MB
+    return {
+        "rows_scanned": rows or 0,
+        "scanned_mb": blocks or 0,
+        "temp_mb": temp_blocks or 0,
+        "peak_memory_kb": (workmem or 0) / 1024,
+        "spilled": bool(diskbased),
+    }
+
+
+def benchmark_scale_factor(
+    conn,
+    redshift: bool,
+    scale_factor: float,
+    target: str,
+    env: dict,
+    repeat: int,
+    load_args: dict,
+) -> List[dict]:
+    schema = f"tickit_sf{scale_factor:g}".replace(".", "_")
+    if load_args is not None:
+        for table, loaded in tickit_data.load(
+            conn, scale_factor, schema=schema, **load_args
+        ).items():
+            print(f"{schema}.{table}: {loaded['rows']} rows", file=sys.stderr)
+    run_args = ["--target", target, "--vars", json.dumps({"tickit_schema": schema})]
+    dbt(["run", "--full-refresh"] + run_args, env)
+    with open(os.path.join(PROJECT_DIR, "target", "manifest.json")) as f:
+        manifest = json.load(f)
+
+    results = []
+    for node in model_order(manifest):
+        latencies = []
+        for _ in range(repeat):
+            dbt(
+                ["run", "--full-refresh", "-m", f"path:{node['original_file_path']}"]
+                + run_args,
+                env,
+            )
+            with open(os.path.join(PROJECT_DIR, "target", "run_results.json")) as f:
+                result = json.load(f)["results"][0]
+            timing = execute_timing(result)
+            latencies.append(
+                (timing["completed_at"] - timing["started_at"]).total_seconds()
+            )
+        with conn.cursor() as cursor:
+            if redshift:
+                stats = redshift_stats(cursor, node, timing)
+            else:
+                stats = postgres_stats(cursor, node)
+        results.append(
+            {
+                "scale_factor": scale_factor,
+                "model": node["name"],
+                "rows": result.get("adapter_response", {}).get("rows_affected"),
+                "p50_s": statistics.median(latencies),
+                "min_s": min(latencies),
+                **stats,
+            }
+        )
+    return results
+
+
+def print_results(results: List[dict]) -> None:
+    print(
+        f"{'sf':>6} {'model':<34} {'rows':>9} {'p50_s':>8} {'min_s':>8} "
+        f"{'scanned':>11} {'scan_mb':>9} {'temp_mb':>8} {'mem_kb':>9} {'spill':>5}"
+    )
+    for r in results:
+        print(
+            f"{r['scale_factor']:>6g} {r['model']:<34} {r['rows'] or 0:>9} "
+            f"{r['p50_s']:>8.3f} {r['min_s']:>8.3f} {r['rows_scanned']:>11.0f} "
+            f"{r['scanned_mb']:>9.1f} {r['temp_mb']:>8.1f} "
+            f"{r['peak_memory_kb']:>9.0f} {'yes' if r['spilled'] else 'no':>5}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", help="libpq connection string of a local stand-in")
+    parser.add_argument("--target", help="dbt target, `local` with --dsn, else `dev`")
+    parser.add_argument("--scale-factors", type=float, nargs="+", default=[0.1, 1])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--skip-load", action="store_true", help="reuse the tables already loaded"
+    )
+    parser.add_argument("--s3-uri", help="Redshift only: where to stage the CSVs")
+    parser.add_argument("--iam-role", help="Redshift only: role used by COPY")
+    parser.add_argument("--output", help="save the results as JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.dsn:
+        # The local target of the profile reads the DBT_LOCAL_* variables
+        dsn = parse_dsn(args.dsn)
+        for key, variable in (
+            ("host", "DBT_LOCAL_HOST"),
+            ("user", "DBT_LOCAL_USER"),
+            ("password", "DBT_LOCAL_PASSWORD"),
+            ("dbname", "DBT_LOCAL_DBNAME"),
+        ):
+            if key in dsn:
+                env[variable] = dsn[key]
+    target = args.target or ("local" if args.dsn else "dev")
+
+    conn = connect(args.dsn)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT version()")
+        redshift = "Redshift" in cursor.fetchone()[0]
+    load_args = None
+    if not args.skip_load:
+        load_args = {
+            "seed": args.seed,
+            "s3_uri": args.s3_uri,
+            "iam_role": args.iam_role,
+        }
+    results = []
+    try:
+        for scale_factor in args.scale_factors:
+            results += benchmark_scale_factor(
+                conn, redshift, scale_factor, target, env, args.repeat, load_args
+            )
+    finally:
+        conn.close()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,110 @@
+"""Compare the exact and approximate modes of percentile_sales_model.
+
+For every data size, loads a synthetic gross sales table and runs both
+top-0.1% queries, reporting their latency and how well the approximate
+result matches the exact one.
+
+    $ python benchmarks/percentile_modes.py --sizes 10000 100000 1000000
+
+Connects to Redshift with the REDSHIFT_* variables used by the dbt profile,
+or to a local Postgres stand-in with --dsn.
+"""
+import argparse
+import os
+import random
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+TABLE = "bench_gross_sales"
+
+EXACT_SQL = f"""
+SELECT eventid FROM (
+    SELECT eventid, ntile(1000) over(order by total_price desc) as percentile
+    FROM {TABLE}
+) q
+WHERE percentile = 1
+"""
+
+APPROXIMATE_SQL = """
+SELECT eventid
+FROM {table}
+WHERE total_price >= (
+    SELECT {aggregate} percentile_disc(0.999) WITHIN GROUP (ORDER BY total_price)
+    FROM {table}
+)
+"""
+
+
+def connect(dsn):
+    if dsn:
+        return psycopg2.connect(dsn)
+    return psycopg2.connect(
+        host=os.environ["REDSHIFT_HOST"],
+        port=int(os.environ.get("REDSHIFT_PORT", "5439")),
+        user=os.environ["REDSHIFT_USER"],
+        password=os.environ["REDSHIFT_PASSWORD"],
+        dbname=os.environ.get("REDSHIFT_DBNAME", "redshift-db"),
+    )
+
+
+def load(cursor, size, seed):
+    # Heavy-tailed totals, like gross sales per event
+    rng = random.Random(seed)
+    rows = [(i, round(rng.lognormvariate(6, 1.5), 2)) for i in range(size)]
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    cursor.execute(
+        f"CREATE TABLE {TABLE} (eventid INTEGER, total_price DECIMAL(18, 2))"
+    )
+    execute_values(cursor, f"INSERT INTO {TABLE} VALUES %s", rows, page_size=10000)
+    cursor.execute(f"ANALYZE {TABLE}")
+
+
+def timed(cursor, sql, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cursor.execute(sql)
+        rows = cursor.fetchall()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, {row[0] for row in rows}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", help="libpq connection string of a local stand-in")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    conn = connect(args.dsn)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("SELECT version()")
+    redshift = "Redshift" in cursor.fetchone()[0]
+    approximate_sql = APPROXIMATE_SQL.format(
+        table=TABLE, aggregate="APPROXIMATE" if redshift else ""
+    )
+
+    print(
+        f"{'rows':>10} {'exact_s':>9} {'approx_s':>9} {'speedup':>8} "
+        f"{'exact_n':>8} {'approx_n':>8} {'recall':>7} {'precision':>9}"
+    )
+    for size in args.sizes:
+        load(cursor, size, args.seed)
+        exact_time, exact = timed(cursor, EXACT_SQL, args.repeat)
+        approx_time, approx = timed(cursor, approximate_sql, args.repeat)
+        hits = len(exact & approx)
+        print(
+            f"{size:>10} {exact_time:>9.3f} {approx_time:>9.3f} "
+            f"{exact_time / approx_time:>8.2f} {len(exact):>8} {len(approx):>8} "
+            f"{hits / len(exact) if exact else 1:>7.3f} "
+            f"{hits / len(approx) if approx else 1:>9.3f}"
+        )
+
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
@@ -0,0 +1,360 @@
+"""Generate the TICKIT sales, users and event tables at a scale factor.
+
+Scale factor 1 has the row counts of the Redshift TICKIT sample (49,990
+users, 8,798 events, 172,456 sales). Popular events and frequent buyers
+are skewed: sales draw eventid and buyerid from Zipf distributions over
+shuffled ids (--event-skew and --buyer-skew are their exponents, 0 is
+uniform). The same scale factor and seed always give the same rows, and
+the sha256 of every table is printed to check it.
+
+    $ python benchmarks/tickit_data.py --dsn "host=localhost user=postgres" --scale-factor 1
+
+bulk loads them with COPY into a local Postgres stand-in. Without --dsn the
+tables go to Redshift (REDSHIFT_* variables of the dbt profile), copied
+from gzipped CSV parts uploaded under --s3-uri, with --iam-role:
+
+    $ python benchmarks/tickit_data.py --scale-factor 10 \\
+        --s3-uri s3://my-bucket/tickit --iam-role arn:aws:iam::123456789012:role/redshift-copy
+"""
+import argparse
+import bisect
+import csv
+import gzip
+import hashlib
+import io
+import itertools
+import math
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import boto3
+
+from percentile_modes import connect
+
+# Row counts of the TICKIT sample at scale factor 1
+BASE_ROWS = {"users": 49990, "event": 8798, "sales": 172456}
+LISTINGS = 192497
+VENUES = 202
+CATEGORIES = 11
+# Dates of the sample, dateid 1827 is 2008-01-01
+FIRST_DATEID, LAST_DATEID = 1827, 2191
+FIRST_DATE = datetime(2008, 1, 1)
+
+# Column definitions of the TICKIT sample, distribution and sort keys are
+# only used on Redshift
+TABLES = {
+    "users": [
+        ("userid", "INTEGER NOT NULL", "DISTKEY SORTKEY"),
+        ("username", "CHAR(8)", ""),
+        ("firstname", "VARCHAR(30)", ""),
+        ("lastname", "VARCHAR(30)", ""),
+        ("city", "VARCHAR(30)", ""),
+        ("state", "CHAR(2)", ""),
+        ("email", "VARCHAR(100)", ""),
+        ("phone", "CHAR(14)", ""),
+    ]
+    + [
+        (f"like{genre}", "BOOLEAN", "")
+        for genre in (
+            "sports",
+            "theatre",
+            "concerts",
+            "jazz",
+            "classical",
+            "opera",
+            "rock",
+            "vegas",
+            "broadway",
+            "musicals",
+        )
+    ],
+    "event": [
+        ("eventid", "INTEGER NOT NULL", "DISTKEY"),
+        ("venueid", "SMALLINT NOT NULL", ""),
+        ("catid", "SMALLINT NOT NULL", ""),
+        ("dateid", "SMALLINT NOT NULL", "SORTKEY"),
+        ("eventname", "VARCHAR(200)", ""),
+        ("starttime", "TIMESTAMP", ""),
+    ],
+    "sales": [
+        ("salesid", "INTEGER NOT NULL", ""),
+        ("listid", "INTEGER NOT NULL", "DISTKEY"),
+        ("sellerid", "INTEGER NOT NULL", ""),
+        ("buyerid", "INTEGER NOT NULL", ""),
+        ("eventid", "INTEGER NOT NULL", ""),
+        ("dateid", "SMALLINT NOT NULL", "SORTKEY"),
+        ("qtysold", "SMALLINT NOT NULL", ""),
+        ("pricepaid", "DECIMAL(8, 2)", ""),
+        ("commission", "DECIMAL(8, 2)", ""),
+        ("saletime", "TIMESTAMP", ""),
+    ],
+}
+
+# fmt: off
+FIRST_NAMES = [
+    "Aaron", "Barry", "Cathy", "Dana", "Elijah", "Fiona", "Gil", "Hana",
+    "Ivor", "Jada", "Kato", "Lara", "Maya", "Nero", "Olga", "Pavel",
+    "Quinn", "Rafa", "Sade", "Tobias", "Uma", "Vera", "Wing", "Xena",
+    "Yael", "Zane",
+]
+LAST_NAMES = [
+    "Abbott", "Bishop", "Coleman", "Durham", "Ellis", "Franco", "Garner",
+    "Hodges", "Ingram", "Jensen", "Kirby", "Lowery", "Mercer", "Nolan",
+    "Ortega", "Pruitt", "Quincy", "Rowe", "Sutton", "Tate", "Underwood",
+    "Vance", "Walsh", "Yates",
+]
+CITIES = [
+    ("Seattle", "WA"), ("Portland", "OR"), ("San Jose", "CA"),
+    ("Phoenix", "AZ"), ("Denver", "CO"), ("Austin", "TX"),
+    ("Chicago", "IL"), ("Nashville", "TN"), ("Atlanta", "GA"),
+    ("Boston", "MA"), ("New York", "NY"), ("Miami", "FL"),
+]
+EVENT_WORDS = [
+    "Macbeth", "Tosca", "Wicked", "Hamlet", "Carmen", "Cats", "Rent",
+    "Aida", "Grease", "Mamma Mia!", "Jersey Boys", "The Lion King",
+    "Radiohead", "Coldplay", "Beck", "Bjork", "Fall Out Boy", "Linkin Park",
+]
+# fmt: on
+
+
+class Zipf:
+    """Draws ids 1..n, the id of rank r with a weight of 1 / r**s. Ranks
+    are shuffled, so popular ids are spread over the id range."""
+
+    def __init__(self, n: int, s: float, rng: random.Random) -> None:
+        self.ids = list(range(1, n + 1))
+        rng.shuffle(self.ids)
+        self.cumulative = list(
+            itertools.accumulate(1 / rank**s for rank in range(1, n + 1))
+        )
+
+    def sample(self, rng: random.Random) -> int:
+        index = bisect.bisect(self.cumulative, rng.random() * self.cumulative[-1])
+        return self.ids[min(index, len(self.ids) - 1)]
+
+
+def table_rows(scale_factor: float) -> Dict[str, int]:
+    return {
+        table: max(1, round(rows * scale_factor)) for table, rows in BASE_ROWS.items()
+    }
+
+
+def users(rng: random.Random, count: int) -> Iterator[tuple]:
+    for userid in range(1, count + 1):
+        firstname, lastname = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        city, state = rng.choice(CITIES)
+        yield (
+            userid,
+            "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(8)),
+            firstname,
+            lastname,
+            city,
+            state,
+            f"{firstname}.{lastname}{userid}@example.com".lower(),
+            f"({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(0, 9999):04d}",
+            # likesports to likemusicals, some left unanswered
+            *(rng.choice((True, False, None)) for _ in range(10)),
+        )
+
+
+def events(rng: random.Random, count: int) -> Iterator[tuple]:
+    for eventid in range(1, count + 1):
+        dateid = rng.randint(FIRST_DATEID, LAST_DATEID)
+        start = FIRST_DATE + timedelta(
+            days=dateid - FIRST_DATEID, hours=rng.choice((14, 15, 19, 20))
+        )
+        yield (
+            eventid,
+            rng.randint(1, VENUES),
+            rng.randint(1, CATEGORIES),
+            dateid,
+            rng.choice(EVENT_WORDS),
+            start,
+        )
+
+
+def sales(
+    rng: random.Random,
+    count: int,
+    rows: Dict[str, int],
+    event_skew: float,
+    buyer_skew: float,
+) -> Iterator[tuple]:
+    event_ids = Zipf(rows["event"], event_skew, rng)
+    buyer_ids = Zipf(rows["users"], buyer_skew, rng)
+    listings = max(1, round(LISTINGS * rows["sales"] / BASE_ROWS["sales"]))
+    for salesid in range(1, count + 1):
+        qtysold = min(8, 1 + int(rng.expovariate(0.8)))
+        pricepaid = round(qtysold * rng.lognormvariate(4.5, 0.8), 2)
+        dateid = rng.randint(FIRST_DATEID, LAST_DATEID)
+        yield (
+            salesid,
+            rng.randint(1, listings),
+            rng.randint(1, rows["users"]),
+            buyer_ids.sample(rng),
+            event_ids.sample(rng),
+            dateid,
+            qtysold,
+            f"{pricepaid:.2f}",
+            f"{pricepaid * 0.15:.2f}",
+            FIRST_DATE
+            + timedelta(days=dateid - FIRST_DATEID, seconds=rng.randrange(86400)),
+        )
+
+
+def generate(
+    scale_factor: float, seed: int, event_skew: float, buyer_skew: float
+) -> Dict[str, Iterator[tuple]]:
+    """Return the rows of every table. Each table has its own random
+    generator, so tables can be generated in any order."""
+    rows = table_rows(scale_factor)
+
+    def rng(table: str) -> random.Random:
+        return random.Random(f"{seed}:{table}")
+
+    return {
+        "users": users(rng("users"), rows["users"]),
+        "event": events(rng("event"), rows["event"]),
+        "sales": sales(rng("sales"), rows["sales"], rows, event_skew, buyer_skew),
+    }
+
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        # Same text on Postgres and Redshift
+        return value.isoformat(sep=" ")
+    return value
+
+
+def csv_line(row: tuple) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(map(csv_value, row))
+    return buffer.getvalue()
+
+
+def write_parts(
+    rows: Iterator[tuple], count: int, directory: str, parts: int
+) -> Tuple[List[str], str]:
+    """Write the rows to `parts` gzipped CSV files, returning their paths
+    and the sha256 of the whole CSV text."""
+    digest = hashlib.sha256()
+    per_part = math.ceil(count / parts)
+    paths = []
+    for part in range(parts):
+        path = os.path.join(directory, f"part-{part:04d}.csv.gz")
+        with gzip.open(path, "wt", compresslevel=1) as f:
+            for row in itertools.islice(rows, per_part):
+                line = csv_line(row)
+                digest.update(line.encode())
+                f.write(line)
+        paths.append(path)
+    return paths, digest.hexdigest()
+
+
+def create_table(cursor, schema: str, table: str, redshift: bool) -> None:
+    columns = ",\n    ".join(
+        f"{name} {definition} {keys if redshift else ''}".rstrip()
+        for name, definition, keys in TABLES[table]
+    )
+    cursor.execute(f"DROP TABLE IF EXISTS {schema}.{table}")
+    cursor.execute(f"CREATE TABLE {schema}.{table} (\n    {columns}\n)")
+
+
+def load(
+    conn,
+    scale_factor: float,
+    seed: int = 42,
+    schema: str = "public",
+    event_skew: float = 1.1,
+    buyer_skew: float = 0.7,
+    s3_uri: Optional[str] = None,
+    iam_role: Optional[str] = None,
+    parts: int = 1,
+) -> Dict[str, dict]:
+    """Generate and bulk load the three tables, returning their row counts
+    and checksums."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT version()")
+        redshift = "Redshift" in cursor.fetchone()[0]
+    if redshift and not (s3_uri and iam_role):
+        raise ValueError("Loading into Redshift needs --s3-uri and --iam-role")
+
+    rows = table_rows(scale_factor)
+    loaded = {}
+    with conn.cursor() as cursor, tempfile.TemporaryDirectory() as directory:
+        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+        tables = generate(scale_factor, seed, event_skew, buyer_skew)
+        for table, table_data in tables.items():
+            table_dir = os.path.join(directory, table)
+            os.makedirs(table_dir)
+            paths, checksum = write_parts(
+                table_data, rows[table], table_dir, parts if redshift else 1
+            )
+            create_table(cursor, schema, table, redshift)
+            if redshift:
+                prefix = f"{s3_uri.rstrip('/')}/sf{scale_factor:g}-seed{seed}/{table}/"
+                upload(paths, prefix)
+                cursor.execute(
+                    f"COPY {schema}.{table} FROM %s IAM_ROLE %s CSV GZIP"
+                    " TIMEFORMAT 'auto' COMPUPDATE OFF STATUPDATE OFF",
+                    (prefix, iam_role),
+                )
+            else:
+                with gzip.open(paths[0], "rt") as f:
+                    cursor.copy_expert(
+                        f"COPY {schema}.{table} FROM STDIN WITH (FORMAT csv)", f
+                    )
+            cursor.execute(f"ANALYZE {schema}.{table}")
+            loaded[table] = {"rows": rows[table], "sha256": checksum}
+    return loaded
+
+
+def upload(paths: List[str], prefix: str) -> None:
+    bucket, _, key = prefix[len("s3://") :].partition("/")
+    s3 = boto3.client("s3")
+    for path in paths:
+        s3.upload_file(path, bucket, key + os.path.basename(path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", help="libpq connection string of a local stand-in")
+    parser.add_argument("--scale-factor", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--schema", default="public")
+    parser.add_argument("--event-skew", type=float, default=1.1)
+    parser.add_argument("--buyer-skew", type=float, default=0.7)
+    parser.add_argument("--s3-uri", help="Redshift only: where to stage the CSVs")
+    parser.add_argument("--iam-role", help="Redshift only: role used by COPY")
+    parser.add_argument(
+        "--parts", type=int, default=8, help="Redshift only: CSV files per table"
+    )
+    args = parser.parse_args()
+
+    conn = connect(args.dsn)
+    conn.autocommit = True
+    try:
+        loaded = load(
+            conn,
+            args.scale_factor,
+            args.seed,
+            args.schema,
+            args.event_skew,
+            args.buyer_skew,
+            args.s3_uri,
+            args.iam_role,
+            args.parts,
+        )
+    finally:
+        conn.close()
+    for table, result in loaded.items():
+        print(
+            f"{args.schema}.{table}: {result['rows']} rows, sha256 {result['sha256']}"
+        )
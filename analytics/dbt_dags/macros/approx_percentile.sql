@@ -0,0 +1,12 @@
+{#- Percentile aggregate that avoids a global sort where the database allows it -#}
+{% macro approx_percentile(column, fraction) %}
+    {{ return(adapter.dispatch('approx_percentile')(column, fraction)) }}
+{% endmacro %}
+
+{% macro default__approx_percentile(column, fraction) %}
+    percentile_disc({{ fraction }}) WITHIN GROUP (ORDER BY {{ column }})
+{% endmacro %}
+
+{% macro redshift__approx_percentile(column, fraction) %}
+    APPROXIMATE percentile_disc({{ fraction }}) WITHIN GROUP (ORDER BY {{ column }})
+{% endmacro %}
@@ -0,0 +1,118 @@
+{#-
+    Materialized view, created once and then only refreshed. Redshift
+    refreshes eligible aggregates incrementally. The md5 of the compiled SQL
+    is kept in the dbt_materialized_views table of the model's schema: when
+    the SQL changed, or with --full-refresh, the view is dropped and created
+    again. On Redshift, `dist`, `sort` and `backup` are passed to the DDL.
+-#}
+{% materialization materialized_view, default %}
+  {%- set target_relation = this.incorporate(type='materializedview') -%}
+  {%- set old_relation = adapter.get_relation(database=database, schema=schema, identifier=this.identifier) -%}
+  {%- set definitions = api.Relation.create(database=database, schema=schema, identifier='dbt_materialized_views', type='table') -%}
+
+  {{ run_hooks(pre_hooks, inside_transaction=False) }}
+
+  -- `BEGIN` happens here:
+  {{ run_hooks(pre_hooks, inside_transaction=True) }}
+
+  {% call statement('materialized_view_definitions') -%}
+    CREATE TABLE IF NOT EXISTS {{ definitions }} (
+        relation varchar(512),
+        sql_md5 char(32),
+        created_at timestamp
+    )
+  {%- endcall %}
+
+  {%- set exists = materialized_view_exists(target_relation) -%}
+  {%- set current = exists and materialized_view_matches(target_relation, definitions, sql) -%}
+
+  {% if current and not flags.FULL_REFRESH %}
+    {% call statement('main') -%}
+      {{ refresh_materialized_view(target_relation) }}
+    {%- endcall %}
+  {% else %}
+    {% if exists %}
+      {{ log("Recreating " ~ target_relation ~ (", full refresh" if flags.FULL_REFRESH else ", its SQL changed")) }}
+      {% call statement('drop_materialized_view') -%}
+        DROP MATERIALIZED VIEW IF EXISTS {{ target_relation }} CASCADE
+      {%- endcall %}
+    {% elif old_relation is not none %}
+      {{ adapter.drop_relation(old_relation) }}
+    {% endif %}
+    {% call statement('main') -%}
+      {{ create_materialized_view_as(target_relation, sql) }}
+    {%- endcall %}
+    {% call statement('record_materialized_view') -%}
+      DELETE FROM {{ definitions }} WHERE relation = '{{ target_relation }}';
+      INSERT INTO {{ definitions }} VALUES ('{{ target_relation }}', {{ sql_md5(sql) }}, {{ current_timestamp() }})
+    {%- endcall %}
+  {% endif %}
+
+  {{ run_hooks(post_hooks, inside_transaction=True) }}
+
+  {% do persist_docs(target_relation, model) %}
+
+  -- `COMMIT` happens here
+  {{ adapter.commit() }}
+
+  {{ run_hooks(post_hooks, inside_transaction=False) }}
+
+  {{ return({'relations': [target_relation]}) }}
+{% endmaterialization %}
+
+{% macro sql_md5(sql) -%}
+    md5('{{ sql | replace("'", "''") }}')
+{%- endmacro %}
+
+{% macro materialized_view_matches(relation, definitions, sql) %}
+    {%- set query -%}
+        SELECT count(*) FROM {{ definitions }}
+        WHERE relation = '{{ relation }}' AND sql_md5 = {{ sql_md5(sql) }}
+    {%- endset -%}
+    {{ return(run_query(query).columns[0].values()[0] > 0) }}
+{% endmacro %}
+
+{% macro materialized_view_exists(relation) %}
+    {{ return(adapter.dispatch('materialized_view_exists')(relation)) }}
+{% endmacro %}
+
+{% macro default__materialized_view_exists(relation) %}
+    {%- set query -%}
+        SELECT count(*) FROM pg_matviews
+        WHERE schemaname = '{{ relation.schema }}' AND matviewname = '{{ relation.identifier }}'
+    {%- endset -%}
+    {{ return(run_query(query).columns[0].values()[0] > 0) }}
+{% endmacro %}
+
+{% macro redshift__materialized_view_exists(relation) %}
+    {%- set query -%}
+        SELECT count(*) FROM stv_mv_info
+        WHERE db_name = '{{ relation.database }}' AND schema = '{{ relation.schema }}'
+        AND name = '{{ relation.identifier }}'
+    {%- endset -%}
+    {{ return(run_query(query).columns[0].values()[0] > 0) }}
+{% endmacro %}
+
+{% macro create_materialized_view_as(relation, sql) %}
+    {{ return(adapter.dispatch('create_materialized_view_as')(relation, sql)) }}
+{% endmacro %}
+
+{% macro default__create_materialized_view_as(relation, sql) %}
+    CREATE MATERIALIZED VIEW {{ relation }} AS
+    {{ sql }}
+{% endmacro %}
+
+{% macro redshift__create_materialized_view_as(relation, sql) %}
+    {%- set dist = config.get('dist') -%}
+    {%- set sort = config.get('sort') -%}
+    CREATE MATERIALIZED VIEW {{ relation }}
+    {% if not config.get('backup', true) %}BACKUP NO{% endif %}
+    {% if dist in ('all', 'even', 'auto') %}DISTSTYLE {{ dist }}{% elif dist %}DISTKEY ({{ dist }}){% endif %}
+    {% if sort %}SORTKEY ({{ sort if sort is string else sort | join(', ') }}){% endif %}
+    AS
+    {{ sql }}
+{% endmacro %}
+
+{% macro refresh_materialized_view(relation) %}
+    REFRESH MATERIALIZED VIEW {{ relation }}
+{% endmacro %}
@@ -0,0 +1,18 @@
+{% macro upstream_changed(upstream) %}
+    {#-
+        True when `upstream` was updated since the current incremental model
+        was last built, comparing their dbt_updated_at watermarks.
+    -#}
+    {%- if not execute or not is_incremental() -%}
+        {{ return(true) }}
+    {%- endif -%}
+
+    {%- set query -%}
+        SELECT count(*)
+        FROM {{ upstream }}
+        WHERE dbt_updated_at > (
+            SELECT coalesce(max(dbt_updated_at), '1970-01-01'::timestamp) FROM {{ this }}
+        )
+    {%- endset -%}
+    {{ return(run_query(query).columns[0].values()[0] > 0) }}
+{% endmacro %}
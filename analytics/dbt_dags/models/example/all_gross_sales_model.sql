@@ -1,9 +1,34 @@
 /*
     All time gross sales.
+
+    Incremental runs re-aggregate only the events with sales past the
+    saletime/salesid watermark and replace them (delete+insert on eventid).
+
+    dist and sort only apply when the table is created: after changing them,
+    rebuild the model once with --full-refresh (see the README).
 */
 
-{{ config(materialized='table') }}
+{{ config(
+    materialized='incremental' if var('gross_sales_incremental', true) else 'table',
+    unique_key='eventid',
+    dist='eventid',
+    sort='eventid'
+) }}
+
+{% if is_incremental() %}
+WITH changed_events AS (
+    SELECT DISTINCT eventid
+    FROM {{ source('tickit', 'sales') }}
+    WHERE saletime > (SELECT max(last_saletime) FROM {{ this }})
+    OR salesid > (SELECT max(last_salesid) FROM {{ this }})
+)
+{% endif %}
 
-SELECT eventid, sum(pricepaid) total_price
-FROM sales
+SELECT eventid, sum(pricepaid) total_price,
+    max(saletime) last_saletime, max(salesid) last_salesid,
+    '{{ run_started_at.strftime("%Y-%m-%d %H:%M:%S") }}'::timestamp dbt_updated_at
+FROM {{ source('tickit', 'sales') }}
+{% if is_incremental() %}
+WHERE eventid IN (SELECT eventid FROM changed_events)
+{% endif %}
 GROUP BY eventid
@@ -0,0 +1,12 @@
+/*
+    Quantity bought by every buyer.
+
+    A materialized view: created once, then refreshed, incrementally on
+    Redshift since it only aggregates one table with sum and count.
+*/
+
+{{ config(materialized='materialized_view', dist='buyerid', sort='buyerid') }}
+
+SELECT buyerid, sum(qtysold) total_quantity, count(*) sales
+FROM {{ source('tickit', 'sales') }}
+GROUP BY buyerid
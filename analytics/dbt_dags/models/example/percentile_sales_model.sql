@@ -1,8 +1,41 @@
 /*
     Get percentiles of all time gross sales.
+
+    Only recomputed when all_gross_sales_model changed since the last build.
+    With the `percentile_mode` var set to 'approximate', only the top 0.1%
+    bucket (percentile = 1) is computed, from an approximate percentile
+    threshold instead of a window over all events. Switching the mode alone
+    does not recompute the model: run it and its descendants once with
+    --full-refresh (see the README).
+
+    dist and sort only apply when the table is created: after changing them,
+    rebuild the model once with --full-refresh (see the README).
 */
 
-{{ config(materialized='table') }}
+{{ config(
+    materialized='incremental',
+    dist='eventid',
+    sort='percentile',
+    pre_hook="{% if is_incremental() and upstream_changed(ref('all_gross_sales_model')) %}DELETE FROM {{ this }}{% endif %}"
+) }}
 
-SELECT eventid, total_price, ntile(1000) over(order by total_price desc) as percentile 
-FROM {{ ref('all_gross_sales_model') }} 
+{% if not upstream_changed(ref('all_gross_sales_model')) %}
+SELECT eventid, total_price, percentile, dbt_updated_at
+FROM {{ this }}
+WHERE 1 = 0
+{% elif var('percentile_mode', 'exact') == 'approximate' %}
+WITH threshold AS (
+    SELECT {{ approx_percentile('total_price', 0.999) }} total_price,
+        max(dbt_updated_at) dbt_updated_at
+    FROM {{ ref('all_gross_sales_model') }}
+)
+SELECT eventid, g.total_price,
+    CASE WHEN g.total_price >= t.total_price THEN 1 END percentile,
+    t.dbt_updated_at
+FROM {{ ref('all_gross_sales_model') }} g
+CROSS JOIN threshold t
+{% else %}
+SELECT eventid, total_price, ntile(1000) over(order by total_price desc) as percentile,
+    (SELECT max(dbt_updated_at) FROM {{ ref('all_gross_sales_model') }}) dbt_updated_at
+FROM {{ ref('all_gross_sales_model') }}
+{% endif %}
@@ -2,9 +2,7 @@
     Get data on top 10 buyers by quantity.
 */
 
-{{ config(materialized='table') }}
-
 SELECT firstname, lastname, total_quantity 
-FROM {{ ref('top_buyers_by_quantity_model') }} q, users
+FROM {{ ref('top_buyers_by_quantity_model') }} q, {{ source('tickit', 'users') }}
 WHERE q.buyerid = userid
 ORDER BY q.total_quantity DESC
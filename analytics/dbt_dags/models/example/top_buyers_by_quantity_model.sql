@@ -2,10 +2,9 @@
     Find top 10 buyers by quantity.
 */
 
-{{ config(materialized='table') }}
+{{ config(dist='all', sort='buyerid') }}
 
-SELECT buyerid, sum(qtysold) total_quantity
-FROM sales
-GROUP BY buyerid
+SELECT buyerid, total_quantity
+FROM {{ ref('buyer_quantities_model') }}
 ORDER BY total_quantity DESC
 LIMIT 10
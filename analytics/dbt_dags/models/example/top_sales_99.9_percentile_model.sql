@@ -1,11 +1,22 @@
 /*
     Find events in 99.9 percentile
+
+    Only recomputed when percentile_sales_model changed since the last build.
 */
 
-{{ config(materialized='table') }}
+{{ config(
+    materialized='incremental',
+    pre_hook="{% if is_incremental() and upstream_changed(ref('percentile_sales_model')) %}DELETE FROM {{ this }}{% endif %}"
+) }}
 
-SELECT eventname, total_price 
-FROM {{ ref('percentile_sales_model') }} q, event e
+{% if upstream_changed(ref('percentile_sales_model')) %}
+SELECT eventname, total_price, q.dbt_updated_at
+FROM {{ ref('percentile_sales_model') }} q, {{ source('tickit', 'event') }} e
 WHERE q.eventid = e.eventid
 AND percentile = 1
 ORDER BY total_price DESC
+{% else %}
+SELECT eventname, total_price, dbt_updated_at
+FROM {{ this }}
+WHERE 1 = 0
+{% endif %}
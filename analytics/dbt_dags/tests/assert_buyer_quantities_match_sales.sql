@@ -0,0 +1,18 @@
+/*
+    The refreshed materialized view must match the current sales.
+    Any returned row is a mismatch: run `dbt run --full-refresh` to repair.
+*/
+
+WITH current_sales AS (
+    SELECT buyerid, sum(qtysold) total_quantity, count(*) sales
+    FROM {{ source('tickit', 'sales') }}
+    GROUP BY buyerid
+)
+
+SELECT coalesce(c.buyerid, m.buyerid) buyerid, c.total_quantity expected, m.total_quantity actual
+FROM current_sales c
+FULL OUTER JOIN {{ ref('buyer_quantities_model') }} m ON c.buyerid = m.buyerid
+WHERE c.buyerid IS NULL
+OR m.buyerid IS NULL
+OR c.total_quantity <> m.total_quantity
+OR c.sales <> m.sales
@@ -0,0 +1,17 @@
+/*
+    The incrementally maintained aggregate must match a full rebuild.
+    Any returned row is a mismatch: run `dbt run --full-refresh` to repair.
+*/
+
+WITH full_rebuild AS (
+    SELECT eventid, sum(pricepaid) total_price
+    FROM {{ source('tickit', 'sales') }}
+    GROUP BY eventid
+)
+
+SELECT coalesce(f.eventid, m.eventid) eventid, f.total_price expected, m.total_price actual
+FROM full_rebuild f
+FULL OUTER JOIN {{ ref('all_gross_sales_model') }} m ON f.eventid = m.eventid
+WHERE f.eventid IS NULL
+OR m.eventid IS NULL
+OR f.total_price <> m.total_price
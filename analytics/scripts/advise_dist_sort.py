@@ -0,0 +1,462 @@
+"""Recommend Redshift DISTKEY and SORTKEY configs for the dbt models.
+
+    $ python scripts/advise_dist_sort.py dbt_dags/target --explain scripts/fixtures/explain
+
+Reads the joins, GROUP BY and filters of every model from its compiled SQL
+(dbt compile --full-refresh), and the join steps of its plan from EXPLAIN
+output: recorded files named <model>.txt in --explain, or EXPLAIN run on
+the cluster (REDSHIFT_* variables, or --dsn) and saved with --record DIR.
+
+A table, incremental or materialized view model is distributed on the
+column its consumers join it on, then on the column they group it by,
+then on its own GROUP BY key. A model joined by its consumers and that
+EXPLAIN estimates under --all-max-rows rows is copied to every node
+(DISTSTYLE ALL) instead. It is sorted on the columns its consumers filter
+it on, or else on the column it would be distributed on. For every join with a
+redistribution step (DS_DIST_INNER, DS_DIST_OUTER, DS_DIST_BOTH,
+DS_BCAST_INNER), prints the step expected once the recommendations are
+applied.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from lint_sql import (
+    Group,
+    Item,
+    Token,
+    clauses,
+    is_word,
+    nest,
+    operand,
+    split,
+    tokenize,
+)
+
+NODE_RE = re.compile(
+    r"^(?P<indent>\s*)(?:->\s+)?XN (?P<node>.+?)\s+"
+    r"\(cost=[\d.]+\.\.[\d.]+ rows=(?P<rows>\d+) width=\d+\)$"
+)
+SCAN_RE = re.compile(r"Scan on (\S+)")
+COND_RE = re.compile(r'"outer"\.(\w+) = "inner"\.(\w+)')
+FILTER_RE = re.compile(r"(?<![\w.\"'])([a-z_]\w*)\s*(?:=|<>|!=|<=|>=|<|>)")
+REDISTRIBUTIONS = {"DS_DIST_INNER", "DS_DIST_OUTER", "DS_DIST_BOTH", "DS_BCAST_INNER"}
+CLAUSE_WORDS = {"ON", "USING", "WHERE", "GROUP", "ORDER", "LIMIT", "HAVING"}
+COMPARISONS = {"=", "<", ">", "<=", ">=", "<>", "!=", "BETWEEN", "IN"}
+BUILT = {"table", "incremental", "materialized_view"}
+
+# (relation, column), the relation being a model or source name
+Column = Tuple[Optional[str], str]
+
+
+class PlanNode(NamedTuple):
+    node: str
+    rows: int
+    details: List[str]
+    children: list
+
+
+class JoinStep(NamedTuple):
+    strategy: str
+    outer: Column
+    inner: Column
+
+
+def relation_name(text: str) -> str:
+    """Model or table name of a relation: the identifier of a (quoted)
+    relation name, of a dbt CTE, or of the table behind a materialized
+    view."""
+    name = text.split(".")[-1].strip('"').lower()
+    name = re.sub(r"^__dbt__cte__", "", name)
+    return re.sub(r"^mv_tbl__(.+)__\d+$", r"\1", name)
+
+
+def parse_plan(text: str) -> Optional[PlanNode]:
+    """The tree of an EXPLAIN output."""
+    root = None
+    stack: List[Tuple[int, PlanNode]] = []
+    for line in text.splitlines():
+        match = NODE_RE.match(line)
+        if not match:
+            if stack and line.strip():
+                stack[-1][1].details.append(line.strip())
+            continue
+        indent = len(match.group("indent"))
+        node = PlanNode(match.group("node"), int(match.group("rows")), [], [])
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+        if stack:
+            stack[-1][1].children.append(node)
+        else:
+            root = node
+        stack.append((indent, node))
+    return root
+
+
+def scans(node: PlanNode) -> Dict[str, int]:
+    """Rows estimated for every relation scanned under node."""
+    found = {}
+    match = SCAN_RE.search(node.node)
+    if match:
+        found[relation_name(match.group(1))] = node.rows
+    for child in node.children:
+        found.update(scans(child))
+    return found
+
+
+def scan_filters(node: PlanNode) -> List[Column]:
+    """Columns compared in the filters of the scans under node."""
+    found = []
+    match = SCAN_RE.search(node.node)
+    for detail in node.details if match else []:
+        if detail.startswith("Filter:"):
+            relation = relation_name(match.group(1))
+            found += [(relation, column) for column in FILTER_RE.findall(detail)]
+    for child in node.children:
+        found += scan_filters(child)
+    return found
+
+
+def join_steps(node: PlanNode) -> List[JoinStep]:
+    steps = []
+    words = node.node.split()
+    strategy = words[-1] if words[-1].startswith("DS_") else None
+    if strategy and len(node.children) == 2:
+        cond = next(
+            (m for m in map(COND_RE.search, node.details) if m is not None), None
+        )
+        if cond:
+            outer = scans(node.children[0])
+            inner = scans(node.children[1])
+            if len(outer) == 1 and len(inner) == 1:
+                steps.append(
+                    JoinStep(
+                        strategy,
+                        (next(iter(outer)), cond.group(1)),
+                        (next(iter(inner)), cond.group(2)),
+                    )
+                )
+    for child in node.children:
+        steps += join_steps(child)
+    return steps
+
+
+def column_ref(items: List[Item], index: int, step: int) -> Optional[List[str]]:
+    found = operand(items, index, step)
+    if not found:
+        return None
+    names = [token.text.strip('"').lower() for token in found if token.text != "."]
+    return names[::-1] if step < 0 else names
+
+
+class Usage:
+    """Joins, GROUP BY and filter columns of one model's SQL."""
+
+    def __init__(self) -> None:
+        self.joins: List[Tuple[Column, Column]] = []
+        self.groups: List[Column] = []
+        self.filters: List[Column] = []
+
+    def add_level(self, items: List[Item]) -> None:
+        parts = list(clauses(items))
+        aliases: Dict[str, str] = {}
+        conditions: List[List[Item]] = []
+        for keyword, clause in parts:
+            if keyword == "FROM":
+                for segment in split(clause, ","):
+                    aliases.update(self._relations(segment, conditions))
+            elif keyword == "WHERE":
+                conditions.append(clause)
+        relations = sorted(set(aliases.values()))
+
+        def resolve(names: Optional[List[str]], other: Optional[str] = None):
+            if not names:
+                return None
+            if len(names) > 1:
+                return aliases.get(names[-2], names[-2]), names[-1]
+            if len(relations) == 1:
+                return relations[0], names[0]
+            rest = [relation for relation in relations if relation != other]
+            return (rest[0] if len(rest) == 1 else None), names[0]
+
+        for condition in conditions:
+            for index, item in enumerate(condition):
+                if not isinstance(item, Token):
+                    continue
+                if item.text not in COMPARISONS and not is_word(item, *COMPARISONS):
+                    continue
+                left = column_ref(condition, index, -1)
+                right = column_ref(condition, index, 1)
+                if left and right and item.text == "=":
+                    first = resolve(left) if len(left) > 1 else None
+                    second = resolve(right, first[0] if first else None)
+                    first = first or resolve(left, second[0] if second else None)
+                    if first and second and first[0] != second[0]:
+                        self.joins.append((first, second))
+                elif left:
+                    column = resolve(left)
+                    if column[0]:
+                        self.filters.append(column)
+        for keyword, clause in parts:
+            if keyword == "GROUP":
+                for expression in split(clause[1:], ","):
+                    if all(isinstance(item, Token) for item in expression):
+                        names = column_ref([None] + expression, 0, 1)
+                        if names and len(names) <= 2:
+                            column = resolve(names)
+                            if column[0]:
+                                self.groups.append(column)
+            for item in clause:
+                if isinstance(item, Group):
+                    self.add_level(item.items)
+
+    def _relations(
+        self, segment: List[Item], conditions: List[List[Item]]
+    ) -> Dict[str, str]:
+        """Aliases of the relations of a FROM item, collecting the ON
+        conditions of its joins."""
+        aliases = {}
+        relations = [[]]
+        for item in segment:
+            if is_word(item, "JOIN"):
+                relations.append([])
+            else:
+                relations[-1].append(item)
+        for relation in relations:
+            on = next(
+                (i for i, item in enumerate(relation) if is_word(item, "ON")),
+                len(relation),
+            )
+            conditions.append(relation[on + 1 :])
+            words = [
+                item
+                for item in relation[:on]
+                if not is_word(item, "AS", "INNER", "LEFT", "RIGHT", "FULL", "OUTER")
+                and not is_word(item, "CROSS", "NATURAL", "LATERAL")
+            ]
+            if not words or isinstance(words[0], Group):
+                continue
+            name = []
+            for item in words:
+                if isinstance(item, Token) and (
+                    item.kind in ("word", "quoted")
+                    and (not name or name[-1] == ".")
+                    or item.text == "."
+                ):
+                    name.append(item.text)
+                else:
+                    break
+            target = relation_name("".join(name))
+            alias = words[len(name)] if len(words) > len(name) else None
+            aliases[target] = target
+            if isinstance(alias, Token) and not is_word(alias, *CLAUSE_WORDS):
+                aliases[alias.text.strip('"').lower()] = target
+        return aliases
+
+
+def advise(
+    manifest: dict,
+    compiled: Dict[str, str],
+    plans: Dict[str, str],
+    all_max_rows: int = 1000,
+) -> List[dict]:
+    nodes = {
+        node["name"]: node
+        for node in manifest["nodes"].values()
+        if node["resource_type"] == "model"
+    }
+    aliases = {node.get("alias") or name: name for name, node in nodes.items()}
+    usages = {}
+    for name, sql in compiled.items():
+        usage = Usage()
+        usage.add_level(nest(tokenize(sql)))
+        usages[name] = usage
+    trees = {name: parse_plan(text) for name, text in plans.items()}
+    steps = {name: join_steps(tree) for name, tree in trees.items() if tree}
+    # Rows a model builds, as estimated at the root of its own plan
+    rows = {name: tree.rows for name, tree in trees.items() if tree}
+    plan_filters = {name: scan_filters(tree) for name, tree in trees.items() if tree}
+
+    def model(column: Optional[Column]) -> Optional[str]:
+        return aliases.get(column[0]) if column and column[0] else None
+
+    recommendations = []
+    for name, node in sorted(nodes.items()):
+        config = node["config"]
+        if config["materialized"] not in BUILT:
+            continue
+        scores: Dict[str, int] = {}
+        joined = []
+        for consumer, usage in sorted(usages.items()):
+            for first, second in usage.joins:
+                for own, other in ((first, second), (second, first)):
+                    if model(own) == name:
+                        joined.append((consumer, own[1], other))
+                        scores[own[1]] = scores.get(own[1], 0) + 3
+            for column in usage.groups:
+                if consumer != name and model(column) == name:
+                    scores[column[1]] = scores.get(column[1], 0) + 2
+        for column in usages.get(name, Usage()).groups:
+            if column and column[0]:
+                scores[column[1]] = scores.get(column[1], 0) + 1
+        if not scores:
+            continue
+
+        key = max(sorted(scores), key=lambda column: scores[column])
+        dist = key
+        if joined and rows.get(name, all_max_rows + 1) <= all_max_rows:
+            dist = "all"
+        filters = [
+            column[1]
+            for consumer, usage in sorted(usages.items())
+            if consumer != name
+            for column in usage.filters + plan_filters.get(consumer, [])
+            if model(column) == name
+        ]
+        sort = sorted(set(filters)) or [key]
+
+        changes = []
+        for consumer, column, other in joined:
+            for step in steps.get(consumer, []):
+                sides = {
+                    "outer": (aliases.get(step.outer[0], step.outer[0]), step.outer[1]),
+                    "inner": (aliases.get(step.inner[0], step.inner[0]), step.inner[1]),
+                }
+                own = next(
+                    (side for side, c in sides.items() if c == (name, column)), None
+                )
+                if own is None or step.strategy not in REDISTRIBUTIONS:
+                    continue
+                if dist == "all":
+                    expected = "DS_DIST_ALL_NONE"
+                elif step.strategy == "DS_DIST_BOTH":
+                    expected = "DS_DIST_OUTER" if own == "inner" else "DS_DIST_INNER"
+                elif step.strategy == "DS_DIST_OUTER" and own == "inner":
+                    expected = "DS_DIST_OUTER"
+                elif step.strategy == "DS_DIST_INNER" and own == "outer":
+                    expected = "DS_DIST_INNER"
+                elif step.strategy == "DS_BCAST_INNER" and own == "outer":
+                    expected = "DS_BCAST_INNER"
+                else:
+                    # The other side is already distributed on its join column
+                    expected = "DS_DIST_NONE"
+                changes.append(
+                    {
+                        "consumer": consumer,
+                        "join": f"{name}.{column} = {other[0]}.{other[1]}",
+                        "current": step.strategy,
+                        "expected": expected,
+                    }
+                )
+        recommendations.append(
+            {
+                "model": name,
+                "materialized": config["materialized"],
+                "current_dist": config.get("dist"),
+                "current_sort": config.get("sort"),
+                "dist": dist,
+                "sort": sort,
+                "rows": rows.get(name),
+                "steps": changes,
+            }
+        )
+    return recommendations
+
+
+def compiled_sql(target_dir: str, manifest: dict) -> Dict[str, str]:
+    compiled = {}
+    for node in manifest["nodes"].values():
+        if node["resource_type"] != "model":
+            continue
+        path = os.path.join(
+            target_dir, "compiled", node["package_name"], node["original_file_path"]
+        )
+        if os.path.exists(path):
+            with open(path) as f:
+                compiled[node["name"]] = f.read()
+    return compiled
+
+
+def explain(dsn: Optional[str], compiled: Dict[str, str]) -> Dict[str, str]:
+    import psycopg2
+
+    if dsn:
+        conn = psycopg2.connect(dsn)
+    else:
+        conn = psycopg2.connect(
+            host=os.environ["REDSHIFT_HOST"],
+            port=int(os.environ.get("REDSHIFT_PORT", "5439")),
+            user=os.environ["REDSHIFT_USER"],
+            password=os.environ["REDSHIFT_PASSWORD"],
+            dbname=os.environ.get("REDSHIFT_DBNAME", "redshift-db"),
+        )
+    plans = {}
+    try:
+        with conn.cursor() as cursor:
+            for name, sql in sorted(compiled.items()):
+                cursor.execute(f"EXPLAIN {sql}")
+                plans[name] = "\n".join(row[0] for row in cursor.fetchall())
+                conn.rollback()
+    finally:
+        conn.close()
+    return plans
+
+
+def print_recommendations(recommendations: List[dict]) -> None:
+    removed = total = 0
+    for r in recommendations:
+        config = f"dist='{r['dist']}'"
+        if r["sort"]:
+            config += (
+                f", sort={r['sort'] if len(r['sort']) > 1 else repr(r['sort'][0])}"
+            )
+        current = f"dist={r['current_dist']!r}, sort={r['current_sort']!r}"
+        print(f"{r['model']}: {config} (now {current})")
+        for step in r["steps"]:
+            print(
+                f"    {step['consumer']}: {step['join']} "
+                f"{step['current']} -> {step['expected']}"
+            )
+            total += 1
+            removed += step["expected"] in ("DS_DIST_NONE", "DS_DIST_ALL_NONE")
+    print(f"Redistribution steps removed: {removed} of {total}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("target_dir", help="dbt target folder, after dbt compile")
+    parser.add_argument("--explain", help="folder of recorded <model>.txt plans")
+    parser.add_argument("--dsn", help="libpq connection string, else REDSHIFT_*")
+    parser.add_argument("--record", help="save the EXPLAIN output to this folder")
+    parser.add_argument("--all-max-rows", type=int, default=1000)
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args()
+
+    with open(os.path.join(args.target_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    compiled = compiled_sql(args.target_dir, manifest)
+    if args.explain:
+        plans = {}
+        for name in compiled:
+            path = os.path.join(args.explain, f"{name}.txt")
+            if os.path.exists(path):
+                with open(path) as f:
+                    plans[name] = f.read()
+            else:
+                print(f"No recorded plan for {name}", file=sys.stderr)
+    else:
+        plans = explain(args.dsn, compiled)
+    if args.record:
+        os.makedirs(args.record, exist_ok=True)
+        for name, text in plans.items():
+            with open(os.path.join(args.record, f"{name}.txt"), "w") as f:
+                f.write(text + "\n")
+
+    recommendations = advise(manifest, compiled, plans, args.all_max_rows)
+    if args.json:
+        print(json.dumps(recommendations, indent=2))
+    else:
+        print_recommendations(recommendations)
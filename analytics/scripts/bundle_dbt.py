@@ -0,0 +1,62 @@
+"""Package the dbt project as a content-addressed archive.
+
+    $ python scripts/bundle_dbt.py dbt_dags build/
+    3f2a...
+
+writes build/<sha256>.tar.gz and prints the hash. The archive is
+reproducible (sorted entries, fixed owners and timestamps), so an unchanged
+project always yields the same hash and containers holding that bundle can
+skip the download.
+"""
+import argparse
+import gzip
+import hashlib
+import os
+import tarfile
+import tempfile
+
+# Build outputs and local state, never part of the bundle
+EXCLUDED_DIRS = {"target", "logs", "dbt_modules", "state"}
+
+
+def _add(archive: tarfile.TarFile, path: str, arcname: str) -> None:
+    info = archive.gettarinfo(path, arcname)
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    info.mtime = 0
+    info.mode = 0o755 if info.isdir() or info.mode & 0o100 else 0o644
+    if info.isfile():
+        with open(path, "rb") as f:
+            archive.addfile(info, f)
+    else:
+        archive.addfile(info)
+
+
+def build_bundle(project_dir: str, out_dir: str) -> str:
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".tar.gz")
+    with os.fdopen(fd, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as gz:
+            with tarfile.open(fileobj=gz, mode="w") as archive:
+                for root, dirs, files in os.walk(project_dir):
+                    dirs[:] = sorted(d for d in dirs if d not in EXCLUDED_DIRS)
+                    for name in dirs + sorted(files):
+                        path = os.path.join(root, name)
+                        _add(archive, path, os.path.relpath(path, project_dir))
+
+    digest = hashlib.sha256()
+    with open(tmp_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    sha = digest.hexdigest()
+    os.replace(tmp_path, os.path.join(out_dir, f"{sha}.tar.gz"))
+    return sha
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("project_dir")
+    parser.add_argument("out_dir")
+    args = parser.parse_args()
+
+    print(build_bundle(args.project_dir, args.out_dir))
@@ -0,0 +1,340 @@
+"""Flag performance anti-patterns in the compiled SQL of the dbt models.
+
+    $ cd dbt_dags && dbt compile --full-refresh > /dev/null && cd ..
+    $ python scripts/lint_sql.py dbt_dags/target
+
+Reads the models' compiled SQL under target/compiled, and their
+materialization and suppressions from target/manifest.json. Compile with
+--full-refresh, so incremental models are linted as they are first built
+whatever the state of the database. Rules:
+
+* PERF001 (warning) implicit comma join, use an explicit JOIN ... ON
+* PERF002 (warning) ORDER BY in a table or incremental model: the table
+  does not keep the order. With a LIMIT the sort picks the rows, and the
+  finding is only informational.
+* PERF003 (warning) window without PARTITION BY: every row goes through
+  a single slice
+* PERF004 (warning) SELECT *: scans every column of a columnar table
+* PERF005 (warning) window frame up to UNBOUNDED FOLLOWING
+* PERF006 (warning) CROSS JOIN
+* PERF007 (error) join without a join predicate: a JOIN without ON or
+  USING, or comma-joined relations without an equality between columns
+
+A model skips rules listed in the `lint_ignore` meta of its schema.yml
+properties, preferably with a comment saying why. The script exits with an
+error when a finding reaches --fail-on (error by default).
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+from typing import Dict, Iterator, List, NamedTuple, Optional, Union
+
+SEVERITIES = ["info", "warning", "error"]
+TOKEN_RE = re.compile(
+    r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+    |(?P<string>'(?:''|[^'])*')
+    |(?P<quoted>"(?:""|[^"])*")
+    |(?P<number>\d+(?:\.\d+)?)
+    |(?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    |(?P<space>\s+)
+    |(?P<operator>::|<>|!=|<=|>=|\|\||.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+CLAUSES = {"SELECT", "FROM", "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT", "QUALIFY"}
+SET_OPERATORS = {"UNION", "INTERSECT", "EXCEPT", "MINUS"}
+JOIN_WORDS = {"JOIN", "INNER", "LEFT", "RIGHT", "FULL", "OUTER", "CROSS", "NATURAL"}
+
+
+class Token(NamedTuple):
+    kind: str
+    text: str
+    line: int
+
+    @property
+    def upper(self) -> str:
+        return self.text.upper()
+
+
+class Group(NamedTuple):
+    """Tokens between a pair of parentheses."""
+
+    items: list
+    line: int
+
+
+Item = Union[Token, Group]
+
+
+class Finding(NamedTuple):
+    rule: str
+    severity: str
+    line: int
+    message: str
+
+
+def tokenize(sql: str) -> List[Token]:
+    tokens = []
+    line = 1
+    for match in TOKEN_RE.finditer(sql):
+        kind, text = match.lastgroup, match.group()
+        if kind not in ("comment", "space"):
+            tokens.append(Token(kind, text, line))
+        line += text.count("\n")
+    return tokens
+
+
+def nest(tokens: List[Token]) -> List[Item]:
+    """Nest the tokens between parentheses into Groups."""
+    stack: List[List[Item]] = [[]]
+    lines = []
+    for token in tokens:
+        if token.text == "(":
+            stack.append([])
+            lines.append(token.line)
+        elif token.text == ")" and len(stack) > 1:
+            items = stack.pop()
+            stack[-1].append(Group(items, lines.pop()))
+        else:
+            stack[-1].append(token)
+    while len(stack) > 1:
+        items = stack.pop()
+        stack[-1].append(Group(items, lines.pop()))
+    return stack[0]
+
+
+def is_word(item: Item, *words: str) -> bool:
+    return isinstance(item, Token) and item.kind == "word" and item.upper in words
+
+
+def clauses(items: List[Item]) -> Iterator[tuple]:
+    """Split one level of a query into (keyword, items) clauses. CTE
+    definitions and set operators start a new SELECT."""
+    keyword, start = None, 0
+    for index, item in enumerate(items):
+        if is_word(item, *CLAUSES) or is_word(item, *SET_OPERATORS, "WITH"):
+            # GROUP BY and ORDER BY, not the ORDER BY of a window
+            if keyword is not None or index > start:
+                yield keyword, items[start:index]
+            keyword, start = item.upper, index + 1
+    yield keyword, items[start:]
+
+
+def split(items: List[Item], separator: str) -> List[List[Item]]:
+    parts: List[List[Item]] = [[]]
+    for item in items:
+        if isinstance(item, Token) and item.text == separator:
+            parts.append([])
+        else:
+            parts[-1].append(item)
+    return parts
+
+
+def operand(items: List[Item], index: int, step: int) -> List[Item]:
+    """The column reference next to items[index] in the direction of step,
+    like `a`, `a.b` or `"a"."b"`, empty when it is something else."""
+    found = []
+    index += step
+    while 0 <= index < len(items):
+        item = items[index]
+        if not isinstance(item, Token) or is_word(item, "AND", "OR", "NOT"):
+            break
+        if item.kind not in ("word", "quoted") and item.text != ".":
+            return []
+        found.append(item)
+        index += step
+    return found
+
+
+def has_column_equality(items: List[Item]) -> bool:
+    return any(
+        isinstance(item, Token)
+        and item.text == "="
+        and operand(items, index, -1)
+        and operand(items, index, 1)
+        for index, item in enumerate(items)
+    )
+
+
+def lint_from(items: List[Item], where: Optional[List[Item]]) -> Iterator[Finding]:
+    line = items[0].line if items else 0
+    relations = split(items, ",")
+    if len(relations) > 1:
+        yield Finding(
+            "PERF001",
+            "warning",
+            line,
+            "implicit comma join, use JOIN ... ON",
+        )
+        if not (where and has_column_equality(where)):
+            yield Finding(
+                "PERF007",
+                "error",
+                line,
+                "comma-joined relations without a join predicate",
+            )
+    for relation in relations:
+        for index, item in enumerate(relation):
+            if not is_word(item, "JOIN"):
+                continue
+            modifiers = {
+                previous.upper
+                for previous in relation[max(0, index - 2) : index]
+                if is_word(previous, *JOIN_WORDS)
+            }
+            rest = relation[index + 1 :]
+            following = next(
+                (i for i, other in enumerate(rest) if is_word(other, "JOIN")),
+                len(rest),
+            )
+            condition = [
+                other for other in rest[:following] if is_word(other, "ON", "USING")
+            ]
+            if "CROSS" in modifiers:
+                yield Finding("PERF006", "warning", item.line, "CROSS JOIN")
+            elif "NATURAL" not in modifiers and not condition:
+                yield Finding("PERF007", "error", item.line, "JOIN without ON or USING")
+
+
+def lint_window(group: Group) -> Iterator[Finding]:
+    items = group.items
+    if not any(is_word(item, "PARTITION") for item in items):
+        yield Finding(
+            "PERF003",
+            "warning",
+            group.line,
+            "window without PARTITION BY runs on a single slice",
+        )
+    for index, item in enumerate(items[:-1]):
+        if is_word(item, "UNBOUNDED") and is_word(items[index + 1], "FOLLOWING"):
+            yield Finding(
+                "PERF005",
+                "warning",
+                item.line,
+                "window frame up to UNBOUNDED FOLLOWING",
+            )
+
+
+def lint_level(
+    items: List[Item],
+    materialized: Optional[str],
+    outermost: bool,
+    exists: bool = False,
+) -> Iterator[Finding]:
+    parts = list(clauses(items))
+    where = next((clause for keyword, clause in parts if keyword == "WHERE"), None)
+    limited = any(keyword == "LIMIT" for keyword, _ in parts)
+    for position, (keyword, clause) in enumerate(parts):
+        # EXISTS (SELECT * ...) reads no column
+        if keyword == "SELECT" and not exists:
+            for index, item in enumerate(clause):
+                if isinstance(item, Token) and item.text == "*":
+                    previous = clause[index - 1] if index else None
+                    if (
+                        previous is None
+                        or is_word(previous, "DISTINCT", "ALL")
+                        or (isinstance(previous, Token) and previous.text in (",", "."))
+                    ):
+                        yield Finding("PERF004", "warning", item.line, "SELECT *")
+        elif keyword == "FROM":
+            yield from lint_from(clause, where)
+        elif (
+            keyword == "ORDER"
+            and outermost
+            and materialized in ("table", "incremental")
+            # Only the ORDER BY of the final SELECT, after any set operator
+            and not any(k in SET_OPERATORS for k, _ in parts[position + 1 :])
+        ):
+            yield Finding(
+                "PERF002",
+                "info" if limited else "warning",
+                clause[0].line if clause else 0,
+                f"ORDER BY in {materialized} model"
+                + (
+                    ", only needed to pick the LIMIT rows"
+                    if limited
+                    else ", the table does not keep the order"
+                ),
+            )
+        for index, item in enumerate(clause):
+            if not isinstance(item, Group):
+                continue
+            previous = clause[index - 1] if index else None
+            if previous is not None and is_word(previous, "OVER"):
+                yield from lint_window(item)
+            else:
+                yield from lint_level(
+                    item.items,
+                    materialized,
+                    outermost=False,
+                    exists=is_word(previous, "EXISTS"),
+                )
+
+
+def lint_sql(sql: str, materialized: Optional[str] = None) -> List[Finding]:
+    findings = lint_level(nest(tokenize(sql)), materialized, outermost=True)
+    return sorted(set(findings), key=lambda finding: (finding.line, finding.rule))
+
+
+def compiled_models(target_dir: str) -> Iterator[dict]:
+    """The compiled models, with their name, materialization and ignored
+    rules from the manifest when there is one."""
+    manifest_path = os.path.join(target_dir, "manifest.json")
+    nodes: Dict[str, dict] = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        for node in manifest["nodes"].values():
+            if node["resource_type"] == "model":
+                path = os.path.join(node["package_name"], node["original_file_path"])
+                nodes[os.path.normpath(path)] = node
+    compiled_dir = os.path.join(target_dir, "compiled")
+    pattern = os.path.join(compiled_dir, "*", "models", "**", "*.sql")
+    for path in sorted(glob.glob(pattern, recursive=True)):
+        node = nodes.get(os.path.normpath(os.path.relpath(path, compiled_dir)), {})
+        yield {
+            "path": path,
+            "name": node.get("name", os.path.basename(path)[: -len(".sql")]),
+            "materialized": node.get("config", {}).get("materialized"),
+            "ignore": set(node.get("meta", {}).get("lint_ignore", [])),
+        }
+
+
+def lint(target_dir: str, ignore: List[str]) -> List[dict]:
+    results = []
+    for model in compiled_models(target_dir):
+        with open(model["path"]) as f:
+            sql = f.read()
+        for finding in lint_sql(sql, model["materialized"]):
+            if finding.rule in model["ignore"] or finding.rule in ignore:
+                continue
+            results.append(
+                {"model": model["name"], "path": model["path"], **finding._asdict()}
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("target_dir", help="dbt target folder, after dbt compile")
+    parser.add_argument("--ignore", action="append", default=[], help="rule to skip")
+    parser.add_argument("--fail-on", choices=SEVERITIES + ["never"], default="error")
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args()
+
+    results = lint(args.target_dir, args.ignore)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(
+                "{path}:{line}: {rule} {severity} [{model}] {message}".format(**result)
+            )
+    if args.fail_on != "never":
+        threshold = SEVERITIES.index(args.fail_on)
+        if any(SEVERITIES.index(r["severity"]) >= threshold for r in results):
+            sys.exit(1)
@@ -0,0 +1,333 @@
+"""Propose a materialization for every dbt model from its recorded builds.
+
+    $ python scripts/plan_materializations.py dbt_dags/target/manifest.json \\
+        --history history
+
+Reads the model graph from the manifest and the median execution time and
+rows of each model's last successful builds from the run history
+(dbt_artifacts/history/, see airflow_dags/dataops/dbt_history.py),
+run_results.json files or the results of benchmarks/model_benchmark.py.
+Then estimates the warehouse and task seconds spent per DAG run on each
+model and its consumers for every materialization:
+
+* table: the build, its task, and every consumer reading the rows back
+* view: its task, and every consumer running the model's query
+* ephemeral: every consumer running the model's query, inlined as a CTE
+
+The query of a model costs its build time minus writing its rows
+(--write-rows-per-second). Every model built runs as its own dbt task,
+which costs --task-overhead seconds of start-up. Incremental models and
+materialized views keep their state and are never changed. Leaves and the
+models of an exposure are queried outside dbt and stay tables, as do
+models without recorded builds. Only models with a single consumer and no
+tests are inlined, and a model only changes when that saves at least
+--min-saving seconds. With --apply, the proposed materializations are
+written to the generated block of dbt_project.yml, between the
+`BEGIN materialization plan` and `END materialization plan` comments, for
+the models that do not set their materialization in their SQL.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+from typing import Dict, List, Optional
+
+MATERIALIZATIONS = ["table", "view", "ephemeral"]
+BEGIN_MARKER = "# BEGIN materialization plan"
+END_MARKER = "# END materialization plan"
+CONFIG_RE = re.compile(r"config\s*\((?:[^()]|\([^()]*\))*\bmaterialized\s*=", re.S)
+
+
+def load_builds(paths: List[str], window: int) -> Dict[str, Dict[str, float]]:
+    """Median execution time and rows of the last `window` successful builds
+    of each model, by model name."""
+    builds: Dict[str, List[tuple]] = {}
+    for path in paths:
+        if path.endswith(".parquet") or os.path.isdir(path):
+            import pyarrow.parquet as pq
+
+            # A folder reads every part file of the history
+            history = pq.read_table(path).to_pydict()
+            rows = [dict(zip(history, values)) for values in zip(*history.values())]
+        else:
+            with open(path) as f:
+                content = json.load(f)
+            if isinstance(content, list):
+                # benchmarks/model_benchmark.py --output
+                rows = [
+                    {
+                        "generated_at": str(result["scale_factor"]),
+                        "unique_id": result["model"],
+                        "status": "success",
+                        "execution_time": result["p50_s"],
+                        "rows_affected": result["rows"],
+                    }
+                    for result in content
+                ]
+            else:
+                rows = [
+                    {
+                        "generated_at": content["metadata"]["generated_at"],
+                        "unique_id": result["unique_id"],
+                        "status": result["status"],
+                        "execution_time": result["execution_time"],
+                        "rows_affected": (result.get("adapter_response") or {}).get(
+                            "rows_affected"
+                        ),
+                    }
+                    for result in content["results"]
+                ]
+        for row in rows:
+            if row["status"] == "success":
+                name = row["unique_id"].split(".")[-1]
+                builds.setdefault(name, []).append(
+                    (row["generated_at"], row["execution_time"], row["rows_affected"])
+                )
+    medians = {}
+    for name, rows in builds.items():
+        rows = sorted(rows)[-window:]
+        counts = [count for _, _, count in rows if count is not None]
+        medians[name] = {
+            "seconds": statistics.median(seconds for _, seconds, _ in rows),
+            "rows": statistics.median(counts) if counts else 0,
+        }
+    return medians
+
+
+def model_nodes(manifest: dict) -> Dict[str, dict]:
+    """The models of the manifest by name, with the names of the models they
+    ref, their consumers and whether tests or exposures use them."""
+    nodes = manifest["nodes"]
+    models = {
+        node["name"]: {
+            "node": node,
+            "parents": sorted(
+                {
+                    nodes[unique_id]["name"]
+                    for unique_id in node["depends_on"]["nodes"]
+                    if nodes.get(unique_id, {}).get("resource_type") == "model"
+                }
+            ),
+            "children": [],
+            "tested": False,
+            "exposed": False,
+        }
+        for node in nodes.values()
+        if node["resource_type"] == "model"
+    }
+    for name, model in models.items():
+        for parent in model["parents"]:
+            models[parent]["children"].append(name)
+    by_id = {model["node"]["unique_id"]: model for model in models.values()}
+    for node in nodes.values():
+        if node["resource_type"] == "test":
+            for unique_id in node["depends_on"]["nodes"]:
+                if unique_id in by_id:
+                    by_id[unique_id]["tested"] = True
+    for exposure in manifest.get("exposures", {}).values():
+        for unique_id in exposure["depends_on"]["nodes"]:
+            if unique_id in by_id:
+                by_id[unique_id]["exposed"] = True
+    return models
+
+
+def costs(
+    build: Dict[str, float],
+    consumers: int,
+    task_overhead: float,
+    write_rate: float,
+    read_rate: float,
+) -> Dict[str, float]:
+    """Seconds per DAG run spent on a model and on reading it, by
+    materialization."""
+    query = max(build["seconds"] - build["rows"] / write_rate, 0.0)
+    read = build["rows"] / read_rate
+    return {
+        "table": task_overhead + build["seconds"] + consumers * read,
+        "view": task_overhead + consumers * query,
+        "ephemeral": consumers * query,
+    }
+
+
+def plan(
+    manifest: dict,
+    builds: Dict[str, Dict[str, float]],
+    task_overhead: float = 60.0,
+    write_rate: float = 1e6,
+    read_rate: float = 1e7,
+    min_saving: float = 1.0,
+) -> List[dict]:
+    proposals = []
+    for name, model in sorted(model_nodes(manifest).items()):
+        current = model["node"]["config"]["materialized"]
+        consumers = len(model["children"])
+        build = builds.get(name)
+        proposal = {
+            "model": name,
+            "current": current,
+            "proposed": current,
+            "consumers": consumers,
+            "rows": build["rows"] if build else None,
+            "build_s": build["seconds"] if build else None,
+            "current_s": None,
+            "proposed_s": None,
+            "reason": "",
+        }
+        proposals.append(proposal)
+        if current == "incremental":
+            proposal["reason"] = "incremental, keeps its state"
+            continue
+        if current not in MATERIALIZATIONS:
+            proposal["reason"] = f"{current} materialization"
+            continue
+        if not consumers or model["exposed"]:
+            proposal["proposed"] = "table"
+            proposal["reason"] = "queried outside dbt"
+            continue
+        if build is None:
+            proposal["reason"] = "no recorded build"
+            continue
+
+        estimates = costs(build, consumers, task_overhead, write_rate, read_rate)
+        candidates = ["view", "table"]
+        if consumers == 1 and not model["tested"]:
+            candidates.insert(0, "ephemeral")
+        best = min(candidates, key=lambda materialization: estimates[materialization])
+        proposal["current_s"] = estimates[current]
+        if estimates[best] > estimates[current] - min_saving:
+            best = current
+            proposal["reason"] = "no cheaper materialization"
+        elif best == "table":
+            proposal["reason"] = f"cheaper to read than to recompute for {consumers}"
+        elif best == "ephemeral":
+            proposal["reason"] = "single consumer, inlined"
+        elif consumers == 1:
+            proposal["reason"] = "single consumer, tested"
+        else:
+            proposal["reason"] = f"cheaper to recompute for {consumers} consumers"
+        proposal["proposed"] = best
+        proposal["proposed_s"] = estimates[best]
+    return proposals
+
+
+def block_prefix(lines: List[str], index: int) -> List[str]:
+    """YAML keys enclosing lines[index], from the outermost."""
+    keys = []
+    indent = len(lines[index]) - len(lines[index].lstrip())
+    for line in reversed(lines[:index]):
+        stripped = line.strip()
+        line_indent = len(line) - len(line.lstrip())
+        if stripped and not stripped.startswith("#") and line_indent < indent:
+            keys.insert(0, stripped.rstrip(":").lstrip("+"))
+            indent = line_indent
+    return keys
+
+
+def apply(project_path: str, manifest: dict, proposals: List[dict]) -> List[str]:
+    """Write the proposed materializations to the generated block of
+    dbt_project.yml. Returns the models left out of it."""
+    with open(project_path) as f:
+        lines = f.read().split("\n")
+    begin = next(i for i, line in enumerate(lines) if line.strip() == BEGIN_MARKER)
+    end = next(i for i, line in enumerate(lines) if line.strip() == END_MARKER)
+    indent = lines[begin][: len(lines[begin]) - len(lines[begin].lstrip())]
+    # models: <package>: <folder>...: the fqn of the models it configures
+    prefix = block_prefix(lines, begin)[1:]
+    nodes = {
+        node["name"]: node
+        for node in manifest["nodes"].values()
+        if node["resource_type"] == "model"
+    }
+    generated, skipped = [], []
+    for proposal in proposals:
+        node = nodes[proposal["model"]]
+        if node["fqn"][:-1] != prefix or CONFIG_RE.search(node["raw_sql"]):
+            if proposal["proposed"] != proposal["current"]:
+                skipped.append(proposal["model"])
+            continue
+        generated += [
+            f"{indent}{proposal['model']}:",
+            f"{indent}    materialized: {proposal['proposed']}",
+        ]
+    lines[begin + 1 : end] = generated
+    with open(project_path, "w") as f:
+        f.write("\n".join(lines))
+    return skipped
+
+
+def print_plan(proposals: List[dict]) -> None:
+    def seconds(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value:.1f}"
+
+    print(
+        f"{'model':<34} {'current':<12} {'proposed':<12} {'consumers':>9} "
+        f"{'rows':>10} {'build_s':>8} {'current_s':>9} {'planned_s':>9}  reason"
+    )
+    for p in proposals:
+        print(
+            f"{p['model']:<34} {p['current']:<12} {p['proposed']:<12} "
+            f"{p['consumers']:>9} {'-' if p['rows'] is None else int(p['rows']):>10} "
+            f"{seconds(p['build_s']):>8} {seconds(p['current_s']):>9} "
+            f"{seconds(p['proposed_s']):>9}  {p['reason']}"
+        )
+    saved = sum(
+        p["current_s"] - p["proposed_s"]
+        for p in proposals
+        if p["current_s"] is not None and p["proposed"] != p["current"]
+    )
+    print(f"Predicted saving: {saved:.1f}s per DAG run")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest", help="target/manifest.json of the project")
+    parser.add_argument(
+        "--history",
+        action="append",
+        required=True,
+        help="history folder or .parquet file, run_results.json or "
+        "model_benchmark.py results",
+    )
+    parser.add_argument("--window", type=int, default=10, help="builds per model")
+    parser.add_argument(
+        "--task-overhead",
+        type=float,
+        default=60.0,
+        help="seconds to start the dbt task of a model",
+    )
+    parser.add_argument("--write-rows-per-second", type=float, default=1e6)
+    parser.add_argument("--read-rows-per-second", type=float, default=1e7)
+    parser.add_argument(
+        "--min-saving",
+        type=float,
+        default=1.0,
+        help="seconds per run a change must save",
+    )
+    parser.add_argument("--json", action="store_true", help="print the plan as JSON")
+    parser.add_argument(
+        "--apply", action="store_true", help="write the plan to dbt_project.yml"
+    )
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    proposals = plan(
+        manifest,
+        load_builds(args.history, args.window),
+        task_overhead=args.task_overhead,
+        write_rate=args.write_rows_per_second,
+        read_rate=args.read_rows_per_second,
+        min_saving=args.min_saving,
+    )
+    if args.json:
+        print(json.dumps(proposals, indent=2))
+    else:
+        print_plan(proposals)
+    if args.apply:
+        project_dir = os.path.dirname(os.path.dirname(os.path.abspath(args.manifest)))
+        skipped = apply(
+            os.path.join(project_dir, "dbt_project.yml"), manifest, proposals
+        )
+        for model in skipped:
+            print(f"{model}: materialization set in its SQL or folder, not applied")
@@ -0,0 +1,243 @@
+"""Profile how long the scheduler takes to parse each Airflow DAG file.
+
+    $ python scripts/profile_dags.py airflow_dags
+    $ python scripts/profile_dags.py airflow_dags --check
+
+Every file is imported in a fresh interpreter that already has Airflow
+loaded, like the scheduler's DAG file processors. For each file it reports
+the median wall time over --runs imports, the time spent importing modules
+(from `python -X importtime`) and the number of DAGs and tasks created.
+
+Top-level work that should happen at task run time instead is flagged:
+imports slower than --heavy-import-ms, and network connections, DNS
+lookups and subprocesses started while the file is parsed. Network access
+is blocked during profiling.
+
+With --check the script exits with an error when a file exceeds its parse
+budget (see scripts/dag_parse_budgets.json) or makes network calls.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import List
+
+BUDGETS_PATH = os.path.join(os.path.dirname(__file__), "dag_parse_budgets.json")
+START_MARKER = "profile_dags: start"
+
+
+def _child(path: str) -> None:
+    # Loaded by every scheduler process already, not a cost of the DAG file
+    import airflow  # noqa: F401
+    from airflow.models import DAG, BaseOperator  # noqa: F401
+
+    import importlib.util
+    import socket
+    import time
+    import traceback
+
+    calls = []
+
+    dags_folder = os.environ["AIRFLOW__CORE__DAGS_FOLDER"]
+
+    def _caller() -> str:
+        # The last line of the DAG folder's code leading to the call
+        for frame in reversed(traceback.extract_stack()):
+            if frame.filename.startswith(dags_folder):
+                return f"{os.path.relpath(frame.filename, dags_folder)}:{frame.lineno}"
+        return "?"
+
+    def _blocked(kind):
+        def _block(*args, **kwargs):
+            calls.append({"kind": kind, "target": repr(args[:2]), "at": _caller()})
+            raise OSError(f"{kind} blocked while profiling DAG parsing")
+
+        return _block
+
+    socket.socket.connect = _blocked("connect")
+    socket.socket.connect_ex = _blocked("connect")
+    socket.getaddrinfo = _blocked("dns")
+    subprocess.Popen.__init__ = _blocked("subprocess")
+
+    error = None
+    module = None
+    sys.stderr.write(START_MARKER + "\n")
+    sys.stderr.flush()
+    started = time.perf_counter()
+    try:
+        spec = importlib.util.spec_from_file_location(
+            os.path.splitext(os.path.basename(path))[0], path
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except Exception as e:  # report the import error like the DagBag does
+        error = f"{type(e).__name__}: {e}"
+    elapsed = time.perf_counter() - started
+    sys.stderr.flush()
+
+    dags = []
+    if module is not None:
+        dags = [v for v in vars(module).values() if isinstance(v, airflow.DAG)]
+    print(
+        json.dumps(
+            {
+                "seconds": elapsed,
+                "dags": len(dags),
+                "tasks": sum(len(dag.tasks) for dag in dags),
+                "calls": calls,
+                "error": error,
+            }
+        )
+    )
+
+
+def parse_importtime(stderr: str) -> List[dict]:
+    """Return the modules imported after the start marker, with their self
+    and cumulative import times in seconds."""
+    lines = stderr.splitlines()
+    if START_MARKER in lines:
+        lines = lines[lines.index(START_MARKER) + 1 :]
+    imports = []
+    for line in lines:
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        imports.append(
+            {
+                "module": name.strip(),
+                # Nested imports are indented by two spaces per level
+                "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+                "self": int(self_us) / 1e6,
+                "cumulative": int(cumulative_us) / 1e6,
+            }
+        )
+    return imports
+
+
+def profile_file(path: str, dags_folder: str, runs: int) -> dict:
+    env = dict(
+        os.environ,
+        AIRFLOW__CORE__DAGS_FOLDER=os.path.abspath(dags_folder),
+        AIRFLOW__CORE__LOAD_EXAMPLES="False",
+        PYTHONDONTWRITEBYTECODE="1",
+    )
+    samples = []
+    for _ in range(runs):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", __file__, "--child", path],
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode != 0:
+            raise RuntimeError(f"Could not profile {path}:\n{process.stderr[-2000:]}")
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        imports = parse_importtime(process.stderr)
+        result["import_seconds"] = sum(i["self"] for i in imports)
+        result["imports"] = [i for i in imports if i["depth"] == 0]
+        samples.append(result)
+
+    result = min(samples, key=lambda s: abs(s["seconds"] - _median(samples)))
+    result["seconds"] = _median(samples)
+    return result
+
+
+def _median(samples: List[dict]) -> float:
+    return statistics.median(s["seconds"] for s in samples)
+
+
+def dag_files(dags_folder: str) -> List[str]:
+    """Files the DAG parser would load: .py files mentioning "airflow" and
+    "dag" whose path matches no .airflowignore pattern."""
+    patterns = []
+    ignore_path = os.path.join(dags_folder, ".airflowignore")
+    if os.path.exists(ignore_path):
+        with open(ignore_path) as f:
+            patterns = [re.compile(line.strip()) for line in f if line.strip()]
+
+    def ignored(path: str) -> bool:
+        return any(pattern.search(path) for pattern in patterns)
+
+    files = []
+    for root, dirs, names in os.walk(dags_folder):
+        dirs[:] = sorted(
+            d for d in dirs if d != "__pycache__" and not ignored(os.path.join(root, d))
+        )
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            if not name.endswith(".py") or ignored(path):
+                continue
+            with open(path, "rb") as f:
+                content = f.read().lower()
+            if b"airflow" in content and b"dag" in content:
+                files.append(path)
+    return files
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dags_folder")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--heavy-import-ms", type=float, default=100)
+    parser.add_argument("--budgets", default=BUDGETS_PATH)
+    parser.add_argument("--check", action="store_true", help="fail on exceeded budgets")
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args()
+
+    # {"default_seconds": ..., "files": {<path in the DAG folder>: seconds}}
+    with open(args.budgets) as f:
+        budgets = json.load(f)
+    failures = []
+    results = {}
+    for path in dag_files(args.dags_folder):
+        name = os.path.relpath(path, args.dags_folder)
+        result = profile_file(path, args.dags_folder, args.runs)
+        budget = budgets["files"].get(name, budgets["default_seconds"])
+        result["budget_seconds"] = budget
+        result["heavy_imports"] = [
+            i
+            for i in result.pop("imports")
+            if i["cumulative"] * 1000 >= args.heavy_import_ms
+        ]
+        results[name] = result
+
+        if result["error"]:
+            failures.append(f"{name}: {result['error']}")
+        if result["seconds"] > budget:
+            failures.append(
+                f"{name}: parsed in {result['seconds']:.3f}s, budget {budget:.3f}s"
+            )
+        for call in result["calls"]:
+            failures.append(f"{name}: {call['kind']} {call['target']} at {call['at']}")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results.items():
+            print(
+                f"{name}: {result['seconds']:.3f}s "
+                f"(imports {result['import_seconds']:.3f}s, "
+                f"budget {result['budget_seconds']:.3f}s), "
+                f"{result['dags']} DAGs, {result['tasks']} tasks"
+            )
+            for i in sorted(result["heavy_imports"], key=lambda i: -i["cumulative"]):
+                print(f"  heavy import: {i['module']} {i['cumulative']:.3f}s")
+            for call in result["calls"]:
+                print(f"  top-level {call['kind']}: {call['target']} at {call['at']}")
+            if result["error"]:
+                print(f"  import error: {result['error']}")
+
+    if args.check and failures:
+        print("\n".join(["DAG parse check failed:"] + failures), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        _child(sys.argv[2])
+    else:
+        sys.exit(main())
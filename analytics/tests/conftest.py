@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The DAGs folder is on Airflow's path, the scripts are run as scripts
+for path in ("airflow_dags", "scripts"):
+    sys.path.insert(0, os.path.join(ROOT, path))
+
+# Airflow reads its settings once, on import: keep the tests on their own
+# SQLite metadata DB
+AIRFLOW_HOME = tempfile.mkdtemp(prefix="airflow_home")
+os.environ["AIRFLOW_HOME"] = AIRFLOW_HOME
+os.environ["AIRFLOW__CORE__SQL_ALCHEMY_CONN"] = f"sqlite:///{AIRFLOW_HOME}/airflow.db"
+os.environ["AIRFLOW__CORE__LOAD_EXAMPLES"] = "False"
+# AWS hooks use moto's credentials instead of a stored connection
+os.environ["AIRFLOW_CONN_AWS_DEFAULT"] = "aws://"
+
+BUCKET_NAME = "dataops-tests"
+POSTGRES_DSN = os.environ.get(
+    "POSTGRES_TEST_DSN", "host=localhost user=postgres dbname=dbt"
+)
+# Installed next to the interpreter running the tests
+DBT = os.path.join(os.path.dirname(sys.executable), "dbt")
+
+
+@pytest.fixture(scope="session")
+def metadata_db():
+    """Empty Airflow metadata DB, for the tests of tasks that use it."""
+    db = pytest.importorskip("airflow.utils.db")
+    db.resetdb(rbac=False)
+
+
+@pytest.fixture
+def s3():
+    """S3 client on moto's in-memory S3, with an empty BUCKET_NAME."""
+    boto3 = pytest.importorskip("boto3")
+    moto = pytest.importorskip("moto")
+    with moto.mock_s3():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET_NAME)
+        yield client
+
+
+@pytest.fixture(scope="session")
+def postgres():
+    """Connection to the local Postgres, skipping the test without one."""
+    psycopg2 = pytest.importorskip("psycopg2")
+    try:
+        conn = psycopg2.connect(POSTGRES_DSN, connect_timeout=5)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"No local Postgres at {POSTGRES_DSN!r}: {e}")
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+def copy_project(path, schema: str = "public") -> str:
+    """Copy of dbt_dags under path, with a profile building the models in
+    schema on the Postgres at POSTGRES_TEST_DSN, so the tests leave the
+    target/ and logs/ folders of the project alone."""
+    if not os.path.exists(DBT):
+        pytest.skip("dbt is not installed")
+    psycopg2 = pytest.importorskip("psycopg2")
+    project = os.path.join(str(path), "dbt_dags")
+    shutil.copytree(
+        os.path.join(ROOT, "dbt_dags"),
+        project,
+        ignore=shutil.ignore_patterns("target", "dbt_modules", "logs"),
+    )
+    dsn = psycopg2.extensions.parse_dsn(POSTGRES_DSN)
+    output = {
+        "type": "postgres",
+        "threads": 1,
+        "host": dsn.get("host", "localhost"),
+        "port": int(dsn.get("port", 5432)),
+        "user": dsn.get("user", "postgres"),
+        "pass": dsn.get("password", ""),
+        "dbname": dsn.get("dbname", "postgres"),
+        "schema": schema,
+    }
+    profiles = {
+        "default": {"outputs": {"tests": output}, "target": "tests"},
+        "config": {"send_anonymous_usage_stats": False},
+    }
+    # JSON is valid YAML
+    with open(os.path.join(project, "config", "profiles.yml"), "w") as f:
+        json.dump(profiles, f)
+    return project
+
+
+def run_dbt(project: str, *args: str) -> str:
+    """Runs a dbt command on a copy_project() project, returning its debug
+    output, which logs every statement. Compiling looks the models up too,
+    so every command needs the postgres fixture."""
+    env = dict(os.environ, DBT_PROFILES_DIR=os.path.join(project, "config"))
+    result = subprocess.run(
+        [DBT, "--debug", *args],
+        cwd=project,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+    assert result.returncode == 0, result.stdout[-2000:]
+    return result.stdout
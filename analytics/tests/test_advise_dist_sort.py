@@ -0,0 +1,79 @@
+import json
+import os
+
+import pytest
+
+from advise_dist_sort import advise, compiled_sql
+from conftest import ROOT, copy_project, run_dbt
+
+FIXTURES = os.path.join(ROOT, "scripts", "fixtures", "explain")
+
+
+@pytest.fixture(scope="module")
+def target(tmp_path_factory, postgres):
+    """The project compiled with --full-refresh, as advise_dist_sort.py
+    expects."""
+    project = copy_project(tmp_path_factory.mktemp("advise"))
+    run_dbt(project, "compile", "--full-refresh")
+    return os.path.join(project, "target")
+
+
+@pytest.fixture(scope="module")
+def recommendations(target):
+    with open(os.path.join(target, "manifest.json")) as f:
+        manifest = json.load(f)
+    compiled = compiled_sql(target, manifest)
+    plans = {}
+    for name in compiled:
+        with open(os.path.join(FIXTURES, f"{name}.txt")) as f:
+            plans[name] = f.read()
+    return {r["model"]: r for r in advise(manifest, compiled, plans)}
+
+
+def test_advice_from_the_recorded_plans(recommendations):
+    advice = {
+        name: (r["dist"], r["sort"], r["rows"]) for name, r in recommendations.items()
+    }
+
+    # Views are not advised, they have no keys of their own
+    assert advice == {
+        "all_gross_sales_model": ("eventid", ["eventid"], 8798),
+        "buyer_quantities_model": ("buyerid", ["buyerid"], 49563),
+        "percentile_sales_model": ("eventid", ["percentile"], 8798),
+        "top_buyers_by_quantity_model": ("all", ["buyerid"], 10),
+    }
+
+
+def test_redistribution_steps_removed(recommendations):
+    steps = {
+        name: [
+            (s["consumer"], s["join"], s["current"], s["expected"]) for s in r["steps"]
+        ]
+        for name, r in recommendations.items()
+        if r["steps"]
+    }
+
+    assert steps == {
+        "percentile_sales_model": [
+            (
+                "top_sales_99.9_percentile_model",
+                "percentile_sales_model.eventid = event.eventid",
+                "DS_DIST_INNER",
+                "DS_DIST_NONE",
+            )
+        ],
+        "top_buyers_by_quantity_model": [
+            (
+                "top_buyer_data_model",
+                "top_buyers_by_quantity_model.buyerid = users.userid",
+                "DS_BCAST_INNER",
+                "DS_DIST_ALL_NONE",
+            )
+        ],
+    }
+
+
+def test_models_follow_the_advice(recommendations):
+    for name, r in recommendations.items():
+        sort = r["sort"] if len(r["sort"]) > 1 else r["sort"][0]
+        assert (r["current_dist"], r["current_sort"]) == (r["dist"], sort), name
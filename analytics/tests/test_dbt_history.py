@@ -0,0 +1,117 @@
+import json
+
+import pytest
+
+pytest.importorskip("airflow")
+pytest.importorskip("pyarrow")
+from airflow.hooks.S3_hook import S3Hook  # noqa: E402
+from conftest import BUCKET_NAME  # noqa: E402
+from dataops import dbt_history  # noqa: E402
+
+MODEL = "model.dbt_dags.sales"
+
+
+def upload_run(s3, run_id, invocation_id, execution_time, generated_at):
+    run_results = {
+        "metadata": {"invocation_id": invocation_id, "generated_at": generated_at},
+        "results": [
+            {
+                "unique_id": MODEL,
+                "status": "success",
+                "execution_time": execution_time,
+                "adapter_response": {"rows_affected": 10},
+            }
+        ],
+    }
+    s3.put_object(
+        Bucket=BUCKET_NAME,
+        Key=f"dbt_artifacts/{run_id}/{invocation_id}/run_results.json",
+        Body=json.dumps(run_results),
+    )
+    # Files of the run itself, next to the invocations
+    for name in ("threads.json", "cost.json"):
+        s3.put_object(
+            Bucket=BUCKET_NAME, Key=f"dbt_artifacts/{run_id}/{name}", Body="{}"
+        )
+
+
+@pytest.fixture
+def hook(s3):
+    return S3Hook()
+
+
+def test_record_run_only_reads_the_artifacts_of_the_run(s3, hook):
+    upload_run(s3, "manual__1", "a", 1.0, "2021-01-01T00:00:00Z")
+    upload_run(s3, "manual__2", "b", 2.0, "2021-01-02T00:00:00Z")
+
+    rows = dbt_history.record_run(hook, BUCKET_NAME, "manual__2")
+
+    assert rows["invocation_id"] == ["b"]
+    assert hook.list_keys(BUCKET_NAME, prefix="dbt_artifacts/history/") == [
+        "dbt_artifacts/history/manual__2.parquet"
+    ]
+
+
+def test_overlapping_runs_keep_each_others_rows(s3, hook):
+    upload_run(s3, "manual__1", "a", 1.0, "2021-01-01T00:00:00Z")
+    upload_run(s3, "manual__2", "b", 2.0, "2021-01-02T00:00:00Z")
+
+    # Overlapping runs write their own part files
+    dbt_history.record_run(hook, BUCKET_NAME, "manual__1")
+    dbt_history.record_run(hook, BUCKET_NAME, "manual__2")
+    # A rerun of the task writes the same rows again
+    dbt_history.record_run(hook, BUCKET_NAME, "manual__1")
+
+    history = dbt_history.read_history(hook, BUCKET_NAME)
+    assert sorted(history["invocation_id"]) == ["a", "b"]
+
+
+def test_read_history_includes_the_legacy_file(s3, hook):
+    upload_run(s3, "manual__1", "a", 1.0, "2021-01-01T00:00:00Z")
+    legacy = dbt_history.record_run(hook, BUCKET_NAME, "manual__1")
+    dbt_history._write_history(
+        hook, BUCKET_NAME, dbt_history.LEGACY_HISTORY_KEY, legacy
+    )
+    upload_run(s3, "manual__2", "b", 2.0, "2021-01-02T00:00:00Z")
+    dbt_history.record_run(hook, BUCKET_NAME, "manual__2")
+
+    history = dbt_history.read_history(hook, BUCKET_NAME)
+    assert sorted(history["invocation_id"]) == ["a", "b"]
+
+
+def test_read_history_stops_at_the_window(s3, hook, monkeypatch):
+    for day in range(1, 5):
+        run_id = f"manual__{day}"
+        upload_run(s3, run_id, run_id, 1.0, f"2021-01-0{day}T00:00:00Z")
+        dbt_history.record_run(hook, BUCKET_NAME, run_id)
+    read = []
+    read_parquet = dbt_history._read_parquet
+    monkeypatch.setattr(
+        dbt_history,
+        "_read_parquet",
+        lambda hook, bucket, key: read.append(key) or read_parquet(hook, bucket, key),
+    )
+
+    history = dbt_history.read_history(hook, BUCKET_NAME, "manual__3", window=1)
+
+    # Its own part first, the run after it does not count towards the window
+    assert read == [
+        dbt_history.history_key("manual__3"),
+        dbt_history.history_key("manual__4"),
+        dbt_history.history_key("manual__2"),
+    ]
+    assert sorted(history["run_id"]) == ["manual__2", "manual__3", "manual__4"]
+
+
+def test_check_regressions_compares_the_run_with_the_history(s3):
+    for day in range(1, 4):
+        run_id = f"manual__{day}"
+        upload_run(s3, run_id, run_id, 1.0, f"2021-01-0{day}T00:00:00Z")
+        dbt_history.check_regressions(BUCKET_NAME, run_id=run_id)
+    upload_run(s3, "manual__4", "manual__4", 5.0, "2021-01-04T00:00:00Z")
+
+    regressions = dbt_history.check_regressions(BUCKET_NAME, run_id="manual__4")
+
+    assert regressions == [
+        {"unique_id": MODEL, "execution_time": 5.0, "baseline": 1.0, "ratio": 5.0}
+    ]
@@ -0,0 +1,99 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("airflow")
+fakeredis = pytest.importorskip("fakeredis")
+from airflow import DAG  # noqa: E402
+from airflow.exceptions import AirflowException  # noqa: E402
+from airflow.exceptions import AirflowRescheduleException  # noqa: E402
+from airflow.models import TaskReschedule  # noqa: E402
+from airflow.utils import timezone  # noqa: E402
+
+from dataops.dbt_runner import (  # noqa: E402
+    REQUEST_QUEUE,
+    RESULT_PREFIX,
+    DbtRunnerOperator,
+)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    server = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(
+        "airflow.contrib.hooks.redis_hook.RedisHook.get_conn", lambda self: server
+    )
+    return server
+
+
+@pytest.fixture
+def reschedules(monkeypatch):
+    """Reschedules of the task instance, the first poke has none."""
+    reschedules = []
+    monkeypatch.setattr(
+        TaskReschedule,
+        "find_for_task_instance",
+        staticmethod(lambda task_instance, session=None: reschedules),
+    )
+    return reschedules
+
+
+def operator():
+    dag = DAG("dbt_runner_test", start_date=timezone.datetime(2021, 1, 1))
+    return DbtRunnerOperator(
+        task_id="dbt_model", dag=dag, command=["dbt", "run", "-m", "model"]
+    )
+
+
+def context(try_number=1):
+    return {"ti": SimpleNamespace(try_number=try_number), "run_id": "manual__1"}
+
+
+def push_result(redis, request_id, success=True):
+    result = {
+        "id": request_id,
+        "success": success,
+        "elapsed": 1.5,
+        "results": [
+            {
+                "unique_id": "model.dataops.model",
+                "status": "success",
+                "execution_time": 1.2,
+            }
+        ],
+    }
+    redis.rpush(RESULT_PREFIX + request_id, json.dumps(result))
+
+
+def test_first_poke_queues_the_request_and_frees_the_slot(redis, reschedules):
+    with pytest.raises(AirflowRescheduleException):
+        operator().execute(context())
+
+    request = json.loads(redis.lindex(REQUEST_QUEUE, 0))
+    assert request["id"] == "manual__1.dbt_model.1"
+    assert request["command"] == ["dbt", "run", "-m", "model"]
+    assert request["run_id"] == "manual__1"
+
+
+def test_later_pokes_only_look_for_the_result(redis, reschedules):
+    reschedules.append(SimpleNamespace(start_date=timezone.utcnow()))
+    with pytest.raises(AirflowRescheduleException):
+        operator().execute(context())
+    assert redis.llen(REQUEST_QUEUE) == 0
+
+    push_result(redis, "manual__1.dbt_model.1")
+    operator().execute(context())
+
+
+def test_failed_run(redis):
+    push_result(redis, "manual__1.dbt_model.1", success=False)
+
+    with pytest.raises(AirflowException, match="dbt run manual__1.dbt_model.1 failed"):
+        operator().poke(context())
+
+
+def test_retry_waits_for_its_own_request(redis):
+    push_result(redis, "manual__1.dbt_model.1", success=False)
+
+    assert not operator().poke(context(try_number=2))
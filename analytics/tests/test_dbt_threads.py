@@ -0,0 +1,22 @@
+import json
+
+import pytest
+
+pytest.importorskip("airflow")
+from conftest import BUCKET_NAME  # noqa: E402
+from dataops.dbt_threads import run_allowance  # noqa: E402
+
+
+def test_run_allowance_reads_the_decision_of_the_run(s3):
+    s3.put_object(
+        Bucket=BUCKET_NAME,
+        Key="dbt_artifacts/manual__1/threads.json",
+        Body=json.dumps({"threads": 3, "allowance": 4, "width": 3}),
+    )
+
+    assert run_allowance({"run_id": "manual__1"}, BUCKET_NAME) == 3
+    assert run_allowance({"run_id": "manual__2"}, BUCKET_NAME) is None
+
+
+def test_run_allowance_without_a_bucket():
+    assert run_allowance({"run_id": "manual__1"}) is None
@@ -0,0 +1,263 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("airflow")
+import boto3  # noqa: E402
+from airflow import DAG  # noqa: E402
+from airflow.exceptions import (
+    AirflowException,
+    AirflowRescheduleException,
+)  # noqa: E402
+from airflow.models import TaskInstance, TaskReschedule, XCom  # noqa: E402
+from airflow.utils import timezone  # noqa: E402
+from airflow.utils.db import create_session  # noqa: E402
+from botocore.stub import Stubber  # noqa: E402
+
+from dataops.ecs import ON_DEMAND, EcsRunTaskOperator, EcsTaskSensor  # noqa: E402
+from dataops.fargate_cost import COST_KEY  # noqa: E402
+
+CLUSTER = "MyCluster"
+TASK_ARN = "arn:aws:ecs:us-east-1:123456789012:task/MyCluster/0123456789abcdef"
+SPOT = [
+    {"capacityProvider": "FARGATE", "weight": 1, "base": 1},
+    {"capacityProvider": "FARGATE_SPOT", "weight": 3},
+]
+EXECUTION_DATE = timezone.datetime(2021, 3, 1)
+
+
+@pytest.fixture
+def ecs(monkeypatch):
+    """Stubbed ECS client handed to every operator."""
+    client = boto3.client("ecs", region_name="us-east-1")
+    with Stubber(client) as stubber:
+        monkeypatch.setattr(
+            "airflow.contrib.hooks.aws_hook.AwsHook.get_client_type",
+            lambda *args, **kwargs: client,
+        )
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+def run_operator(dag=None, **kwargs):
+    dag = dag or DAG("ecs_test", start_date=datetime(2021, 1, 1))
+    return EcsRunTaskOperator(
+        task_id="dbt_model",
+        dag=dag,
+        cluster=CLUSTER,
+        task_definition="dbt-cdk",
+        launch_type="FARGATE",
+        overrides={},
+        **kwargs,
+    )
+
+
+def expect_list_tasks(ecs, count):
+    ecs.add_response(
+        "list_tasks",
+        {"taskArns": [f"{TASK_ARN}{i}" for i in range(count)]},
+        {"cluster": CLUSTER, "family": "dbt-cdk", "desiredStatus": "RUNNING"},
+    )
+
+
+def expect_run_task(ecs, strategy=None, arn=TASK_ARN, failures=None):
+    params = {
+        "cluster": CLUSTER,
+        "taskDefinition": "dbt-cdk",
+        "overrides": {},
+        "startedBy": "airflow",
+        "platformVersion": "LATEST",
+    }
+    if strategy:
+        params["capacityProviderStrategy"] = strategy
+    else:
+        params["launchType"] = "FARGATE"
+    if failures:
+        response = {"tasks": [], "failures": failures}
+    else:
+        response = {"tasks": [{"taskArn": arn}], "failures": []}
+    ecs.add_response("run_task", response, params)
+
+
+def stopped(arn=TASK_ARN, stop_code="EssentialContainerExited", exit_code=0):
+    started = datetime(2021, 3, 1, 10)
+    return {
+        "taskArn": arn,
+        "lastStatus": "STOPPED",
+        "stopCode": stop_code,
+        "stoppedReason": stop_code,
+        "capacityProviderName": "FARGATE_SPOT",
+        "createdAt": started,
+        "pullStartedAt": started,
+        "stoppedAt": started + timedelta(minutes=3),
+        "cpu": "512",
+        "memory": "1024",
+        "containers": [{"name": "dbt-cdk-container", "exitCode": exit_code}],
+    }
+
+
+def running(arn=TASK_ARN):
+    return {"taskArn": arn, "lastStatus": "RUNNING", "containers": []}
+
+
+def expect_describe(ecs, task):
+    ecs.add_response(
+        "describe_tasks",
+        {"tasks": [task], "failures": []},
+        {"cluster": CLUSTER, "tasks": [task["taskArn"]]},
+    )
+
+
+@pytest.fixture
+def sensor(metadata_db):
+    """Sensor of a run task that started TASK_ARN on Spot."""
+    dag = DAG("ecs_test", start_date=datetime(2021, 1, 1))
+    run = run_operator(dag, capacity_provider_strategy=SPOT)
+    wait = EcsTaskSensor(task_id="dbt_model_wait", dag=dag, run_task_id=run.task_id)
+    run >> wait
+    with create_session() as session:
+        for model in (XCom, TaskReschedule, TaskInstance):
+            session.query(model).filter(model.dag_id == dag.dag_id).delete()
+    XCom.set(
+        key="return_value",
+        value=TASK_ARN,
+        execution_date=EXECUTION_DATE,
+        task_id=run.task_id,
+        dag_id=dag.dag_id,
+    )
+    return wait
+
+
+def sensor_context(sensor):
+    ti = TaskInstance(sensor, EXECUTION_DATE)
+    return {"ti": ti, "task_instance": ti, "run_id": "manual__1"}
+
+
+def add_reschedules(sensor, count):
+    """Pokes of the first try of the sensor that were rescheduled."""
+    now = timezone.utcnow()
+    with create_session() as session:
+        session.merge(TaskInstance(sensor, EXECUTION_DATE))
+        # The reschedules reference the task instance
+        session.flush()
+        for _ in range(count):
+            session.add(TaskReschedule(sensor, EXECUTION_DATE, 1, now, now, now))
+
+
+def reschedule_delay(sensor, context) -> float:
+    with pytest.raises(AirflowRescheduleException) as e:
+        sensor.execute(context)
+    return (e.value.reschedule_date - timezone.utcnow()).total_seconds()
+
+
+def current_arn(sensor):
+    ti = TaskInstance(sensor, EXECUTION_DATE)
+    return ti.xcom_pull(task_ids=sensor.run_task_id)
+
+
+def test_run_task_waits_at_the_running_limit(ecs):
+    operator = run_operator(running_limit=lambda context: 2)
+    expect_list_tasks(ecs, 2)
+
+    with pytest.raises(AirflowRescheduleException):
+        operator.execute({})
+
+
+def test_run_task_starts_under_the_running_limit(ecs):
+    operator = run_operator(running_limit=lambda context: 2)
+    expect_list_tasks(ecs, 1)
+    expect_run_task(ecs)
+
+    assert operator.execute({}) == TASK_ARN
+
+
+def test_run_task_without_a_limit_does_not_count(ecs):
+    operator = run_operator(running_limit=lambda context: None)
+    expect_run_task(ecs)
+
+    assert operator.execute({}) == TASK_ARN
+
+
+def test_submit_places_the_task_with_the_strategy(ecs):
+    operator = run_operator(capacity_provider_strategy=SPOT)
+    expect_run_task(ecs, SPOT)
+
+    assert operator.submit({}) == TASK_ARN
+
+
+def test_submit_falls_back_to_on_demand_without_spot_capacity(ecs):
+    operator = run_operator(capacity_provider_strategy=SPOT)
+    expect_run_task(ecs, SPOT, failures=[{"reason": "Capacity is unavailable"}])
+    expect_run_task(ecs, ON_DEMAND)
+
+    assert operator.submit({}) == TASK_ARN
+
+
+def test_submit_fails_when_the_task_does_not_start(ecs):
+    operator = run_operator()
+    expect_run_task(ecs, failures=[{"reason": "RESOURCE:MEMORY"}])
+
+    with pytest.raises(AirflowException):
+        operator.submit({})
+
+
+@pytest.mark.parametrize("pokes, interval", [(0, 30), (1, 60), (3, 240), (5, 300)])
+def test_poke_interval_doubles_up_to_the_maximum(ecs, sensor, pokes, interval):
+    add_reschedules(sensor, pokes)
+    expect_describe(ecs, running())
+
+    assert reschedule_delay(sensor, sensor_context(sensor)) == pytest.approx(
+        interval, abs=5
+    )
+
+
+def test_interrupted_task_starts_on_spot_then_on_demand(ecs, sensor):
+    context = sensor_context(sensor)
+    expect_describe(ecs, stopped(stop_code="SpotInterruption"))
+    expect_run_task(ecs, SPOT, arn=f"{TASK_ARN}-2")
+    assert not sensor.poke(context)
+    assert current_arn(sensor) == f"{TASK_ARN}-2"
+
+    expect_describe(ecs, stopped(f"{TASK_ARN}-2", stop_code="SpotInterruption"))
+    expect_run_task(ecs, ON_DEMAND, arn=f"{TASK_ARN}-3")
+    assert not sensor.poke(context)
+
+    expect_describe(ecs, stopped(f"{TASK_ARN}-3"))
+    expect_describe(ecs, stopped(f"{TASK_ARN}-3"))
+    assert sensor.poke(context)
+    cost = context["ti"].xcom_pull(task_ids=sensor.task_id, key=COST_KEY)
+    assert [attempt["stop_code"] for attempt in cost["attempts"]] == [
+        "SpotInterruption",
+        "SpotInterruption",
+        "EssentialContainerExited",
+    ]
+
+
+def test_retry_starts_a_failed_task_again(ecs, sensor):
+    expect_describe(ecs, stopped(exit_code=2))
+    expect_run_task(ecs, SPOT, arn=f"{TASK_ARN}-2")
+
+    sensor._resubmit_stopped(sensor_context(sensor))
+
+    assert current_arn(sensor) == f"{TASK_ARN}-2"
+
+
+def test_retry_keeps_a_task_that_succeeded(ecs, sensor):
+    expect_describe(ecs, stopped(exit_code=0))
+
+    sensor._resubmit_stopped(sensor_context(sensor))
+
+    assert current_arn(sensor) == TASK_ARN
+
+
+def test_retry_of_the_sensor_starts_the_task_again(ecs, sensor):
+    context = sensor_context(sensor)
+    # The first try was lost with its worker, after the task failed
+    context["ti"]._try_number = 1
+    expect_describe(ecs, stopped(exit_code=2))
+    expect_run_task(ecs, SPOT, arn=f"{TASK_ARN}-2")
+    expect_describe(ecs, running(f"{TASK_ARN}-2"))
+
+    # The new task is polled from the first poke interval
+    assert reschedule_delay(sensor, context) == pytest.approx(30, abs=5)
+    assert current_arn(sensor) == f"{TASK_ARN}-2"
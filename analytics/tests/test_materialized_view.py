@@ -0,0 +1,110 @@
+import re
+
+import pytest
+
+from conftest import copy_project, run_dbt
+
+SCHEMA = "dbt_tests_materialized_view"
+MODEL = "buyer_quantities_model"
+STATEMENT_RE = re.compile(
+    rf"On model\.dbt_dags\.{MODEL}: /\* .*? \*/\n(.*?)(?=\n\d{{4}}-\d\d-\d\d )", re.S
+)
+COMMANDS = [
+    "CREATE TABLE IF NOT EXISTS",
+    "CREATE MATERIALIZED VIEW",
+    "REFRESH MATERIALIZED VIEW",
+    "DROP MATERIALIZED VIEW",
+    "drop table",
+    "DELETE",
+    "INSERT",
+    "SELECT",
+]
+
+# Every run records its definition table first and looks the view up
+LOOKUP = ["CREATE TABLE IF NOT EXISTS", "SELECT"]
+CREATE = ["CREATE MATERIALIZED VIEW", "DELETE", "INSERT"]
+
+
+def statements(output: str) -> list:
+    """The commands the materialization ran for the model, in order."""
+    commands = []
+    for sql in STATEMENT_RE.findall(output):
+        for statement in sql.split(";\n"):
+            statement = statement.strip()
+            commands.append(next(c for c in COMMANDS if statement.startswith(c)))
+    return commands
+
+
+@pytest.fixture
+def project(tmp_path, postgres):
+    """The project building its models in SCHEMA, from a sales table there."""
+    with postgres.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+        cursor.execute(f"CREATE TABLE {SCHEMA}.sales (buyerid int, qtysold int)")
+        cursor.execute(f"INSERT INTO {SCHEMA}.sales VALUES (1, 2), (1, 3), (2, 1)")
+    yield copy_project(tmp_path, SCHEMA)
+    with postgres.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+
+
+def run(project: str, *args: str) -> list:
+    output = run_dbt(
+        project, "run", "-m", MODEL, "--vars", f"{{tickit_schema: {SCHEMA}}}", *args
+    )
+    return statements(output)
+
+
+def recorded(postgres) -> list:
+    """The recorded definitions and the materialized views in SCHEMA."""
+    with postgres.cursor() as cursor:
+        cursor.execute(
+            f"SELECT relation FROM {SCHEMA}.dbt_materialized_views "
+            f"UNION ALL SELECT matviewname FROM pg_matviews WHERE schemaname = %s",
+            (SCHEMA,),
+        )
+        return sorted(row[0] for row in cursor.fetchall())
+
+
+def created(postgres) -> list:
+    """What recorded() finds after the view was created."""
+    return [f'"{postgres.info.dbname}"."{SCHEMA}"."{MODEL}"', MODEL]
+
+
+def test_first_run_creates_the_view(project, postgres):
+    assert run(project) == LOOKUP + CREATE
+    assert recorded(postgres) == created(postgres)
+
+
+def test_unchanged_sql_refreshes_the_view(project, postgres):
+    run(project)
+
+    assert run(project) == LOOKUP + ["SELECT", "REFRESH MATERIALIZED VIEW"]
+    assert recorded(postgres) == created(postgres)
+
+
+def test_changed_sql_recreates_the_view(project, postgres):
+    run(project)
+    path = f"{project}/models/example/{MODEL}.sql"
+    with open(path, "a") as f:
+        f.write("HAVING count(*) > 0\n")
+
+    assert run(project) == LOOKUP + ["SELECT", "DROP MATERIALIZED VIEW"] + CREATE
+    assert run(project) == LOOKUP + ["SELECT", "REFRESH MATERIALIZED VIEW"]
+
+
+def test_full_refresh_recreates_the_view(project, postgres):
+    run(project)
+
+    assert run(project, "--full-refresh") == (
+        LOOKUP + ["SELECT", "DROP MATERIALIZED VIEW"] + CREATE
+    )
+    assert recorded(postgres) == created(postgres)
+
+
+def test_a_table_of_the_same_name_is_replaced(project, postgres):
+    with postgres.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {SCHEMA}.{MODEL} (buyerid int)")
+
+    assert run(project) == LOOKUP + ["drop table"] + CREATE
+    assert recorded(postgres) == created(postgres)
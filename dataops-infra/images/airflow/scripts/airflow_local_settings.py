@@ -0,0 +1,34 @@
+"""Cluster policy of the Airflow services: route tasks to Celery queues.
+
+Tasks left on the default queue are routed by operator type:
+
+* ecs-dispatch: operators that start or wait for ECS tasks, and the dbt
+  runner operator, served by a few worker slots (worker_ecs_dispatch_cdk);
+* light: every other task, served by many worker slots (worker_cdk).
+
+Set `queue` on a task to route it explicitly.
+"""
+from airflow.configuration import conf
+
+# Airflow copies every public name of this module into airflow.settings
+__all__ = ["policy"]
+
+LIGHT_QUEUE = "light"
+ECS_DISPATCH_QUEUE = "ecs-dispatch"
+# Class names, so the operators of the DAG helpers need not be importable
+ECS_DISPATCH_OPERATORS = {
+    "ECSOperator",
+    "EcsRunTaskOperator",
+    "EcsTaskSensor",
+    "DbtRunnerOperator",
+}
+
+
+def task_queue(task) -> str:
+    classes = {cls.__name__ for cls in type(task).__mro__}
+    return ECS_DISPATCH_QUEUE if classes & ECS_DISPATCH_OPERATORS else LIGHT_QUEUE
+
+
+def policy(task) -> None:
+    if task.queue == conf.get("celery", "default_queue"):
+        task.queue = task_queue(task)
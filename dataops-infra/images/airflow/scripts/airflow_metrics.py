@@ -0,0 +1,173 @@
+"""Publish Airflow load metrics to CloudWatch for worker autoscaling.
+
+Every AIRFLOW_METRICS_INTERVAL seconds it publishes, in the Airflow namespace:
+
+* PendingTasks: Celery messages waiting in the Redis broker, in total and
+  per queue (Queue dimension). Workers only leave messages in the broker
+  once all their slots are taken.
+* InFlightTasks: task instances queued or running in the metadata DB, in
+  total and per queue.
+* With AIRFLOW_PGBOUNCER_ENABLED=true, the PgBouncer pool of the metadata
+  DB (SHOW POOLS): PoolClientsActive, PoolClientsWaiting,
+  PoolServersActive, PoolServersIdle and PoolMaxWait, the wait in seconds
+  of the oldest client waiting for a server connection.
+
+Run it in a single service (the scheduler). Point REDIS_HOST,
+AIRFLOW_DATABASE_* and CLOUDWATCH_ENDPOINT_URL to local stand-ins to test,
+or pass --dry-run to only print the metrics.
+"""
+import argparse
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import boto3
+import psycopg2
+import redis
+
+NAMESPACE = os.environ.get("AIRFLOW_METRICS_NAMESPACE", "Airflow")
+INTERVAL = int(os.environ.get("AIRFLOW_METRICS_INTERVAL", "30"))
+# Celery queues to watch, "default" unless tasks set another queue
+QUEUES = os.environ.get("AIRFLOW_METRICS_QUEUES", "default").split(",")
+
+# The services reach the metadata DB through PgBouncer, see images/pgbouncer
+PGBOUNCER_ENABLED = os.environ.get("AIRFLOW_PGBOUNCER_ENABLED") == "true"
+
+log = logging.getLogger("airflow_metrics")
+
+
+def pending_tasks(broker: redis.Redis, queues: List[str]) -> Dict[str, int]:
+    # The Redis transport keeps each Celery queue in a list named after it
+    pipeline = broker.pipeline()
+    for queue in queues:
+        pipeline.llen(queue)
+    return dict(zip(queues, pipeline.execute()))
+
+
+def in_flight_tasks(conn, queues: List[str]) -> Dict[str, int]:
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT queue, count(*) FROM task_instance"
+            " WHERE state IN ('queued', 'running') GROUP BY queue"
+        )
+        counts = dict(cursor.fetchall())
+    # Queues without tasks are published as zero, so scaling in can happen
+    return {queue: counts.get(queue, 0) for queue in set(queues) | set(counts)}
+
+
+def pgbouncer_pools(conn, database: str) -> Dict[str, float]:
+    # One pool per database and user, on PgBouncer's admin database
+    with conn.cursor() as cursor:
+        cursor.execute("SHOW POOLS")
+        columns = [column.name for column in cursor.description]
+        pools = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    pools = [pool for pool in pools if pool["database"] == database]
+    return {
+        "PoolClientsActive": sum(pool["cl_active"] for pool in pools),
+        "PoolClientsWaiting": sum(pool["cl_waiting"] for pool in pools),
+        "PoolServersActive": sum(pool["sv_active"] for pool in pools),
+        "PoolServersIdle": sum(pool["sv_idle"] for pool in pools),
+        "PoolMaxWait": max(
+            (pool["maxwait"] + pool.get("maxwait_us", 0) / 1e6 for pool in pools),
+            default=0,
+        ),
+    }
+
+
+def metric_data(
+    pending: Dict[str, int],
+    in_flight: Dict[str, int],
+    pools: Optional[Dict[str, float]] = None,
+) -> List[dict]:
+    data = [
+        {"MetricName": "PendingTasks", "Value": sum(pending.values()), "Unit": "Count"},
+        {
+            "MetricName": "InFlightTasks",
+            "Value": sum(in_flight.values()),
+            "Unit": "Count",
+        },
+    ]
+    for name, value in sorted((pools or {}).items()):
+        data.append(
+            {
+                "MetricName": name,
+                "Value": value,
+                "Unit": "Seconds" if name == "PoolMaxWait" else "Count",
+            }
+        )
+    for name, counts in (("PendingTasks", pending), ("InFlightTasks", in_flight)):
+        for queue, count in sorted(counts.items()):
+            data.append(
+                {
+                    "MetricName": name,
+                    "Dimensions": [{"Name": "Queue", "Value": queue}],
+                    "Value": count,
+                    "Unit": "Count",
+                }
+            )
+    return data
+
+
+def connect_db(dbname: Optional[str] = None):
+    conn = psycopg2.connect(
+        host=os.environ["AIRFLOW_DATABASE_HOST"],
+        port=int(os.environ.get("AIRFLOW_DATABASE_PORT_NUMBER", "5432")),
+        dbname=dbname or os.environ["AIRFLOW_DATABASE_NAME"],
+        user=os.environ["AIRFLOW_DATABASE_USERNAME"],
+        password=os.environ["AIRFLOW_DATABASE_PASSWORD"],
+    )
+    conn.autocommit = True
+    return conn
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--once", action="store_true", help="publish once and exit")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="print the metrics instead"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s"
+    )
+    broker = redis.Redis(
+        host=os.environ.get("REDIS_HOST", "localhost"),
+        port=int(os.environ.get("REDIS_PORT_NUMBER", "6379")),
+        db=int(os.environ.get("AIRFLOW_METRICS_REDIS_DB", "1")),
+    )
+    cloudwatch = None
+    if not args.dry_run:
+        cloudwatch = boto3.client(
+            "cloudwatch", endpoint_url=os.environ.get("CLOUDWATCH_ENDPOINT_URL")
+        )
+    conn = None
+    admin_conn = None
+
+    while True:
+        started = time.monotonic()
+        try:
+            if conn is None or conn.closed:
+                conn = connect_db()
+            pools = None
+            if PGBOUNCER_ENABLED:
+                if admin_conn is None or admin_conn.closed:
+                    admin_conn = connect_db("pgbouncer")
+                pools = pgbouncer_pools(admin_conn, os.environ["AIRFLOW_DATABASE_NAME"])
+            data = metric_data(
+                pending_tasks(broker, QUEUES), in_flight_tasks(conn, QUEUES), pools
+            )
+            if args.dry_run:
+                for datum in data:
+                    print(datum)
+            else:
+                cloudwatch.put_metric_data(Namespace=NAMESPACE, MetricData=data)
+        except (redis.RedisError, psycopg2.Error):
+            log.exception("Could not collect Airflow metrics")
+            for connection in (conn, admin_conn):
+                if connection is not None:
+                    connection.close()
+        if args.once:
+            break
+        time.sleep(max(INTERVAL - (time.monotonic() - started), 0))
@@ -1,7 +1,12 @@
 #!/usr/bin/env bash
 
-# Sync dags from s3 every minute
-sh ./sync_dags.sh &
+# Sync dags from s3 on change notifications (with a polling fallback)
+python /sync_dags.py &
+
+# Publish queue depth metrics for worker autoscaling
+if [ "$AIRFLOW_METRICS_ENABLED" = "true" ]; then
+  python /airflow_metrics.py &
+fi
 
 # Run base image entrypoint
 exec /app-entrypoint.sh "$@"
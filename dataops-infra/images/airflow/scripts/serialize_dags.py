@@ -0,0 +1,148 @@
+"""Serialize the DAGs of the DAGs folder into the Airflow metadata DB.
+
+With store_serialized_dags, the webserver renders DAGs from the
+serialized_dag table instead of importing the DAG files. The scheduler
+refreshes that table as it parses the files, at most every
+min_serialized_dag_update_interval. Running this script after a DAG sync
+stores the new DAGs right away, and only re-imports the files whose source
+changed: the sha256 of each file is compared to the code stored alongside
+its serialized DAGs.
+
+DAG files also build their tasks from the other files of the folder, like
+dbt/manifest.json and the dataops helpers. The sha256 of those files, as
+of each DAG file's serialization, is kept in the
+serialized_dags_dependencies variable: when any of them changed, every DAG
+file serialized before the change is stale.
+
+    $ python serialize_dags.py          # serialize the stale files
+    $ python serialize_dags.py --check  # list the stale files, exit 1 if any
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+from typing import Dict, List
+
+from airflow import settings
+from airflow.models import DagBag, Variable
+from airflow.models.dagcode import DagCode
+from airflow.models.serialized_dag import SerializedDagModel
+from airflow.utils.db import provide_session
+from airflow.utils.file import list_py_file_paths
+
+log = logging.getLogger("serialize_dags")
+DEPENDENCIES_KEY = "serialized_dags_dependencies"
+
+
+def source_hash(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def dependencies_hash(dags_folder: str, dag_files: List[str]) -> str:
+    """sha256 of every file of the DAGs folder that is not a DAG file."""
+    digest = hashlib.sha256()
+    dag_files = {os.path.abspath(path) for path in dag_files}
+    for root, dirs, files in os.walk(dags_folder):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if name.endswith(".pyc") or os.path.abspath(path) in dag_files:
+                continue
+            digest.update(os.path.relpath(path, dags_folder).encode() + b"\0")
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def _stored_dependencies(session) -> Dict[str, str]:
+    variable = session.query(Variable).filter(Variable.key == DEPENDENCIES_KEY).first()
+    return json.loads(variable.val) if variable else {}
+
+
+@provide_session
+def stale_files(dags_folder: str, session=None) -> Dict[str, str]:
+    """Return the DAG files whose serialized DAGs are missing or out of date,
+    with the reason, including serialized files that no longer exist."""
+    stored = {
+        fileloc: source_hash(source)
+        for fileloc, source in session.query(DagCode.fileloc, DagCode.source_code)
+    }
+    serialized = {fileloc for (fileloc,) in session.query(SerializedDagModel.fileloc)}
+    dependencies = _stored_dependencies(session)
+
+    stale = {}
+    files = list_py_file_paths(dags_folder, include_examples=False)
+    current = dependencies_hash(dags_folder, files)
+    for fileloc in files:
+        if fileloc not in stored or fileloc not in serialized:
+            stale[fileloc] = "new"
+            continue
+        with open(fileloc, encoding="utf-8") as f:
+            if source_hash(f.read()) != stored[fileloc]:
+                stale[fileloc] = "changed"
+            elif dependencies.get(fileloc) != current:
+                stale[fileloc] = "dependencies changed"
+    for fileloc in serialized - set(files):
+        stale[fileloc] = "deleted"
+    return stale
+
+
+@provide_session
+def serialize(dags_folder: str, session=None) -> int:
+    """Serialize the stale DAG files and return the number of import errors."""
+    stale = stale_files(dags_folder, session=session)
+    alive = list_py_file_paths(dags_folder, include_examples=False)
+    current = dependencies_hash(dags_folder, alive)
+    dependencies = {
+        fileloc: digest
+        for fileloc, digest in _stored_dependencies(session).items()
+        if fileloc in alive
+    }
+    errors = 0
+    for fileloc, reason in sorted(stale.items()):
+        if reason == "deleted":
+            continue
+        with open(fileloc, encoding="utf-8") as f:
+            source = f.read()
+        dagbag = DagBag(fileloc, include_examples=False, store_serialized_dags=False)
+        for path, error in dagbag.import_errors.items():
+            log.error("Could not import %s: %s", path, error)
+            errors += 1
+        for dag in dagbag.dags.values():
+            if not dag.is_subdag:
+                # Ignores min_serialized_dag_update_interval, unlike sync_to_db
+                SerializedDagModel.write_dag(dag, session=session)
+                session.flush()
+            dag.sync_to_db(session=session)
+        if dagbag.dags:
+            # Store the exact source the DAGs were serialized from
+            session.merge(DagCode(fileloc, source))
+            dependencies[fileloc] = current
+        log.info("Serialized %s (%s): %s", fileloc, reason, sorted(dagbag.dag_ids))
+
+    Variable.set(DEPENDENCIES_KEY, dependencies, serialize_json=True, session=session)
+    SerializedDagModel.remove_deleted_dags(alive, session=session)
+    DagCode.remove_deleted_code(alive, session=session)
+    session.commit()
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dags-folder", default=settings.DAGS_FOLDER)
+    parser.add_argument(
+        "--check", action="store_true", help="only list the stale files"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s"
+    )
+    if args.check:
+        stale = stale_files(args.dags_folder)
+        for fileloc, reason in sorted(stale.items()):
+            print(f"{reason}: {fileloc}")
+        sys.exit(1 if stale else 0)
+    sys.exit(1 if serialize(args.dags_folder) else 0)
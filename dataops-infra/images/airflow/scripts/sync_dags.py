@@ -0,0 +1,289 @@
+"""Sync Airflow DAGs from Amazon S3.
+
+Listens to S3 change notifications delivered through an SQS queue
+(DAGS_SYNC_QUEUE_URL) and falls back to a periodic full listing, every
+DAGS_SYNC_POLL_INTERVAL seconds. A queue message reaches a single
+consumer, so only give a queue to a service running a single task; the
+others list the bucket every minute by default. Only objects whose ETag
+changed are downloaded. Each sync is published as a new release directory
+and swapped into the DAGs folder atomically, so Airflow never parses a
+half-synced tree. A failed sync is logged and retried with a backoff,
+keeping the published release.
+
+Point S3_ENDPOINT_URL / SQS_ENDPOINT_URL to a local S3 stand-in for testing.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import unquote_plus
+
+import boto3
+from botocore.exceptions import ClientError
+
+BUCKET_NAME = os.environ.get("BUCKET_NAME")
+PREFIX = os.environ.get("DAGS_SYNC_PREFIX", "airflow_dags/")
+DAGS_FOLDER = os.environ.get("DAGS_SYNC_TARGET", "/opt/bitnami/airflow/dags")
+STATE_DIR = os.environ.get("DAGS_SYNC_STATE_DIR", "/opt/bitnami/airflow/.dags_sync")
+QUEUE_URL = os.environ.get("DAGS_SYNC_QUEUE_URL")
+# Full listings are only a safety net when notifications are available
+POLL_INTERVAL = int(
+    os.environ.get("DAGS_SYNC_POLL_INTERVAL", "300" if QUEUE_URL else "60")
+)
+RELEASES_TO_KEEP = 2
+# Wait after a failed sync, doubled while it keeps failing
+BACKOFF_SECONDS = 5
+MAX_BACKOFF_SECONDS = 300
+# Store the serialized DAGs of each release (see serialize_dags.py)
+SERIALIZE_ON_SYNC = os.environ.get("DAGS_SERIALIZE_ON_SYNC") == "true"
+SERIALIZE_SCRIPT = os.path.join(os.path.dirname(__file__), "serialize_dags.py")
+
+log = logging.getLogger("sync_dags")
+
+
+class DagSync:
+    def __init__(self, s3, sqs=None) -> None:
+        self.s3 = s3
+        self.sqs = sqs
+        self.releases_dir = os.path.join(STATE_DIR, "releases")
+        self.index_path = os.path.join(STATE_DIR, "index.json")
+        self.index = self._load_index()
+
+    def _load_index(self) -> Dict[str, dict]:
+        # key -> {"etag", "size"} of the objects in the published release
+        if not os.path.exists(self.index_path) or not os.path.islink(DAGS_FOLDER):
+            return {}
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def reconcile(self) -> None:
+        remote = {}
+        latest = None
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=PREFIX):
+            for obj in page.get("Contents", []):
+                if obj["Key"].endswith("/"):
+                    continue
+                remote[obj["Key"]] = {"etag": obj["ETag"], "size": obj["Size"]}
+                if latest is None or obj["LastModified"] > latest:
+                    latest = obj["LastModified"]
+
+        changed = [
+            key
+            for key, meta in remote.items()
+            if self.index.get(key, {}).get("etag") != meta["etag"]
+        ]
+        removed = [key for key in self.index if key not in remote]
+        self.publish(changed, removed, latest)
+
+    def listen(self) -> None:
+        next_reconcile = time.monotonic()
+        failures = 0
+        while True:
+            try:
+                if time.monotonic() >= next_reconcile:
+                    self.reconcile()
+                    next_reconcile = time.monotonic() + POLL_INTERVAL
+                if self.sqs is not None:
+                    self._handle_notifications()
+                else:
+                    time.sleep(max(0.0, next_reconcile - time.monotonic()))
+                failures = 0
+            except Exception:
+                # The entrypoint starts the sync once: never let it exit. The
+                # messages are delivered again and a failed full listing is
+                # retried on the next iteration.
+                failures += 1
+                backoff = min(
+                    BACKOFF_SECONDS * 2 ** (failures - 1), MAX_BACKOFF_SECONDS
+                )
+                log.exception("sync failed, retrying in %ds", backoff)
+                time.sleep(backoff)
+
+    def _handle_notifications(self) -> None:
+        # Long-poll for the first message, then drain whatever else a deploy
+        # produced so that it ends up in a single release.
+        messages = []
+        wait = 20
+        while True:
+            batch = self.sqs.receive_message(
+                QueueUrl=QUEUE_URL, MaxNumberOfMessages=10, WaitTimeSeconds=wait
+            ).get("Messages", [])
+            if not batch:
+                break
+            messages += batch
+            wait = 1
+        if not messages:
+            return
+
+        created, removed = set(), set()
+        oldest = None
+        for record in _s3_records(messages):
+            key = unquote_plus(record["s3"]["object"]["key"])
+            if not key.startswith(PREFIX) or key.endswith("/"):
+                continue
+            event_time = datetime.strptime(
+                record["eventTime"], "%Y-%m-%dT%H:%M:%S.%fZ"
+            ).replace(tzinfo=timezone.utc)
+            oldest = event_time if oldest is None else min(oldest, event_time)
+            if record["eventName"].startswith("ObjectCreated"):
+                created.add(key)
+            else:
+                removed.add(key)
+
+        # Notifications may arrive out of order: trust S3 over the event type
+        for key in sorted(created | removed):
+            try:
+                head = self.s3.head_object(Bucket=BUCKET_NAME, Key=key)
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                    raise
+                created.discard(key)
+                removed.add(key)
+                continue
+            removed.discard(key)
+            if self.index.get(key, {}).get("etag") == head["ETag"]:
+                created.discard(key)
+            else:
+                created.add(key)
+
+        self.publish(
+            sorted(created), sorted(k for k in removed if k in self.index), oldest
+        )
+        for start in range(0, len(messages), 10):
+            self.sqs.delete_message_batch(
+                QueueUrl=QUEUE_URL,
+                Entries=[
+                    {"Id": str(i), "ReceiptHandle": message["ReceiptHandle"]}
+                    for i, message in enumerate(messages[start : start + 10])
+                ],
+            )
+
+    def publish(
+        self, changed: List[str], removed: List[str], changed_at: Optional[datetime]
+    ) -> None:
+        if not changed and not removed and os.path.islink(DAGS_FOLDER):
+            return
+
+        started = time.monotonic()
+        os.makedirs(self.releases_dir, exist_ok=True)
+        release = os.path.join(self.releases_dir, str(time.time_ns()))
+        current = os.path.realpath(DAGS_FOLDER) if os.path.islink(DAGS_FOLDER) else None
+
+        # Unchanged files are hard links into the current release
+        if current and os.path.isdir(current):
+            shutil.copytree(current, release, copy_function=os.link)
+        else:
+            os.makedirs(release)
+
+        index = dict(self.index)
+        bytes_moved = 0
+        for key in changed:
+            path = os.path.join(release, key[len(PREFIX) :])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.sync-tmp"
+            response = self.s3.get_object(Bucket=BUCKET_NAME, Key=key)
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(response["Body"], f)
+            os.replace(tmp_path, path)
+            index[key] = {"etag": response["ETag"], "size": response["ContentLength"]}
+            bytes_moved += response["ContentLength"]
+        for key in removed:
+            path = os.path.join(release, key[len(PREFIX) :])
+            if os.path.exists(path):
+                os.remove(path)
+            index.pop(key, None)
+
+        self._swap(release)
+        self._write_index(index)
+        self._prune_releases(release)
+
+        latency = (
+            (datetime.now(timezone.utc) - changed_at).total_seconds()
+            if changed_at
+            else 0.0
+        )
+        log.info(
+            "published %s: %d changed, %d removed, %d bytes moved, "
+            "sync took %.2fs, %.1fs after the change",
+            os.path.basename(release),
+            len(changed),
+            len(removed),
+            bytes_moved,
+            time.monotonic() - started,
+            latency,
+        )
+        if SERIALIZE_ON_SYNC:
+            self.serialize()
+
+    def serialize(self) -> None:
+        # In a separate process: importing the DAGs must not affect the sync
+        started = time.monotonic()
+        result = subprocess.run([sys.executable, SERIALIZE_SCRIPT])
+        log.info(
+            "serialized DAGs in %.2fs (exit code %d)",
+            time.monotonic() - started,
+            result.returncode,
+        )
+
+    def _swap(self, release: str) -> None:
+        if os.path.isdir(DAGS_FOLDER) and not os.path.islink(DAGS_FOLDER):
+            # First run: the image ships DAGS_FOLDER as a plain directory
+            shutil.rmtree(DAGS_FOLDER)
+        tmp_link = f"{DAGS_FOLDER}.sync-tmp"
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(release, tmp_link)
+        os.replace(tmp_link, DAGS_FOLDER)
+
+    def _write_index(self, index: Dict[str, dict]) -> None:
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+        self.index = index
+
+    def _prune_releases(self, current: str) -> None:
+        # Keep the previous release around for processes still reading it
+        releases = sorted(os.listdir(self.releases_dir), key=int)
+        for name in releases[:-RELEASES_TO_KEEP]:
+            path = os.path.join(self.releases_dir, name)
+            if path != current:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def _s3_records(messages: List[dict]) -> Iterable[dict]:
+    for message in messages:
+        body = json.loads(message["Body"])
+        # Accept both raw and SNS-enveloped deliveries
+        if body.get("Type") == "Notification":
+            body = json.loads(body["Message"])
+        yield from body.get("Records", [])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--once", action="store_true", help="run a single full sync and exit"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s"
+    )
+    s3 = boto3.client("s3", endpoint_url=os.environ.get("S3_ENDPOINT_URL"))
+    sqs = None
+    if QUEUE_URL and not args.once:
+        sqs = boto3.client("sqs", endpoint_url=os.environ.get("SQS_ENDPOINT_URL"))
+
+    sync = DagSync(s3, sqs)
+    if args.once:
+        sync.reconcile()
+    else:
+        sync.listen()
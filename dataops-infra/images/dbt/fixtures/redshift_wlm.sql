@@ -0,0 +1,88 @@
+-- Redshift WLM system tables for a local Postgres stand-in, with rows
+-- recorded on a 2-node cluster with manual WLM while dbt ran alongside a
+-- BI refresh. Query times are stored relative to the load time and the
+-- queries are attributed to the user loading the fixture.
+--
+--   $ psql -f fixtures/redshift_wlm.sql
+--   $ python scripts/dbt_threads.py --no-record --dsn "host=localhost user=postgres" -- dbt run
+DROP TABLE IF EXISTS stl_wlm_query;
+DROP TABLE IF EXISTS stv_wlm_service_class_config;
+
+CREATE TABLE stv_wlm_service_class_config (
+    service_class integer,
+    queueing_strategy char(32),
+    num_query_tasks integer,
+    query_working_mem integer,
+    max_execution_time bigint,
+    name char(64)
+);
+
+INSERT INTO stv_wlm_service_class_config VALUES
+    (5, 'FIFO', 1, 256, 0, 'Superuser queue'),
+    (6, 'FIFO', 4, 350, 0, 'etl'),
+    (7, 'FIFO', 2, 700, 0, 'Default queue'),
+    (14, 'FIFO', 6, 64, 0, 'Short query queue'),
+    (15, 'FIFO', 1, 64, 0, 'Maintenance queue');
+
+CREATE TABLE stl_wlm_query (
+    userid integer,
+    query integer,
+    service_class integer,
+    slot_count integer,
+    queue_start_time timestamp,
+    queue_end_time timestamp,
+    total_queue_time bigint,
+    exec_start_time timestamp,
+    exec_end_time timestamp,
+    total_exec_time bigint,
+    final_state char(16)
+);
+
+-- (query, service class, minutes ago, queue time, exec time), microseconds
+INSERT INTO stl_wlm_query
+SELECT
+    (SELECT usesysid FROM pg_user WHERE usename = current_user),
+    query,
+    service_class,
+    1,
+    queued_at,
+    queued_at + queue_us * interval '1 microsecond',
+    queue_us,
+    queued_at + queue_us * interval '1 microsecond',
+    queued_at + (queue_us + exec_us) * interval '1 microsecond',
+    exec_us,
+    'Completed'
+FROM (
+    SELECT
+        query,
+        service_class,
+        (now() AT TIME ZONE 'utc') - minutes_ago * interval '1 minute' AS queued_at,
+        queue_us,
+        exec_us
+    FROM (VALUES
+        -- Three hours ago, dbt alone on the cluster
+        (418201, 6, 185, 0, 2481133),
+        (418202, 6, 185, 0, 1923871),
+        (418207, 6, 184, 11020, 5120392),
+        (418210, 6, 184, 0, 812044),
+        (418233, 14, 183, 0, 102311),
+        (418240, 6, 183, 0, 3380021),
+        -- Last hour, while the BI refresh holds the etl queue
+        (421877, 6, 48, 0, 2790312),
+        (421878, 6, 48, 0, 2011876),
+        (421879, 6, 48, 0, 1744010),
+        (421880, 6, 48, 0, 2302334),
+        (421884, 6, 47, 7214480, 4410237),
+        (421885, 6, 47, 9876012, 1220938),
+        (421891, 14, 46, 0, 88127),
+        (421902, 6, 46, 12450199, 6012774),
+        (421903, 6, 45, 3120002, 2233109),
+        (421915, 6, 44, 0, 1502286),
+        (421916, 6, 44, 15604418, 3988120),
+        (421930, 6, 43, 880213, 902112),
+        (421931, 6, 43, 0, 1120774),
+        (421944, 7, 42, 0, 19873201),
+        (421950, 6, 41, 21087331, 2660091),
+        (421951, 6, 41, 4022190, 1870443)
+    ) AS recorded (query, service_class, minutes_ago, queue_us, exec_us)
+) AS queries;
@@ -0,0 +1,88 @@
+"""Build the command line of production `dbt run` invocations.
+
+Shared by entrypoint.sh and dbt_runner.py:
+
+    $ python dbt_args.py [--state DIR] [--full-refresh] [--threads N]
+        [--exclude MODEL ...] -- dbt run --models a
+
+prints the final arguments, one per line.
+"""
+import argparse
+from typing import List, Optional
+
+SELECTOR_FLAGS = {"-m", "--models", "-s", "--select"}
+
+
+def production_args(
+    args: List[str],
+    state: Optional[str] = None,
+    full_refresh: bool = False,
+    threads: Optional[int] = None,
+    exclude: Optional[List[str]] = None,
+) -> List[str]:
+    prefix = args[:1] if args[:1] == ["dbt"] else []
+    args = args[len(prefix) :]
+    if args[:1] != ["run"]:
+        return prefix + args
+
+    if state:
+        # Only build modified models and their descendants, deferring
+        # unchanged parents to the production relations of the previous run.
+        # Incremental models (and their descendants) always run to pick up
+        # new data.
+        selected = False
+        in_selector = False
+        rewritten = []
+        for arg in args:
+            if arg in SELECTOR_FLAGS:
+                selected = in_selector = True
+                rewritten.append(arg)
+            elif arg.startswith("-"):
+                in_selector = False
+                rewritten.append(arg)
+            elif in_selector:
+                rewritten += [
+                    f"state:modified+,{arg}",
+                    f"config.materialized:incremental+,{arg}",
+                ]
+            else:
+                rewritten.append(arg)
+        if not selected:
+            rewritten += [
+                "--models",
+                "state:modified+",
+                "config.materialized:incremental+",
+            ]
+        args = rewritten + ["--defer", "--state", state]
+
+    if full_refresh:
+        # Rebuild incremental models from scratch
+        args.append("--full-refresh")
+    if exclude:
+        # Models with unchanged sources, see source_fingerprint.py. dbt only
+        # keeps the last --exclude flag, extend an existing one.
+        if "--exclude" in args:
+            position = args.index("--exclude") + 1
+            args = args[:position] + exclude + args[position:]
+        else:
+            args += ["--exclude"] + exclude
+    if threads:
+        # Picked per run by dbt_threads.py, overrides the profile
+        args += ["--threads", str(threads)]
+    return prefix + args
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--state", help="directory with the previous manifest")
+    parser.add_argument("--full-refresh", action="store_true")
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--exclude", nargs="+")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    parsed = parser.parse_args()
+
+    args = parsed.args[1:] if parsed.args[:1] == ["--"] else parsed.args
+    for arg in production_args(
+        args, parsed.state, parsed.full_refresh, parsed.threads, parsed.exclude
+    ):
+        print(arg)
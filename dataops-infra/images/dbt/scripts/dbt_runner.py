@@ -0,0 +1,281 @@
+"""Long-lived dbt runner.
+
+Pulls run requests from a Redis list and runs dbt in-process, so the
+interpreter, the project sync and the parsed project survive between runs.
+The project is only re-synced and re-parsed when its content hash changes.
+Results are pushed back to a per-request Redis list read by Airflow's
+DbtRunnerOperator.
+
+Request: {"id": "...",
+          "command": ["dbt", "run", ...] | ["save-state"] | ["threads"],
+          "state_aware": true, "full_refresh": false, "run_id": "<dag run>"}
+
+Start it from the project directory (the image entrypoint does that). Set
+DBT_RUNNER_SYNC=false and DBT_TARGET=local to test against a local Redis and
+Postgres.
+"""
+import copy
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import time
+import traceback
+
+import boto3
+import redis
+import dbt.task.runnable
+from botocore.exceptions import ClientError
+from dbt.adapters.factory import get_adapter
+from dbt.logger import log_manager
+from dbt.main import handle_and_check
+
+from dbt_args import production_args
+from dbt_threads import choose_threads, plan_run
+import source_fingerprint
+from upload_artifacts import upload_artifacts
+
+REQUEST_QUEUE = "dbt:runs"
+RESULT_PREFIX = "dbt:results:"
+RESULT_TTL = 24 * 60 * 60
+
+BUCKET_NAME = os.environ.get("BUCKET_NAME")
+STATE_KEY = f"{os.environ.get('DBT_STATE_PREFIX', 'dbt_state')}/manifest.json"
+SYNC = os.environ.get("DBT_RUNNER_SYNC", "true") == "true"
+TARGET = os.environ.get("DBT_TARGET")
+ADAPTIVE_THREADS = os.environ.get("DBT_ADAPTIVE_THREADS") == "true"
+SOURCE_FINGERPRINTS = os.environ.get("DBT_SOURCE_FINGERPRINTS") == "true"
+IGNORED_DIRS = {"target", "logs", "state", "dbt_modules"}
+
+log = logging.getLogger("dbt_runner")
+
+
+class ManifestCache:
+    """Keeps the parsed project in memory between invocations."""
+
+    def __init__(self) -> None:
+        self.project_hash = None
+        self._key = None
+        self._manifest = None
+        self._load = dbt.task.runnable.get_full_manifest
+
+    def get_full_manifest(self, config, *, reset=False):
+        key = (
+            self.project_hash,
+            config.target_name,
+            json.dumps(config.cli_vars, sort_keys=True, default=str),
+        )
+        if key != self._key:
+            started = time.monotonic()
+            manifest = self._load(config, reset=reset)
+            self._key, self._manifest = key, copy.deepcopy(manifest)
+            log.info("parsed project in %.2fs", time.monotonic() - started)
+            return manifest
+
+        # Tasks compile nodes in place: hand out a copy of the cached manifest
+        manifest = copy.deepcopy(self._manifest)
+        get_adapter(config).connections.set_query_header(manifest)
+        return manifest
+
+
+class DbtRunner:
+    def __init__(self, s3) -> None:
+        self.s3 = s3
+        self.cache = ManifestCache()
+        dbt.task.runnable.get_full_manifest = self.cache.get_full_manifest
+        # dbt expects to set up its file logger once per process
+        set_log_path = log_manager.set_path
+        log_manager.set_path = lambda path: (
+            None if log_manager._file_handler.initialized else set_log_path(path)
+        )
+        self.remote_hash = None
+        self.refresh_project()
+
+    def refresh_project(self) -> None:
+        if SYNC:
+            # One listing tells whether the project changed in S3
+            digest = hashlib.sha256()
+            paginator = self.s3.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix="dbt_dags/"):
+                for obj in page.get("Contents", []):
+                    digest.update(f"{obj['Key']}:{obj['ETag']}\n".encode())
+            if digest.hexdigest() != self.remote_hash:
+                subprocess.run(
+                    [
+                        "aws",
+                        "s3",
+                        "sync",
+                        f"s3://{BUCKET_NAME}/dbt_dags",
+                        ".",
+                        "--delete",
+                    ]
+                    + [arg for d in IGNORED_DIRS for arg in ("--exclude", f"{d}/*")],
+                    check=True,
+                )
+                self.remote_hash = digest.hexdigest()
+
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk("."):
+            dirs[:] = sorted(d for d in dirs if d not in IGNORED_DIRS)
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(path.encode())
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+        if digest.hexdigest() != self.cache.project_hash:
+            log.info("project hash is now %s", digest.hexdigest())
+            self.cache.project_hash = digest.hexdigest()
+
+    def fetch_state(self) -> bool:
+        if not self.s3:
+            return False
+        try:
+            os.makedirs("state", exist_ok=True)
+            self.s3.download_file(BUCKET_NAME, STATE_KEY, "state/manifest.json")
+            return True
+        except ClientError:
+            log.info(
+                "no previous manifest at %s, running all selected models", STATE_KEY
+            )
+            return False
+
+    def threads(self, command, run_id=None):
+        if not ADAPTIVE_THREADS or command[1:2] != ["run"]:
+            return None
+        manifest = "target/manifest.json"
+        if not os.path.exists(manifest):
+            manifest = "state/manifest.json"
+        try:
+            return choose_threads(
+                command, manifest, self.s3, BUCKET_NAME, run_id=run_id
+            )["threads"]
+        except Exception:
+            log.exception("could not pick the thread count, using the profile's")
+            return None
+
+    def unchanged_models(self, command, full_refresh):
+        if not SOURCE_FINGERPRINTS or command[1:2] != ["run"]:
+            return None
+        try:
+            # Cheap with the project parsed, writes the current manifest
+            if not self.invoke(["ls", "--resource-type", "model"]):
+                return None
+            return source_fingerprint.plan(
+                command,
+                "target/manifest.json",
+                self.s3,
+                BUCKET_NAME,
+                rebuild_all=full_refresh,
+            )
+        except Exception:
+            log.exception("could not fingerprint the sources, building all models")
+            return None
+
+    def invoke(self, args):
+        if TARGET:
+            args = args + ["--target", TARGET]
+        log.info("running dbt %s", " ".join(args))
+        # `dbt ls` moves console output to stderr, restore it for other commands
+        log_manager.stdout_console()
+        _, success = handle_and_check(args)
+        return success
+
+    def run(self, request: dict) -> dict:
+        started = time.monotonic()
+        self.refresh_project()
+        command = request["command"]
+
+        if command == ["threads"]:
+            # Once per DAG run, over the graph of the last production manifest
+            success = True
+            if ADAPTIVE_THREADS:
+                self.fetch_state()
+                plan_run("state/manifest.json", request["run_id"], self.s3, BUCKET_NAME)
+        elif command == ["save-state"]:
+            success = self.invoke(["ls", "--resource-type", "model"])
+            if success and self.s3:
+                self.s3.upload_file("target/manifest.json", BUCKET_NAME, STATE_KEY)
+        else:
+            state = (
+                "state" if request.get("state_aware") and self.fetch_state() else None
+            )
+            full_refresh = request.get("full_refresh", False)
+            args = production_args(
+                command,
+                state,
+                full_refresh,
+                self.threads(command, request.get("run_id")),
+                self.unchanged_models(command, full_refresh),
+            )
+            success = self.invoke(args[1:] if args[:1] == ["dbt"] else args)
+            if SOURCE_FINGERPRINTS:
+                source_fingerprint.record(s3=self.s3, bucket=BUCKET_NAME)
+
+        if self.s3 and request.get("run_id"):
+            upload_artifacts(self.s3, BUCKET_NAME, request["run_id"])
+
+        results = []
+        if os.path.exists("target/run_results.json"):
+            with open("target/run_results.json") as f:
+                run_results = json.load(f)
+            results = [
+                {
+                    "unique_id": result["unique_id"],
+                    "status": result["status"],
+                    "execution_time": result["execution_time"],
+                }
+                for result in run_results["results"]
+            ]
+        return {
+            "id": request["id"],
+            "success": bool(success),
+            "elapsed": time.monotonic() - started,
+            "results": results,
+        }
+
+
+if __name__ == "__main__":
+    # dbt takes over the root logger, keep a handler of our own
+    handler = logging.StreamHandler()
+    handler.setFormatter(
+        logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s")
+    )
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    queue = redis.Redis(
+        host=os.environ.get("REDIS_HOST", "localhost"),
+        port=int(os.environ.get("REDIS_PORT", "6379")),
+        db=int(os.environ.get("DBT_RUNNER_REDIS_DB", "2")),
+    )
+    runner = DbtRunner(boto3.client("s3") if SYNC else None)
+
+    log.info("waiting for run requests on %s", REQUEST_QUEUE)
+    while True:
+        item = queue.blpop(REQUEST_QUEUE, timeout=60)
+        if item is None:
+            continue
+        request = json.loads(item[1])
+        # Remove stale artifacts so results always belong to this request
+        for artifact in (
+            "target/run_results.json",
+            "target/threads.json",
+            source_fingerprint.PENDING_PATH,
+        ):
+            if os.path.exists(artifact):
+                os.remove(artifact)
+        try:
+            result = runner.run(request)
+        except Exception:
+            log.exception("run %s failed", request.get("id"))
+            result = {
+                "id": request.get("id"),
+                "success": False,
+                "error": traceback.format_exc(),
+                "results": [],
+            }
+        key = f"{RESULT_PREFIX}{result['id']}"
+        queue.pipeline().rpush(key, json.dumps(result)).expire(
+            key, RESULT_TTL
+        ).execute()
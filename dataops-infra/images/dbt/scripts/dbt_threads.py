@@ -0,0 +1,364 @@
+"""Pick the number of dbt threads of a production run.
+
+A run uses as many threads as the widest layer of its selected models in
+the manifest (more threads than models that can run side by side never
+help), up to an allowance shared by all runs. The allowance follows the
+queue wait of dbt's recent queries (stl_wlm_query): it grows by one per run
+while their p90 queue wait stays under DBT_QUEUE_WAIT_TARGET seconds and
+halves when it goes over, within DBT_MAX_THREADS and the slots of the
+Redshift WLM queues dbt's queries land in.
+
+Each decision is saved to s3://$BUCKET_NAME/dbt_state/threads.json, as the
+starting point of the next run, and to target/threads.json, which is
+uploaded with the run artifacts.
+
+    $ python dbt_threads.py --manifest state/manifest.json -- dbt run -m a b
+
+prints the thread count. Pass --dsn to read the system tables of a local
+Postgres loaded with fixtures/redshift_wlm.sql, and --no-record to keep
+the decision out of S3.
+
+The Airflow DAG runs a dbt task per model, each of them a single thread.
+It decides once per DAG run instead, before the first model:
+
+    $ python dbt_threads.py --manifest state/manifest.json --run-id <id> --plan
+
+measures the whole graph, saves the decision to
+s3://$BUCKET_NAME/dbt_artifacts/<id>/threads.json and prints its thread
+count, the number of model tasks the DAG runs at once. Commands passed
+with the same --run-id use that allowance and leave the shared decision
+alone. Without DBT_ADAPTIVE_THREADS, the entrypoint prints the static
+thread count of the dbt profile instead:
+
+    $ python dbt_threads.py --profile-threads
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import boto3
+import psycopg2
+import yaml
+from botocore.exceptions import ClientError
+
+from upload_artifacts import ARTIFACTS_PREFIX
+
+BUCKET_NAME = os.environ.get("BUCKET_NAME")
+DECISION_KEY = f"{os.environ.get('DBT_STATE_PREFIX', 'dbt_state')}/threads.json"
+MAX_THREADS = int(os.environ.get("DBT_MAX_THREADS", "8"))
+QUEUE_WAIT_TARGET = float(os.environ.get("DBT_QUEUE_WAIT_TARGET", "5"))
+QUEUE_WAIT_WINDOW = int(os.environ.get("DBT_QUEUE_WAIT_WINDOW", "60"))
+SELECTOR_FLAGS = {"-m", "--models", "-s", "--select"}
+
+# User queues only: 6-13 with manual WLM, 100-107 with automatic WLM. The
+# other service classes are system, short query acceleration and
+# maintenance queues.
+USER_QUEUES = "(service_class BETWEEN 6 AND 13 OR service_class >= 100)"
+QUEUE_WAIT_SQL = f"""
+SELECT service_class, total_queue_time
+FROM stl_wlm_query
+WHERE userid = (SELECT usesysid FROM pg_user WHERE usename = current_user)
+  AND queue_start_time >= %s
+  AND {USER_QUEUES}
+"""
+# num_query_tasks is -1 for queues managed by automatic WLM
+SLOTS_SQL = f"""
+SELECT service_class, num_query_tasks
+FROM stv_wlm_service_class_config
+WHERE {USER_QUEUES}
+"""
+
+log = logging.getLogger("dbt_threads")
+
+
+def selected_models(args: List[str]) -> Optional[List[str]]:
+    """Return the model names selected by a `dbt run` command, or None when
+    every model is selected or the selection uses graph operators or
+    methods."""
+    models = []
+    in_selector = False
+    for arg in args:
+        if arg in SELECTOR_FLAGS:
+            in_selector = True
+        elif arg.startswith("-"):
+            in_selector = False
+        elif in_selector:
+            if any(c in arg for c in "+*@:,/"):
+                return None
+            models.append(arg)
+    return models or None
+
+
+def graph_width(manifest: dict, models: Optional[List[str]] = None) -> int:
+    """Return the largest number of selected models at the same depth of the
+    ref() graph, which bounds how many of them can run concurrently."""
+    nodes = {
+        unique_id: node
+        for unique_id, node in manifest["nodes"].items()
+        if node["resource_type"] == "model"
+    }
+    depths: Dict[str, int] = {}
+
+    def depth(unique_id: str) -> int:
+        # Ephemeral models are inlined into their children and never built:
+        # they take no thread and add no layer
+        if unique_id not in depths:
+            parents = [p for p in nodes[unique_id]["depends_on"]["nodes"] if p in nodes]
+            own = 0 if _is_ephemeral(nodes[unique_id]) else 1
+            depths[unique_id] = own + max((depth(p) for p in parents), default=-1)
+        return depths[unique_id]
+
+    layers: Dict[int, int] = {}
+    for unique_id, node in nodes.items():
+        if _is_ephemeral(node):
+            continue
+        if models is None or node["name"] in models:
+            layers[depth(unique_id)] = layers.get(depth(unique_id), 0) + 1
+    return max(layers.values(), default=1)
+
+
+def _is_ephemeral(node: dict) -> bool:
+    return node["config"].get("materialized") == "ephemeral"
+
+
+def observe_queue(conn, window_minutes: int = QUEUE_WAIT_WINDOW) -> dict:
+    """Return the p90 queue wait (seconds) of the current user's queries over
+    the last window_minutes, and the slots of the queues they ran in."""
+    since = datetime.utcnow() - timedelta(minutes=window_minutes)
+    with conn.cursor() as cursor:
+        cursor.execute(QUEUE_WAIT_SQL, (since,))
+        queries = cursor.fetchall()
+        cursor.execute(SLOTS_SQL)
+        queue_slots = dict(cursor.fetchall())
+
+    service_classes = {service_class for service_class, _ in queries}
+    slots = [
+        n
+        for service_class, n in queue_slots.items()
+        if n > 0 and (service_class in service_classes or not service_classes)
+    ]
+    waits = sorted(queue_time / 1e6 for _, queue_time in queries)
+    return {
+        "queries": len(waits),
+        "queue_wait_p90": waits[int(len(waits) * 0.9)] if waits else None,
+        # Several user queues: dbt may use any of them, the smallest bounds it
+        "slots": min(slots) if slots else None,
+    }
+
+
+def decide(
+    width: Optional[int],
+    observation: dict,
+    previous: Optional[dict],
+    max_threads: int = MAX_THREADS,
+    target: float = QUEUE_WAIT_TARGET,
+) -> dict:
+    # The allowance is what Redshift can take, shared by every run. A run
+    # uses no more threads than its models can use side by side.
+    limit = min(max_threads, observation.get("slots") or max_threads)
+    wait = observation.get("queue_wait_p90")
+    allowance = previous["allowance"] if previous else limit
+    if wait is not None and wait > target:
+        allowance //= 2
+        reason = f"p90 queue wait {wait:.1f}s over {target:.1f}s"
+    elif wait is None:
+        reason = "no recent queries"
+    elif previous is None:
+        reason = "no previous decision"
+    else:
+        allowance += 1
+        reason = f"p90 queue wait {wait:.1f}s within {target:.1f}s"
+    allowance = max(1, min(allowance, limit))
+    return {
+        "threads": min(allowance, width) if width else allowance,
+        "allowance": allowance,
+        "width": width,
+        "previous_allowance": previous["allowance"] if previous else None,
+        "reason": reason,
+        **observation,
+    }
+
+
+def run_decision_key(run_id: str) -> str:
+    return f"{ARTIFACTS_PREFIX}/{run_id}/threads.json"
+
+
+def load_previous(s3, bucket: str, key: str = DECISION_KEY) -> Optional[dict]:
+    try:
+        body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except ClientError:
+        return None
+    return json.loads(body)
+
+
+def record(decision: dict, s3=None, bucket: Optional[str] = None) -> None:
+    os.makedirs("target", exist_ok=True)
+    with open("target/threads.json", "w") as f:
+        json.dump(decision, f, indent=2)
+    if s3 is not None:
+        s3.put_object(Bucket=bucket, Key=DECISION_KEY, Body=json.dumps(decision))
+
+
+def connect(dsn: Optional[str] = None):
+    if dsn:
+        return psycopg2.connect(dsn, connect_timeout=10)
+    return psycopg2.connect(
+        host=os.environ["REDSHIFT_HOST"],
+        port=int(os.environ.get("REDSHIFT_PORT", "5439")),
+        dbname=os.environ.get("REDSHIFT_DBNAME", "redshift-db"),
+        user=os.environ["REDSHIFT_USER"],
+        password=os.environ["REDSHIFT_PASSWORD"],
+        connect_timeout=10,
+    )
+
+
+def profile_threads(
+    project_dir: str = ".",
+    profiles_dir: Optional[str] = None,
+    target: Optional[str] = None,
+) -> int:
+    """Threads of the target of the project's dbt profile, which runs use
+    without --threads."""
+    with open(os.path.join(project_dir, "dbt_project.yml")) as f:
+        profile_name = yaml.safe_load(f)["profile"]
+    profiles_dir = profiles_dir or os.environ.get(
+        "DBT_PROFILES_DIR", os.path.expanduser("~/.dbt")
+    )
+    with open(os.path.join(project_dir, profiles_dir, "profiles.yml")) as f:
+        profile = yaml.safe_load(f)[profile_name]
+    return int(profile["outputs"][target or profile["target"]].get("threads", 1))
+
+
+def _manifest_width(
+    manifest_path: Optional[str], models: Optional[List[str]] = None
+) -> Optional[int]:
+    if not (manifest_path and os.path.exists(manifest_path)):
+        return None
+    with open(manifest_path) as f:
+        return graph_width(json.load(f), models)
+
+
+def _decide(
+    width: Optional[int], s3=None, bucket: Optional[str] = None, dsn=None
+) -> dict:
+    observation = {}
+    try:
+        conn = connect(dsn or os.environ.get("DBT_THREADS_DSN"))
+        try:
+            observation = observe_queue(conn)
+        finally:
+            conn.close()
+    except psycopg2.Error as e:
+        log.warning("Could not read the WLM system tables: %s", e)
+
+    previous = load_previous(s3, bucket) if s3 is not None else None
+    decision = decide(width, observation, previous)
+    decision["decided_at"] = datetime.utcnow().isoformat()
+    record(decision, s3, bucket)
+    log.info(
+        "using %s threads (width %s, allowance %s, previous %s): %s",
+        decision["threads"],
+        decision["width"],
+        decision["allowance"],
+        decision["previous_allowance"],
+        decision["reason"],
+    )
+    return decision
+
+
+def plan_run(
+    manifest_path: Optional[str],
+    run_id: str,
+    s3=None,
+    bucket: Optional[str] = None,
+    dsn: Optional[str] = None,
+) -> dict:
+    """Decide the allowance of a DAG run over the whole model graph, and
+    save it for the commands of the run."""
+    decision = _decide(_manifest_width(manifest_path), s3, bucket, dsn)
+    decision["run_id"] = run_id
+    if s3 is not None:
+        s3.put_object(
+            Bucket=bucket, Key=run_decision_key(run_id), Body=json.dumps(decision)
+        )
+    return decision
+
+
+def choose_threads(
+    command: List[str],
+    manifest_path: Optional[str],
+    s3=None,
+    bucket: Optional[str] = None,
+    dsn: Optional[str] = None,
+    run_id: Optional[str] = None,
+) -> dict:
+    """Decide and record the thread count of a `dbt run` command. A command
+    of a planned DAG run takes the run's allowance instead."""
+    width = _manifest_width(manifest_path, selected_models(command))
+    planned = None
+    if run_id and s3 is not None:
+        planned = load_previous(s3, bucket, run_decision_key(run_id))
+    if planned is None:
+        return _decide(width, s3, bucket, dsn)
+
+    allowance = planned["allowance"]
+    decision = {
+        "threads": min(allowance, width) if width else allowance,
+        "allowance": allowance,
+        "width": width,
+        "reason": f"allowance of run {run_id}",
+        "decided_at": planned["decided_at"],
+    }
+    record(decision)
+    log.info(
+        "using %s threads (width %s, allowance %s of run %s)",
+        decision["threads"],
+        width,
+        allowance,
+        run_id,
+    )
+    return decision
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--manifest", help="manifest.json to measure the width of")
+    parser.add_argument("--dsn", help="libpq connection string to read WLM from")
+    parser.add_argument(
+        "--no-record", action="store_true", help="do not read or save S3 decisions"
+    )
+    parser.add_argument("--run-id", help="Airflow DAG run the command belongs to")
+    parser.add_argument(
+        "--plan", action="store_true", help="decide once for the whole --run-id"
+    )
+    parser.add_argument(
+        "--profile-threads",
+        action="store_true",
+        help="print the thread count of the dbt profile and exit",
+    )
+    parser.add_argument("command", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format="%(asctime)s %(name)s %(levelname)s %(message)s",
+    )
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if args.profile_threads:
+        print(profile_threads(target=os.environ.get("DBT_TARGET")))
+        sys.exit()
+    s3 = None if args.no_record or not BUCKET_NAME else boto3.client("s3")
+    if args.plan:
+        if not args.run_id:
+            parser.error("--plan needs --run-id")
+        decision = plan_run(args.manifest, args.run_id, s3, BUCKET_NAME, args.dsn)
+    else:
+        decision = choose_threads(
+            command, args.manifest, s3, BUCKET_NAME, args.dsn, args.run_id
+        )
+    print(decision["threads"])
@@ -1,6 +1,120 @@
 #!/usr/bin/env bash
 
-aws s3 sync s3://$BUCKET_NAME/dbt_dags dbt_dags
-cd dbt_dags
-dbt debug
-exec "$@"
+started=$(date +%s.%N)
+PROJECT_DIR=${DBT_PROJECT_DIR:-/dbt_dags}
+BUNDLE_URI="s3://$BUCKET_NAME/${DBT_BUNDLE_PREFIX:-dbt_bundles}"
+
+# The project is published as a content-addressed bundle, LATEST holds the
+# hash of the current one. Skip the download when this container already has it.
+if latest=$(aws s3 cp "$BUNDLE_URI/LATEST" - 2> /dev/null); then
+    if [ "$latest" != "$(cat $PROJECT_DIR/.bundle_sha 2> /dev/null)" ]; then
+        echo "Fetching dbt project bundle $latest"
+        rm -rf $PROJECT_DIR && mkdir -p $PROJECT_DIR
+        aws s3 cp "$BUNDLE_URI/$latest.tar.gz" - | tar -xz -C $PROJECT_DIR || exit 1
+        echo "$latest" > $PROJECT_DIR/.bundle_sha
+    fi
+else
+    echo "No dbt project bundle at $BUNDLE_URI, syncing dbt_dags"
+    aws s3 sync s3://$BUCKET_NAME/dbt_dags $PROJECT_DIR
+fi
+synced=$(date +%s.%N)
+cd $PROJECT_DIR
+
+# Connection checks are opt-in, they add a full project load to every start
+if [ "$DBT_DEBUG" = "true" ]; then
+    dbt debug
+fi
+
+# Manifest of the last successful production run
+STATE_URI="s3://$BUCKET_NAME/${DBT_STATE_PREFIX:-dbt_state}/manifest.json"
+
+if [ "$1" = "threads" ]; then
+    if [ "$DBT_ADAPTIVE_THREADS" != "true" ]; then
+        # Nothing to decide: model tasks run unlimited, each with the
+        # profile's threads
+        exec python /scripts/dbt_threads.py --profile-threads
+    fi
+    # Decide the thread allowance of the whole DAG run once, over the graph
+    # of the last production manifest
+    aws s3 cp "$STATE_URI" state/manifest.json > /dev/null 2>&1
+    exec python /scripts/dbt_threads.py --manifest state/manifest.json --run-id "$DBT_RUN_ID" --plan
+fi
+
+if [ "$1" = "save-state" ]; then
+    dbt ls --resource-type model > /dev/null || exit 1
+    exec aws s3 cp target/manifest.json "$STATE_URI"
+fi
+
+if [ "$1" = "dbt" ] && [ "$2" = "run" ]; then
+    flags=()
+    if [ "$DBT_STATE_AWARE" = "true" ]; then
+        if aws s3 cp "$STATE_URI" state/manifest.json; then
+            flags+=(--state state)
+        else
+            echo "No previous manifest at $STATE_URI, running all selected models"
+        fi
+    fi
+    if [ "$DBT_FULL_REFRESH" = "true" ]; then
+        flags+=(--full-refresh)
+    fi
+    if [ "$DBT_ADAPTIVE_THREADS" = "true" ]; then
+        # The last production manifest tells how wide the model graph is
+        [ -f state/manifest.json ] || aws s3 cp "$STATE_URI" state/manifest.json > /dev/null 2>&1
+        threads_flags=(--manifest state/manifest.json)
+        if [ -n "$DBT_RUN_ID" ]; then
+            threads_flags+=(--run-id "$DBT_RUN_ID")
+        fi
+        if threads=$(python /scripts/dbt_threads.py "${threads_flags[@]}" -- "$@"); then
+            flags+=(--threads "$threads")
+        fi
+    fi
+    if [ "$DBT_SOURCE_FINGERPRINTS" = "true" ]; then
+        # Exclude the models whose sources did not change since their last
+        # build, the current manifest tells their sources and definitions
+        plan_flags=()
+        if [ "$DBT_FULL_REFRESH" = "true" ]; then
+            plan_flags+=(--rebuild-all)
+        fi
+        if dbt ls --resource-type model > /dev/null; then
+            # Never exclude from a plan that failed part way through
+            if plan=$(python /scripts/source_fingerprint.py plan "${plan_flags[@]}" -- "$@"); then
+                if [ -n "$plan" ]; then
+                    mapfile -t unchanged <<< "$plan"
+                    flags+=(--exclude "${unchanged[@]}")
+                fi
+            else
+                echo "Could not plan the unchanged models, running all selected models"
+            fi
+        fi
+    fi
+    # The command is replaced by the output: an empty one would run nothing
+    args_out=$(python /scripts/dbt_args.py "${flags[@]}" -- "$@") || exit 1
+    mapfile -t args <<< "$args_out"
+    set -- "${args[@]}"
+fi
+
+if [ "$1" != "dbt" ]; then
+    exec "$@"
+fi
+
+# Keep bash around to report where the start-up time went and to keep
+# the run results
+rm -f target/run_results.json
+trap 'kill -TERM $pid 2> /dev/null' TERM INT
+"$@" &
+pid=$!
+wait $pid
+status=$?
+if [ -f logs/dbt.log ]; then
+    python /scripts/startup_timing.py \
+        --started "$started" \
+        --synced "$synced" \
+        logs/dbt.log
+fi
+if [ -f target/source_fingerprints.json ]; then
+    python /scripts/source_fingerprint.py record
+fi
+if [ -n "$DBT_RUN_ID" ]; then
+    python /scripts/upload_artifacts.py "$DBT_RUN_ID"
+fi
+exit $status
@@ -0,0 +1,345 @@
+"""Skip dbt models whose sources did not change since their last build.
+
+The fingerprint of a source table is its row count, the max value of its
+`fingerprint_key` column (meta of the source in schema.yml) and the time
+it was last written, from the Redshift system tables. Before a `dbt run`,
+
+    $ python source_fingerprint.py plan --manifest target/manifest.json -- dbt run -m a
+
+fingerprints every source, keeps them with the model definitions in
+target/source_fingerprints.json and prints the selectors of the models
+that can be excluded, one per line: models whose definition is unchanged
+since their last successful build, whose upstream sources all still have
+the fingerprints of that build, and whose upstream models are excluded
+too and were not rebuilt since. After the run,
+
+    $ python source_fingerprint.py record
+
+stores the fingerprints with every model built successfully, under
+s3://$BUCKET_NAME/dbt_state/fingerprints/<model>.json. Pass --dsn to
+fingerprint the tables of a local Postgres instead, and --no-record to
+keep S3 out of it.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+import boto3
+import psycopg2
+from psycopg2 import sql
+
+from dbt_threads import connect, selected_models
+
+BUCKET_NAME = os.environ.get("BUCKET_NAME")
+FINGERPRINT_PREFIX = f"{os.environ.get('DBT_STATE_PREFIX', 'dbt_state')}/fingerprints/"
+PENDING_PATH = "target/source_fingerprints.json"
+
+# Row count and last insert or delete (updates are both). The STL tables
+# keep a few days of history and only show other users' writes to
+# superusers, in both cases a missing time just causes a rebuild.
+REDSHIFT_SQL = """
+SELECT t.tbl_rows, max(w.endtime)
+FROM svv_table_info t
+LEFT JOIN (
+    SELECT tbl, endtime FROM stl_insert
+    UNION ALL
+    SELECT tbl, endtime FROM stl_delete
+) w ON w.tbl = t.table_id
+WHERE t.schema = %s AND t."table" = %s
+GROUP BY t.tbl_rows
+"""
+# Postgres has no write times, its write counters change on every write
+POSTGRES_SQL = """
+SELECT n_live_tup, n_tup_ins + n_tup_upd + n_tup_del
+FROM pg_stat_user_tables
+WHERE schemaname = %s AND relname = %s
+"""
+
+log = logging.getLogger("source_fingerprint")
+
+
+def _is_ephemeral(node: dict) -> bool:
+    return node["config"].get("materialized") == "ephemeral"
+
+
+def lineage(manifest: dict) -> Dict[str, Tuple[Set[str], Set[str]]]:
+    """Return the upstream sources and upstream models of every model that
+    is built. Ephemeral models are inlined into their children and never
+    built: their children read their sources and the models they ref."""
+    nodes = manifest["nodes"]
+    upstream: Dict[str, Tuple[Set[str], Set[str]]] = {}
+
+    def visit(unique_id: str) -> Tuple[Set[str], Set[str]]:
+        if unique_id not in upstream:
+            sources, models = set(), set()
+            for parent in nodes[unique_id]["depends_on"]["nodes"]:
+                if parent in manifest["sources"]:
+                    sources.add(parent)
+                elif nodes.get(parent, {}).get("resource_type") == "model":
+                    parent_sources, parent_models = visit(parent)
+                    sources |= parent_sources
+                    models |= parent_models
+                    if not _is_ephemeral(nodes[parent]):
+                        models.add(parent)
+            upstream[unique_id] = (sources, models)
+        return upstream[unique_id]
+
+    for unique_id, node in nodes.items():
+        if node["resource_type"] == "model":
+            visit(unique_id)
+    return {
+        unique_id: found
+        for unique_id, found in upstream.items()
+        if not _is_ephemeral(nodes[unique_id])
+    }
+
+
+def definition_hash(manifest: dict, node: dict) -> str:
+    # The SQL, the config and the macros used: var values are not covered.
+    # Ephemeral parents are inlined, their definitions are part of it.
+    digest = hashlib.sha256(node["checksum"]["checksum"].encode())
+    digest.update(json.dumps(node["config"], sort_keys=True, default=str).encode())
+    for macro in sorted(node["depends_on"]["macros"]):
+        digest.update(manifest["macros"][macro]["macro_sql"].encode())
+    for parent in sorted(node["depends_on"]["nodes"]):
+        parent_node = manifest["nodes"].get(parent)
+        if (
+            parent_node
+            and parent_node["resource_type"] == "model"
+            and _is_ephemeral(parent_node)
+        ):
+            digest.update(definition_hash(manifest, parent_node).encode())
+    return digest.hexdigest()
+
+
+def fingerprint(conn, source: dict, redshift: bool) -> Optional[dict]:
+    with conn.cursor() as cursor:
+        cursor.execute(
+            REDSHIFT_SQL if redshift else POSTGRES_SQL,
+            (source["schema"], source["identifier"]),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        rows, written = row
+        result = {"rows": rows, "written": written}
+        key = source["meta"].get("fingerprint_key")
+        if key:
+            cursor.execute(
+                sql.SQL("SELECT max({}) FROM {}.{}").format(
+                    sql.Identifier(key),
+                    sql.Identifier(source["schema"]),
+                    sql.Identifier(source["identifier"]),
+                )
+            )
+            result["max_key"] = cursor.fetchone()[0]
+    # Compared with the stored JSON, so keep only JSON types
+    return json.loads(json.dumps(result, default=str))
+
+
+def fingerprint_sources(conn, manifest: dict) -> Dict[str, Optional[dict]]:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT version()")
+        redshift = "Redshift" in cursor.fetchone()[0]
+    return {
+        unique_id: fingerprint(conn, source, redshift)
+        for unique_id, source in manifest["sources"].items()
+    }
+
+
+def build_reasons(
+    manifest: dict, current: Dict[str, Optional[dict]], builds: Dict[str, dict]
+) -> Dict[str, Optional[str]]:
+    """Return, for every model, why it has to be built, or None when it can
+    be skipped."""
+    nodes = manifest["nodes"]
+    upstream = lineage(manifest)
+    reasons: Dict[str, Optional[str]] = {}
+
+    def reason(unique_id: str) -> Optional[str]:
+        if unique_id in reasons:
+            return reasons[unique_id]
+        node = nodes[unique_id]
+        sources, models = upstream[unique_id]
+        build = builds.get(node["name"])
+        result = None
+        if build is None:
+            result = "no recorded build"
+        elif build["definition"] != definition_hash(manifest, node):
+            result = "definition changed"
+        elif not sources:
+            result = "no upstream sources"
+        for source in sorted(sources) if result is None else []:
+            name = manifest["sources"][source]["name"]
+            if current.get(source) is None:
+                result = f"source {name} could not be fingerprinted"
+            elif build["sources"].get(source) != current[source]:
+                result = f"source {name} changed"
+            if result:
+                break
+        for parent in sorted(models) if result is None else []:
+            name = nodes[parent]["name"]
+            if reason(parent) is not None:
+                result = f"upstream model {name} is built"
+            elif builds[name]["built_at"] > build["built_at"]:
+                result = f"upstream model {name} was rebuilt since"
+            if result:
+                break
+        reasons[unique_id] = result
+        return result
+
+    return {nodes[unique_id]["name"]: reason(unique_id) for unique_id in upstream}
+
+
+def load_builds(s3, bucket: str) -> Dict[str, dict]:
+    builds = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=FINGERPRINT_PREFIX):
+        for obj in page.get("Contents", []):
+            body = s3.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read()
+            build = json.loads(body)
+            builds[build["model"]] = build
+    return builds
+
+
+def plan(
+    command: List[str],
+    manifest_path: str,
+    s3=None,
+    bucket: Optional[str] = None,
+    dsn: Optional[str] = None,
+    rebuild_all: bool = False,
+) -> List[str]:
+    """Fingerprint the sources and return the selectors of the models to
+    exclude from the `dbt run` command."""
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    try:
+        conn = connect(dsn or os.environ.get("DBT_FINGERPRINT_DSN"))
+        try:
+            current = fingerprint_sources(conn, manifest)
+        finally:
+            conn.close()
+    except psycopg2.Error as e:
+        log.warning("Could not fingerprint the sources, building all models: %s", e)
+        return []
+    # Definitions as parsed: the manifest of a run also lists the macros of
+    # the materializations
+    definitions = {
+        node["name"]: definition_hash(manifest, node)
+        for node in manifest["nodes"].values()
+        if node["resource_type"] == "model"
+    }
+    os.makedirs(os.path.dirname(PENDING_PATH), exist_ok=True)
+    with open(PENDING_PATH, "w") as f:
+        json.dump({"sources": current, "definitions": definitions}, f)
+    if rebuild_all:
+        return []
+
+    builds = load_builds(s3, bucket) if s3 is not None else {}
+    reasons = build_reasons(manifest, current, builds)
+    selected = selected_models(command)
+    for model, why in sorted(reasons.items()):
+        if selected is not None and model not in selected:
+            continue
+        if why is None:
+            log.info(
+                "skipping %s: sources unchanged since its build at %s",
+                model,
+                builds[model]["built_at"],
+            )
+        else:
+            log.info("building %s: %s", model, why)
+    return sorted(
+        # Dots in a name read as a package path, select those by file
+        f"path:{node['original_file_path']}" if "." in node["name"] else node["name"]
+        for node in manifest["nodes"].values()
+        # Ephemeral models have no reason, they are never built
+        if node["resource_type"] == "model"
+        and node["name"] in reasons
+        and reasons[node["name"]] is None
+    )
+
+
+def record(
+    manifest_path: str = "target/manifest.json",
+    run_results_path: str = "target/run_results.json",
+    s3=None,
+    bucket: Optional[str] = None,
+) -> List[str]:
+    """Store the fingerprints taken by plan() with the models built
+    successfully, returning their names."""
+    if not all(map(os.path.exists, (PENDING_PATH, manifest_path, run_results_path))):
+        return []
+    with open(PENDING_PATH) as f:
+        pending = json.load(f)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    with open(run_results_path) as f:
+        run_results = json.load(f)
+
+    upstream = lineage(manifest)
+    built_at = datetime.utcnow().isoformat()
+    recorded = []
+    for result in run_results["results"]:
+        unique_id = result["unique_id"]
+        if result["status"] != "success" or unique_id not in upstream:
+            continue
+        node = manifest["nodes"][unique_id]
+        build = {
+            "model": node["name"],
+            "built_at": built_at,
+            "definition": pending["definitions"].get(node["name"]),
+            "sources": {
+                source: pending["sources"].get(source)
+                for source in upstream[unique_id][0]
+            },
+        }
+        if s3 is not None:
+            s3.put_object(
+                Bucket=bucket,
+                Key=f"{FINGERPRINT_PREFIX}{node['name']}.json",
+                Body=json.dumps(build),
+            )
+        recorded.append(node["name"])
+    os.remove(PENDING_PATH)
+    log.info("recorded source fingerprints of %s", ", ".join(recorded) or "no model")
+    return recorded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    plan_parser = subparsers.add_parser("plan")
+    plan_parser.add_argument("--manifest", default="target/manifest.json")
+    plan_parser.add_argument("--dsn", help="libpq connection string of the sources")
+    plan_parser.add_argument(
+        "--rebuild-all", action="store_true", help="fingerprint, but exclude nothing"
+    )
+    plan_parser.add_argument("command", nargs=argparse.REMAINDER)
+    record_parser = subparsers.add_parser("record")
+    for subparser in (plan_parser, record_parser):
+        subparser.add_argument(
+            "--no-record", action="store_true", help="do not read or write S3"
+        )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format="%(asctime)s %(name)s %(levelname)s %(message)s",
+    )
+    s3 = None if args.no_record or not BUCKET_NAME else boto3.client("s3")
+    if args.action == "plan":
+        command = args.command[1:] if args.command[:1] == ["--"] else args.command
+        for model in plan(
+            command, args.manifest, s3, BUCKET_NAME, args.dsn, args.rebuild_all
+        ):
+            print(model)
+    else:
+        record(s3=s3, bucket=BUCKET_NAME)
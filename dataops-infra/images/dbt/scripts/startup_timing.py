@@ -0,0 +1,83 @@
+"""Log the startup phases of the last dbt invocation.
+
+    $ python startup_timing.py --started 1618000000.12 --synced 1618000000.96 logs/dbt.log
+    startup timing: sync=0.84s boot=1.32s parse=0.71s connect=0.05s first_query=0.38s
+
+* sync: fetching the project (measured by the entrypoint)
+* boot: from the end of the sync until dbt starts logging
+* parse: loading the project, until dbt reports the resource counts
+* connect: opening the first warehouse connection
+* first_query: from the end of parsing until the first model statement returns
+"""
+import argparse
+import re
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+LINE = re.compile(r"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d+) \(([^)]+)\): (.*)$")
+SQL_STATUS = re.compile(r"SQL status: .* in (\d+\.\d+) seconds")
+
+
+def parse_log(path: str) -> List[Tuple[float, str, str]]:
+    """Return (timestamp, thread, message) of the last dbt invocation."""
+    events = []
+    with open(path, errors="replace") as f:
+        for line in f:
+            match = LINE.match(line)
+            if not match:
+                continue
+            ts = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S.%f")
+            if match.group(3).startswith("Running with dbt="):
+                events = []
+            events.append((ts.timestamp(), match.group(2), match.group(3)))
+    return events
+
+
+def phases(events: List[Tuple[float, str, str]]) -> Dict[str, float]:
+    result = {}
+    if not events:
+        return result
+    started = events[0][0]
+    parsed = next((ts for ts, _, msg in events if msg.startswith("Found ")), None)
+    if parsed is None:
+        return result
+    result["parse"] = parsed - started
+
+    # Connections open lazily: the first statement of a thread reports its
+    # own duration, the rest of the gap is spent connecting
+    opening = {}
+    node = {}
+    for ts, thread, msg in events:
+        if msg.startswith("Opening a new connection"):
+            opening.setdefault(thread, ts)
+        elif msg.startswith("On "):
+            node[thread] = msg
+        status = SQL_STATUS.search(msg)
+        if not status:
+            continue
+        if "connect" not in result and thread in opening:
+            result["connect"] = max(ts - float(status.group(1)) - opening[thread], 0)
+        if node.get(thread, "").startswith("On model."):
+            result["first_query"] = ts - parsed
+            break
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--started", type=float, help="epoch at container start")
+    parser.add_argument("--synced", type=float, help="epoch once the project synced")
+    parser.add_argument("log")
+    args = parser.parse_args()
+
+    events = parse_log(args.log)
+    timings = {}
+    if args.started is not None and args.synced is not None:
+        timings["sync"] = args.synced - args.started
+        if events:
+            timings["boot"] = events[0][0] - args.synced
+    timings.update(phases(events))
+    print(
+        "startup timing: "
+        + " ".join(f"{name}={seconds:.2f}s" for name, seconds in timings.items())
+    )
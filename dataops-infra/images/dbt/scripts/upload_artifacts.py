@@ -0,0 +1,46 @@
+"""Upload the artifacts of the last dbt invocation to S3.
+
+    $ python upload_artifacts.py <airflow run id>
+
+stores target/run_results.json (and threads.json) under
+s3://$BUCKET_NAME/dbt_artifacts/<run id>/<invocation id>/, where Airflow's
+dbt_regression_check task builds the run history from it.
+"""
+import argparse
+import json
+import os
+
+import boto3
+
+ARTIFACTS_PREFIX = os.environ.get("DBT_ARTIFACTS_PREFIX", "dbt_artifacts")
+# threads.json is the thread count decision of dbt_threads.py, if any
+ARTIFACTS = ["run_results.json", "threads.json"]
+
+
+def upload_artifacts(s3, bucket: str, run_id: str, target_dir: str = "target"):
+    """Return the S3 prefix the artifacts were stored under, if any."""
+    run_results_path = os.path.join(target_dir, "run_results.json")
+    if not os.path.exists(run_results_path):
+        return None
+    with open(run_results_path) as f:
+        invocation_id = json.load(f)["metadata"]["invocation_id"]
+
+    prefix = f"{ARTIFACTS_PREFIX}/{run_id}/{invocation_id}"
+    for name in ARTIFACTS:
+        path = os.path.join(target_dir, name)
+        if os.path.exists(path):
+            s3.upload_file(path, bucket, f"{prefix}/{name}")
+    return prefix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("run_id")
+    parser.add_argument("--target-dir", default="target")
+    args = parser.parse_args()
+
+    prefix = upload_artifacts(
+        boto3.client("s3"), os.environ["BUCKET_NAME"], args.run_id, args.target_dir
+    )
+    if prefix:
+        print(f"Uploaded dbt artifacts to s3://{os.environ['BUCKET_NAME']}/{prefix}")
@@ -0,0 +1,38 @@
+#!/bin/sh
+set -e
+
+# Pool the connections of the Airflow services to their metadata database.
+# Transactions, not sessions, hold a server connection: Airflow keeps no
+# session state (prepared statements, SET, advisory locks) across them.
+CONFIG_DIR=${PGBOUNCER_CONFIG_DIR:-/etc/pgbouncer}
+
+cat > "$CONFIG_DIR/pgbouncer.ini" <<INI
+[databases]
+$AIRFLOW_DATABASE_NAME = host=$AIRFLOW_DATABASE_HOST port=${AIRFLOW_DATABASE_PORT_NUMBER:-5432} dbname=$AIRFLOW_DATABASE_NAME
+
+[pgbouncer]
+listen_addr = 0.0.0.0
+listen_port = ${PGBOUNCER_PORT:-6432}
+unix_socket_dir =
+auth_type = md5
+auth_file = $CONFIG_DIR/userlist.txt
+pool_mode = ${PGBOUNCER_POOL_MODE:-transaction}
+default_pool_size = ${PGBOUNCER_DEFAULT_POOL_SIZE:-20}
+min_pool_size = ${PGBOUNCER_MIN_POOL_SIZE:-2}
+reserve_pool_size = ${PGBOUNCER_RESERVE_POOL_SIZE:-5}
+reserve_pool_timeout = 3
+max_client_conn = ${PGBOUNCER_MAX_CLIENT_CONN:-1000}
+max_db_connections = ${PGBOUNCER_MAX_DB_CONNECTIONS:-40}
+server_idle_timeout = 300
+ignore_startup_parameters = extra_float_digits
+; SHOW POOLS and SHOW STATS on the pgbouncer database, see airflow_metrics.py
+stats_users = $AIRFLOW_DATABASE_USERNAME
+stats_period = 60
+log_stats = 1
+INI
+
+# Clients and PgBouncer authenticate with the credentials of the database
+printf '"%s" "%s"\n' "$AIRFLOW_DATABASE_USERNAME" "$AIRFLOW_DATABASE_PASSWORD" \
+    > "$CONFIG_DIR/userlist.txt"
+
+exec pgbouncer "$CONFIG_DIR/pgbouncer.ini"
@@ -1,57 +1,120 @@
 #!/usr/bin/env python3
 import os
-from aws_cdk import core
-
-from stacks.vpc_stack import VpcStack
-from stacks.ecr_stack import ECRStack
-from stacks.s3_stack import S3Stack
-from stacks.airflow_rds import RDSStack
-from stacks.airflow_cluster_stack import AirflowClusterStack
-from stacks.airflow_redis import RedisStack
-from stacks.fargate_services.airflow import AirflowServices
-from stacks.fargate_services.dbt import DBT
-from stacks.redshift_cluster_stack import RedshiftClusterStack
+import sys
+
+import synth_cache
+
+# Skip loading the CDK libraries when nothing changed since the last synth
+if synth_cache.restore():
+    sys.exit(0)
+
+from aws_cdk import core  # noqa: E402
+
+from stacks.vpc_stack import VpcStack  # noqa: E402
+from stacks.ecr_stack import ECRStack  # noqa: E402
+from stacks.s3_stack import S3Stack  # noqa: E402
+from stacks.airflow_rds import RDSStack  # noqa: E402
+from stacks.airflow_cluster_stack import AirflowClusterStack  # noqa: E402
+from stacks.airflow_redis import RedisStack  # noqa: E402
+from stacks.fargate_services.airflow import AirflowServices  # noqa: E402
+from stacks.fargate_services.dbt import DBT  # noqa: E402
+from stacks.redshift_cluster_stack import RedshiftClusterStack  # noqa: E402
 
 env = core.Environment(region=os.environ.get("AWS_REGION"))
 app = core.App()
 
-ecr = ECRStack(app, "ECRStack", env=env)
-s3 = S3Stack(app, "S3Stack", env=env)
-vpc = VpcStack(app, "VpcStack", env=env)
+# Stacks are only built when selected (`cdk synth -c stacks=airflow,dbt`)
+# or needed by a selected stack. All of them are built by default.
+stacks = {}
 
-redshift = RedshiftClusterStack(app, "RedshiftClusterStack", vpc, env=env)
-redshift.add_dependency(vpc)
 
-rds = RDSStack(app, "RDSStack", vpc, env=env)
-rds.add_dependency(vpc)
+def stack(name: str) -> core.Stack:
+    if name not in stacks:
+        stacks[name] = builders[name]()
+    return stacks[name]
 
-redis = RedisStack(app, "RedisStack", vpc, env=env)
-redis.add_dependency(vpc)
 
-airflow_cluster_props = {
-    "vpc": vpc,
-    "s3": s3,
-}
-airflow_cluster = AirflowClusterStack(
-    app,
-    "AirflowClusterStack",
-    airflow_cluster_props,
-    env=env,
-)
-airflow_cluster.add_dependency(redis)
-airflow_cluster.add_dependency(rds)
-airflow_cluster.add_dependency(ecr)
-
-airflow_services_props = {
-    "airflow_cluster": airflow_cluster,
-    "ecr": ecr,
-    "vpc": vpc,
-    "rds": rds,
-    "redis": redis,
+def vpc_stack():
+    return VpcStack(app, "VpcStack", env=env)
+
+
+def redshift_stack():
+    redshift = RedshiftClusterStack(
+        app, "RedshiftClusterStack", stack("VpcStack"), env=env
+    )
+    redshift.add_dependency(stack("VpcStack"))
+    return redshift
+
+
+def rds_stack():
+    rds = RDSStack(app, "RDSStack", stack("VpcStack"), env=env)
+    rds.add_dependency(stack("VpcStack"))
+    return rds
+
+
+def redis_stack():
+    redis = RedisStack(app, "RedisStack", stack("VpcStack"), env=env)
+    redis.add_dependency(stack("VpcStack"))
+    return redis
+
+
+def airflow_cluster_stack():
+    airflow_cluster_props = {
+        "vpc": stack("VpcStack"),
+        "s3": stack("S3Stack"),
+    }
+    airflow_cluster = AirflowClusterStack(
+        app,
+        "AirflowClusterStack",
+        airflow_cluster_props,
+        env=env,
+    )
+    airflow_cluster.add_dependency(stack("RedisStack"))
+    airflow_cluster.add_dependency(stack("RDSStack"))
+    airflow_cluster.add_dependency(stack("ECRStack"))
+    return airflow_cluster
+
+
+def airflow_services_stack():
+    airflow_services_props = {
+        "airflow_cluster": stack("AirflowClusterStack"),
+        "ecr": stack("ECRStack"),
+        "vpc": stack("VpcStack"),
+        "rds": stack("RDSStack"),
+        "redis": stack("RedisStack"),
+        "s3": stack("S3Stack"),
+    }
+    return AirflowServices(app, "airflow", airflow_services_props, env=env)
+
+
+def dbt_stack():
+    dbt_props = {
+        "airflow_cluster": stack("AirflowClusterStack"),
+        "ecr": stack("ECRStack"),
+        "redshift": stack("RedshiftClusterStack"),
+        "vpc": stack("VpcStack"),
+        "redis": stack("RedisStack"),
+    }
+    return DBT(app, "dbt", dbt_props, env=env)
+
+
+builders = {
+    "ECRStack": lambda: ECRStack(app, "ECRStack", env=env),
+    "S3Stack": lambda: S3Stack(app, "S3Stack", env=env),
+    "VpcStack": vpc_stack,
+    "RedshiftClusterStack": redshift_stack,
+    "RDSStack": rds_stack,
+    "RedisStack": redis_stack,
+    "AirflowClusterStack": airflow_cluster_stack,
+    "airflow": airflow_services_stack,
+    "dbt": dbt_stack,
 }
-airflow_services = AirflowServices(app, "airflow", airflow_services_props, env=env)
 
-dbt_props = {"airflow_cluster": airflow_cluster, "ecr": ecr, "redshift": redshift}
-dbt = DBT(app, "dbt", dbt_props, env=env)
+selected = app.node.try_get_context("stacks")
+for name in selected.split(",") if selected else builders:
+    if name not in builders:
+        raise ValueError(f"Unknown stack {name}, expected one of {list(builders)}")
+    stack(name)
 
-app.synth()
+assembly = app.synth()
+synth_cache.save(assembly.directory)
@@ -4,11 +4,30 @@ from aws_cdk import core, aws_ecs as ecs, aws_iam as iam, aws_logs
 from stacks.vpc_stack import VpcStack
 from stacks.s3_stack import S3Stack
 from types import SimpleNamespace
+from typing import List, Optional
 from typing_extensions import TypedDict
 
 props_type = TypedDict("props_type", {"vpc": VpcStack, "s3": S3Stack})
 
 
+def capacity_provider_strategies(
+    value: str,
+) -> Optional[List[ecs.CapacityProviderStrategy]]:
+    """Parse a capacity provider strategy like "FARGATE:1:1,FARGATE_SPOT:3",
+    as <provider>:<weight>[:<base>] items. Empty for the FARGATE launch type."""
+    strategies = []
+    for item in filter(None, (item.strip() for item in value.split(","))):
+        provider, weight, *base = item.split(":")
+        strategies.append(
+            ecs.CapacityProviderStrategy(
+                capacity_provider=provider,
+                weight=int(weight),
+                base=int(base[0]) if base else None,
+            )
+        )
+    return strategies or None
+
+
 class AirflowClusterStack(core.Stack):
     def __init__(
         self, scope: core.Construct, id: str, props: props_type, **kwargs
@@ -54,6 +73,8 @@ class AirflowClusterStack(core.Stack):
                         "logs:GetLogEvents",
                         "logs:FilterLogEvents",
                         "ecs:DescribeTasks",
+                        # Running dbt tasks, counted against the thread allowance
+                        "ecs:ListTasks",
                     ],
                     resources=["*"],
                 ),
@@ -96,6 +117,15 @@ class AirflowClusterStack(core.Stack):
                         f"{ns.s3.instance.bucket_arn}/*",
                     ],
                 ),
+                # dbt state of the last production run, and run artifacts
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["s3:PutObject"],
+                    resources=[
+                        f"{ns.s3.instance.bucket_arn}/dbt_state/*",
+                        f"{ns.s3.instance.bucket_arn}/dbt_artifacts/*",
+                    ],
+                ),
             ],
             roles=[self.airflow_task_role],
         )
@@ -107,6 +137,8 @@ class AirflowClusterStack(core.Stack):
             cluster_name="MyCluster",
             vpc=ns.vpc.instance,
             container_insights=True,
+            # Services and tasks pick their mix with a capacity provider strategy
+            capacity_providers=["FARGATE", "FARGATE_SPOT"],
         )
 
         # Create log groups
@@ -131,6 +163,13 @@ class AirflowClusterStack(core.Stack):
             retention=aws_logs.RetentionDays.ONE_MONTH,
             removal_policy=core.RemovalPolicy.DESTROY,
         )
+        self.pgbouncer_log_group = aws_logs.LogGroup(
+            self,
+            "pgbouncerLogGroup",
+            log_group_name="/ecs/pgbouncer-cdk",
+            retention=aws_logs.RetentionDays.ONE_MONTH,
+            removal_policy=core.RemovalPolicy.DESTROY,
+        )
         self.dbt_log_group = aws_logs.LogGroup(
             self,
             "dbtLogGroup",
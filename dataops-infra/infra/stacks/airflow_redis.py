@@ -5,6 +5,10 @@ from aws_cdk import (
 )
 from stacks.vpc_stack import VpcStack
 
+# Database of the dbt runner's requests and results, shared by the Airflow
+# connection of DbtRunnerOperator and images/dbt/scripts/dbt_runner.py
+DBT_RUNNER_REDIS_DB = 2
+
 
 class RedisStack(core.Stack):
     def __init__(self, scope: core.Construct, id: str, vpc: VpcStack, **kwargs) -> None:
@@ -23,6 +23,12 @@ class ECRStack(core.Stack):
             repository_name="airflow_worker_cdk",
             removal_policy=core.RemovalPolicy.DESTROY,
         )
+        self.pgbouncer_repo = ecr.Repository(
+            self,
+            "pgbouncer_repo",
+            repository_name="pgbouncer_cdk",
+            removal_policy=core.RemovalPolicy.DESTROY,
+        )
         self.dbt_repo = ecr.Repository(
             self,
             "dbt_ecr_repository",
@@ -2,17 +2,27 @@ import os
 
 from aws_cdk import (
     core,
+    aws_applicationautoscaling as appscaling,
+    aws_cloudwatch as cloudwatch,
     aws_ecs as ecs,
+    aws_iam as iam,
     aws_secretsmanager as sm,
     aws_elasticloadbalancingv2 as elbv2,
     aws_servicediscovery as sd,
+    aws_sns as sns,
+    aws_sqs as sqs,
 )
 from stacks.vpc_stack import VpcStack
-from stacks.airflow_cluster_stack import AirflowClusterStack
+from stacks.airflow_cluster_stack import (
+    AirflowClusterStack,
+    capacity_provider_strategies,
+)
 from stacks.ecr_stack import ECRStack
 from stacks.airflow_rds import RDSStack
-from stacks.airflow_redis import RedisStack
+from stacks.airflow_redis import DBT_RUNNER_REDIS_DB, RedisStack
+from stacks.s3_stack import S3Stack
 from types import SimpleNamespace
+from typing import List
 from typing_extensions import TypedDict
 
 props_type = TypedDict(
@@ -23,10 +33,44 @@ props_type = TypedDict(
         "ecr": ECRStack,
         "rds": RDSStack,
         "redis": RedisStack,
+        "s3": S3Stack,
     },
 )
 
 
+# Published by images/airflow/scripts/airflow_metrics.py from the scheduler
+METRICS_NAMESPACE = "Airflow"
+# Celery queues tasks are routed to by operator type, see
+# images/airflow/scripts/airflow_local_settings.py
+LIGHT_QUEUE = "light"
+ECS_DISPATCH_QUEUE = "ecs-dispatch"
+
+
+def queues_metric(
+    metric_name: str, queues: List[str], period: core.Duration
+) -> cloudwatch.IMetric:
+    """Sum of a per-queue metric over the queues of a worker service."""
+    metrics = {
+        f"q{i}": cloudwatch.Metric(
+            namespace=METRICS_NAMESPACE,
+            metric_name=metric_name,
+            dimensions={"Queue": queue},
+            statistic="Maximum",
+            period=period,
+        )
+        for i, queue in enumerate(queues)
+    }
+    if len(metrics) == 1:
+        return metrics["q0"]
+    # A queue without a datapoint in the period counts as empty
+    return cloudwatch.MathExpression(
+        expression=" + ".join(f"FILL({name}, 0)" for name in metrics),
+        using_metrics=metrics,
+        label=f"{metric_name} ({', '.join(queues)})",
+        period=period,
+    )
+
+
 class AirflowServices(core.Stack):
     def __init__(
         self, scope: core.Construct, id: str, props: props_type, **kwargs
@@ -35,6 +79,53 @@ class AirflowServices(core.Stack):
         ns = SimpleNamespace(**props)
 
         bucket_name = os.environ.get("BUCKET_NAME")
+        redis_host = ns.redis.instance.attr_redis_endpoint_address
+        # Run dbt through the long-lived runner service instead of one task per run
+        dbt_runner_enabled = os.environ.get("DBT_RUNNER_ENABLED", "false")
+        # Capacity providers of the dbt tasks started by the DAGs, like
+        # "FARGATE:1:1,FARGATE_SPOT:3". Interrupted tasks restart on FARGATE.
+        dbt_capacity_providers = os.environ.get("DBT_CAPACITY_PROVIDERS", "")
+        # Prices used by the cost report of the DAG runs, us-east-1 by default
+        fargate_prices = {
+            name: os.environ[name]
+            for name in (
+                "FARGATE_VCPU_HOUR",
+                "FARGATE_GB_HOUR",
+                "FARGATE_SPOT_VCPU_HOUR",
+                "FARGATE_SPOT_GB_HOUR",
+            )
+            if os.environ.get(name)
+        }
+        # The webserver renders DAGs from the metadata DB instead of importing them
+        dag_serialization = {
+            "AIRFLOW__CORE__STORE_SERIALIZED_DAGS": "True",
+            "AIRFLOW__CORE__STORE_DAG_CODE": "True",
+            "AIRFLOW__CORE__MIN_SERIALIZED_DAG_UPDATE_INTERVAL": "30",
+            "AIRFLOW__CORE__MIN_SERIALIZED_DAG_FETCH_INTERVAL": "10",
+        }
+        rds_database = {
+            "AIRFLOW_DATABASE_NAME": ns.rds.db_name,
+            "AIRFLOW_DATABASE_PORT_NUMBER": "5432",
+            "AIRFLOW_DATABASE_HOST": ns.rds.instance.db_instance_endpoint_address,
+        }
+        rds_secrets = {
+            "AIRFLOW_DATABASE_USERNAME": ecs.Secret.from_secrets_manager(
+                ns.rds.rds_secret, field="username"
+            ),
+            "AIRFLOW_DATABASE_PASSWORD": ecs.Secret.from_secrets_manager(
+                ns.rds.rds_secret, field="password"
+            ),
+        }
+        # Pool the metadata DB connections of every Airflow process
+        pgbouncer_enabled = os.environ.get("AIRFLOW_PGBOUNCER_ENABLED") == "true"
+        database = rds_database
+        if pgbouncer_enabled:
+            database = {
+                **rds_database,
+                "AIRFLOW_DATABASE_PORT_NUMBER": "6432",
+                "AIRFLOW_DATABASE_HOST": "pgbouncer.airflow",
+                "AIRFLOW_PGBOUNCER_ENABLED": "true",
+            }
         fernet_key_secret = sm.Secret.from_secret_arn(
             self, "fernetSecret", os.environ.get("FERNET_SECRET_ARN")
         )
@@ -47,6 +138,49 @@ class AirflowServices(core.Stack):
             description="Private DNS for Airflow webserver",
         )
 
+        if pgbouncer_enabled:
+            self.pgbouncer_service(ns, webserver_ns, rds_database, rds_secrets)
+
+        # DAG change notifications for the services running a single task. A
+        # message goes to one consumer of a queue, so the autoscaled workers
+        # have none and list the bucket every minute instead.
+        webserver_dags_queue = self.dags_sync_queue("webserver", ns.s3.dags_topic)
+        scheduler_dags_queue = self.dags_sync_queue("scheduler", ns.s3.dags_topic)
+        iam.Policy(
+            self,
+            "AirflowDagsSyncQueueAccess",
+            statements=[
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        "sqs:ReceiveMessage",
+                        "sqs:DeleteMessage",
+                        "sqs:GetQueueAttributes",
+                    ],
+                    resources=[
+                        webserver_dags_queue.queue_arn,
+                        scheduler_dags_queue.queue_arn,
+                    ],
+                ),
+            ],
+            roles=[ns.airflow_cluster.airflow_task_role],
+        )
+        iam.Policy(
+            self,
+            "AirflowMetricsAccess",
+            statements=[
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["cloudwatch:PutMetricData"],
+                    resources=["*"],
+                    conditions={
+                        "StringEquals": {"cloudwatch:namespace": METRICS_NAMESPACE}
+                    },
+                ),
+            ],
+            roles=[ns.airflow_cluster.airflow_task_role],
+        )
+
         # Webserver
         webserver_task = ecs.FargateTaskDefinition(
             self,
@@ -67,21 +201,18 @@ class AirflowServices(core.Stack):
                 stream_prefix="ecs", log_group=ns.airflow_cluster.webserver_log_group
             ),
             environment={
-                "AIRFLOW_DATABASE_NAME": ns.rds.db_name,
-                "AIRFLOW_DATABASE_PORT_NUMBER": "5432",
-                "AIRFLOW_DATABASE_HOST": ns.rds.instance.db_instance_endpoint_address,
+                **database,
                 "AIRFLOW_EXECUTOR": "CeleryExecutor",
                 "AIRFLOW_LOAD_EXAMPLES": "no",
                 "AIRFLOW__SCHEDULER__DAG_DIR_LIST_INTERVAL": "30",
                 "BUCKET_NAME": bucket_name,
+                "DAGS_SYNC_QUEUE_URL": webserver_dags_queue.queue_url,
+                "DBT_RUNNER_ENABLED": dbt_runner_enabled,
+                "DBT_CAPACITY_PROVIDERS": dbt_capacity_providers,
+                **dag_serialization,
             },
             secrets={
-                "AIRFLOW_DATABASE_USERNAME": ecs.Secret.from_secrets_manager(
-                    ns.rds.rds_secret, field="username"
-                ),
-                "AIRFLOW_DATABASE_PASSWORD": ecs.Secret.from_secrets_manager(
-                    ns.rds.rds_secret, field="password"
-                ),
+                **rds_secrets,
                 "AIRFLOW_FERNET_KEY": ecs.Secret.from_secrets_manager(
                     fernet_key_secret
                 ),
@@ -132,23 +263,25 @@ class AirflowServices(core.Stack):
                 stream_prefix="ecs", log_group=ns.airflow_cluster.scheduler_log_group
             ),
             environment={
-                "AIRFLOW_DATABASE_NAME": ns.rds.db_name,
-                "AIRFLOW_DATABASE_PORT_NUMBER": "5432",
-                "AIRFLOW_DATABASE_HOST": ns.rds.instance.db_instance_endpoint_address,
+                **database,
                 "AIRFLOW_EXECUTOR": "CeleryExecutor",
                 "AIRFLOW_WEBSERVER_HOST": "webserver.airflow",
                 "AIRFLOW_LOAD_EXAMPLES": "no",
                 "AIRFLOW__SCHEDULER__DAG_DIR_LIST_INTERVAL": "30",
                 "REDIS_HOST": ns.redis.instance.attr_redis_endpoint_address,
                 "BUCKET_NAME": bucket_name,
+                "DAGS_SYNC_QUEUE_URL": scheduler_dags_queue.queue_url,
+                "DBT_RUNNER_ENABLED": dbt_runner_enabled,
+                "DBT_CAPACITY_PROVIDERS": dbt_capacity_providers,
+                "AIRFLOW_METRICS_ENABLED": "true",
+                "AIRFLOW_METRICS_NAMESPACE": METRICS_NAMESPACE,
+                "AIRFLOW_METRICS_QUEUES": f"{LIGHT_QUEUE},{ECS_DISPATCH_QUEUE},default",
+                # Serialize new DAG files as soon as they are synced
+                "DAGS_SERIALIZE_ON_SYNC": "true",
+                **dag_serialization,
             },
             secrets={
-                "AIRFLOW_DATABASE_USERNAME": ecs.Secret.from_secrets_manager(
-                    ns.rds.rds_secret, field="username"
-                ),
-                "AIRFLOW_DATABASE_PASSWORD": ecs.Secret.from_secrets_manager(
-                    ns.rds.rds_secret, field="password"
-                ),
+                **rds_secrets,
                 "AIRFLOW_FERNET_KEY": ecs.Secret.from_secrets_manager(
                     fernet_key_secret
                 ),
@@ -166,65 +299,59 @@ class AirflowServices(core.Stack):
             assign_public_ip=False,
         )
 
-        # Worker
-        worker_task = ecs.FargateTaskDefinition(
-            self,
-            "worker-cdk",
-            family="worker-cdk",
+        # Workers, one service per Celery queue
+        worker_environment = {
+            **database,
+            "AIRFLOW_EXECUTOR": "CeleryExecutor",
+            "AIRFLOW_WEBSERVER_HOST": "webserver.airflow",
+            "AIRFLOW__SCHEDULER__DAG_DIR_LIST_INTERVAL": "30",
+            "AIRFLOW_LOAD_EXAMPLES": "no",
+            "REDIS_HOST": ns.redis.instance.attr_redis_endpoint_address,
+            "BUCKET_NAME": bucket_name,
+            "DBT_RUNNER_ENABLED": dbt_runner_enabled,
+            "DBT_CAPACITY_PROVIDERS": dbt_capacity_providers,
+            # RedisHook only reads the database from the db extra, not the path
+            "AIRFLOW_CONN_DBT_RUNNER_REDIS": (
+                f"redis://{redis_host}:6379?db={DBT_RUNNER_REDIS_DB}"
+            ),
+            **fargate_prices,
+            **dag_serialization,
+        }
+        worker_secrets = {
+            **rds_secrets,
+            "AIRFLOW_FERNET_KEY": ecs.Secret.from_secrets_manager(fernet_key_secret),
+        }
+        # Short tasks, many slots. Also serves tasks left on the default queue.
+        self.worker_service(
+            ns,
+            "worker",
+            queues=[LIGHT_QUEUE, "default"],
             cpu=1024,
-            memory_limit_mib=3072,
-            task_role=ns.airflow_cluster.airflow_task_role,
-            execution_role=ns.airflow_cluster.task_execution_role,
+            memory=3072,
+            concurrency=int(os.environ.get("AIRFLOW_WORKER_CONCURRENCY", "16")),
+            min_capacity=int(os.environ.get("AIRFLOW_WORKERS_MIN", "1")),
+            max_capacity=int(os.environ.get("AIRFLOW_WORKERS_MAX", "4")),
+            capacity_providers=os.environ.get("AIRFLOW_WORKER_CAPACITY_PROVIDERS", ""),
+            environment=worker_environment,
+            secrets=worker_secrets,
         )
-
-        worker_container = worker_task.add_container(
-            "worker-cdk-container",
-            image=ecs.ContainerImage.from_ecr_repository(
-                ns.ecr.airflow_worker_repo,
-                os.environ.get("IMAGE_TAG", "latest"),
+        # Tasks starting or waiting for ECS tasks, few slots
+        self.worker_service(
+            ns,
+            "worker-ecs-dispatch",
+            queues=[ECS_DISPATCH_QUEUE],
+            cpu=512,
+            memory=1024,
+            concurrency=int(
+                os.environ.get("AIRFLOW_ECS_DISPATCH_WORKER_CONCURRENCY", "4")
             ),
-            logging=ecs.AwsLogDriver(
-                stream_prefix="ecs", log_group=ns.airflow_cluster.worker_log_group
+            min_capacity=int(os.environ.get("AIRFLOW_ECS_DISPATCH_WORKERS_MIN", "1")),
+            max_capacity=int(os.environ.get("AIRFLOW_ECS_DISPATCH_WORKERS_MAX", "2")),
+            capacity_providers=os.environ.get(
+                "AIRFLOW_ECS_DISPATCH_WORKER_CAPACITY_PROVIDERS", ""
             ),
-            environment={
-                "AIRFLOW_DATABASE_NAME": ns.rds.db_name,
-                "AIRFLOW_DATABASE_PORT_NUMBER": "5432",
-                "AIRFLOW_DATABASE_HOST": ns.rds.instance.db_instance_endpoint_address,
-                "AIRFLOW_EXECUTOR": "CeleryExecutor",
-                "AIRFLOW_WEBSERVER_HOST": "webserver.airflow",
-                "AIRFLOW__SCHEDULER__DAG_DIR_LIST_INTERVAL": "30",
-                "AIRFLOW_LOAD_EXAMPLES": "no",
-                "REDIS_HOST": ns.redis.instance.attr_redis_endpoint_address,
-                "BUCKET_NAME": bucket_name,
-            },
-            secrets={
-                "AIRFLOW_DATABASE_USERNAME": ecs.Secret.from_secrets_manager(
-                    ns.rds.rds_secret, field="username"
-                ),
-                "AIRFLOW_DATABASE_PASSWORD": ecs.Secret.from_secrets_manager(
-                    ns.rds.rds_secret, field="password"
-                ),
-                "AIRFLOW_FERNET_KEY": ecs.Secret.from_secrets_manager(
-                    fernet_key_secret
-                ),
-            },
-        )
-
-        worker_port_mapping = ecs.PortMapping(
-            container_port=8793, host_port=8793, protocol=ecs.Protocol.TCP
-        )
-        worker_container.add_port_mappings(worker_port_mapping)
-
-        # Worker service
-        ecs.FargateService(
-            self,
-            "workerService",
-            service_name="worker_cdk",
-            cluster=ns.airflow_cluster.instance,
-            task_definition=worker_task,
-            desired_count=1,
-            security_group=ns.vpc.airflow_sg,
-            assign_public_ip=False,
+            environment=worker_environment,
+            secrets=worker_secrets,
         )
 
         # ALB
@@ -251,3 +378,187 @@ class AirflowServices(core.Stack):
             targets=[webserver_service],
             health_check=webserver_hc,
         )
+
+    def worker_service(
+        self,
+        ns: SimpleNamespace,
+        name: str,
+        queues: List[str],
+        cpu: int,
+        memory: int,
+        concurrency: int,
+        min_capacity: int,
+        max_capacity: int,
+        capacity_providers: str,
+        environment: dict,
+        secrets: dict,
+    ) -> ecs.FargateService:
+        task = ecs.FargateTaskDefinition(
+            self,
+            f"{name}-cdk",
+            family=f"{name}-cdk",
+            cpu=cpu,
+            memory_limit_mib=memory,
+            task_role=ns.airflow_cluster.airflow_task_role,
+            execution_role=ns.airflow_cluster.task_execution_role,
+        )
+        container = task.add_container(
+            f"{name}-cdk-container",
+            image=ecs.ContainerImage.from_ecr_repository(
+                ns.ecr.airflow_worker_repo,
+                os.environ.get("IMAGE_TAG", "latest"),
+            ),
+            logging=ecs.AwsLogDriver(
+                stream_prefix="ecs", log_group=ns.airflow_cluster.worker_log_group
+            ),
+            environment={
+                **environment,
+                "AIRFLOW_QUEUE": ",".join(queues),
+                "AIRFLOW__CELERY__WORKER_CONCURRENCY": str(concurrency),
+            },
+            # Give Celery time to finish its tasks when the service scales in
+            stop_timeout=core.Duration.seconds(120),
+            secrets=secrets,
+        )
+        container.add_port_mappings(
+            ecs.PortMapping(
+                container_port=8793, host_port=8793, protocol=ecs.Protocol.TCP
+            )
+        )
+        service = ecs.FargateService(
+            self,
+            f"{name}Service",
+            service_name=f"{name.replace('-', '_')}_cdk",
+            cluster=ns.airflow_cluster.instance,
+            task_definition=task,
+            desired_count=1,
+            security_group=ns.vpc.airflow_sg,
+            assign_public_ip=False,
+            # Spot workers get the stop timeout to finish their tasks when
+            # reclaimed. Tasks still running are lost: the DAGs must set
+            # retries to run them again on another worker.
+            capacity_provider_strategies=capacity_provider_strategies(
+                capacity_providers
+            ),
+        )
+
+        # Autoscaling on the tasks of all the queues the workers consume
+        scaling = service.auto_scale_task_count(
+            min_capacity=min_capacity, max_capacity=max_capacity
+        )
+        # Tasks only wait in the broker once every worker slot is taken
+        scaling.scale_on_metric(
+            "WorkerScaleOut",
+            metric=queues_metric("PendingTasks", queues, core.Duration.minutes(1)),
+            scaling_steps=[
+                appscaling.ScalingInterval(upper=1, change=0),
+                appscaling.ScalingInterval(lower=1, change=+1),
+                appscaling.ScalingInterval(lower=16, change=+2),
+            ],
+            adjustment_type=appscaling.AdjustmentType.CHANGE_IN_CAPACITY,
+            cooldown=core.Duration.seconds(60),
+        )
+        # Scale in only after nothing ran for a while, so no task is cut short
+        scaling.scale_on_metric(
+            "WorkerScaleIn",
+            metric=queues_metric("InFlightTasks", queues, core.Duration.minutes(15)),
+            scaling_steps=[
+                appscaling.ScalingInterval(upper=0, change=-1),
+                appscaling.ScalingInterval(lower=1, change=0),
+            ],
+            adjustment_type=appscaling.AdjustmentType.CHANGE_IN_CAPACITY,
+            cooldown=core.Duration.minutes(15),
+        )
+        return service
+
+    def pgbouncer_service(
+        self,
+        ns: SimpleNamespace,
+        namespace: sd.PrivateDnsNamespace,
+        database: dict,
+        secrets: dict,
+    ) -> ecs.FargateService:
+        task = ecs.FargateTaskDefinition(
+            self,
+            "pgbouncer-cdk",
+            family="pgbouncer-cdk",
+            cpu=256,
+            memory_limit_mib=512,
+            task_role=ns.airflow_cluster.airflow_task_role,
+            execution_role=ns.airflow_cluster.task_execution_role,
+        )
+        container = task.add_container(
+            "pgbouncer-cdk-container",
+            image=ecs.ContainerImage.from_ecr_repository(
+                ns.ecr.pgbouncer_repo,
+                os.environ.get("IMAGE_TAG", "latest"),
+            ),
+            logging=ecs.AwsLogDriver(
+                stream_prefix="ecs", log_group=ns.airflow_cluster.pgbouncer_log_group
+            ),
+            environment={
+                **database,
+                # Server connections per database and user, and the total
+                # kept under the db.t2.micro connection limit
+                "PGBOUNCER_DEFAULT_POOL_SIZE": os.environ.get(
+                    "AIRFLOW_PGBOUNCER_POOL_SIZE", "20"
+                ),
+                "PGBOUNCER_RESERVE_POOL_SIZE": os.environ.get(
+                    "AIRFLOW_PGBOUNCER_RESERVE_POOL_SIZE", "5"
+                ),
+                "PGBOUNCER_MAX_DB_CONNECTIONS": os.environ.get(
+                    "AIRFLOW_PGBOUNCER_MAX_DB_CONNECTIONS", "40"
+                ),
+                "PGBOUNCER_MAX_CLIENT_CONN": os.environ.get(
+                    "AIRFLOW_PGBOUNCER_MAX_CLIENT_CONN", "1000"
+                ),
+            },
+            secrets=secrets,
+        )
+        container.add_port_mappings(
+            ecs.PortMapping(
+                container_port=6432, host_port=6432, protocol=ecs.Protocol.TCP
+            )
+        )
+        return ecs.FargateService(
+            self,
+            "pgbouncerService",
+            service_name="pgbouncer_cdk",
+            cluster=ns.airflow_cluster.instance,
+            task_definition=task,
+            desired_count=1,
+            security_group=ns.vpc.airflow_sg,
+            assign_public_ip=False,
+            cloud_map_options=ecs.CloudMapOptions(
+                cloud_map_namespace=namespace,
+                name="pgbouncer",
+                dns_record_type=sd.DnsRecordType.A,
+                dns_ttl=core.Duration.seconds(30),
+            ),
+        )
+
+    def dags_sync_queue(self, service: str, topic: sns.Topic) -> sqs.Queue:
+        queue = sqs.Queue(
+            self,
+            f"{service}-dags-sync-queue",
+            queue_name=f"airflow-{service}-dags-sync",
+            retention_period=core.Duration.hours(1),
+        )
+        queue.add_to_resource_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                principals=[iam.ServicePrincipal("sns.amazonaws.com")],
+                actions=["sqs:SendMessage"],
+                resources=[queue.queue_arn],
+                conditions={"ArnEquals": {"aws:SourceArn": topic.topic_arn}},
+            )
+        )
+        sns.Subscription(
+            self,
+            f"{service}-dags-sync-subscription",
+            topic=topic,
+            endpoint=queue.queue_arn,
+            protocol=sns.SubscriptionProtocol.SQS,
+            raw_message_delivery=True,
+        )
+        return queue
@@ -4,9 +4,14 @@ from aws_cdk import (
     aws_ecs as ecs,
 )
 from types import SimpleNamespace
-from stacks.airflow_cluster_stack import AirflowClusterStack
+from stacks.airflow_cluster_stack import (
+    AirflowClusterStack,
+    capacity_provider_strategies,
+)
+from stacks.airflow_redis import DBT_RUNNER_REDIS_DB, RedisStack
 from stacks.ecr_stack import ECRStack
 from stacks.redshift_cluster_stack import RedshiftClusterStack
+from stacks.vpc_stack import VpcStack
 from types import SimpleNamespace
 from typing_extensions import TypedDict
 
@@ -16,6 +21,8 @@ props_type = TypedDict(
         "airflow_cluster": AirflowClusterStack,
         "ecr": ECRStack,
         "redshift": RedshiftClusterStack,
+        "vpc": VpcStack,
+        "redis": RedisStack,
     },
 )
 
@@ -37,6 +44,20 @@ class DBT(core.Stack):
             task_role=ns.airflow_cluster.airflow_task_role,
             execution_role=ns.airflow_cluster.task_execution_role,
         )
+        environment = {
+            "BUCKET_NAME": bucket_name,
+            "REDSHIFT_HOST": ns.redshift.instance.cluster_endpoint.hostname,
+            "DBT_ADAPTIVE_THREADS": "true",
+            "DBT_SOURCE_FINGERPRINTS": "true",
+        }
+        secrets = {
+            "REDSHIFT_USER": ecs.Secret.from_secrets_manager(
+                ns.redshift.redshift_secret, field="username"
+            ),
+            "REDSHIFT_PASSWORD": ecs.Secret.from_secrets_manager(
+                ns.redshift.redshift_secret, field="password"
+            ),
+        }
         dbt_task.add_container(
             "dbt-cdk-container",
             image=ecs.ContainerImage.from_ecr_repository(
@@ -46,16 +67,50 @@ class DBT(core.Stack):
             logging=ecs.AwsLogDriver(
                 stream_prefix="ecs", log_group=ns.airflow_cluster.dbt_log_group
             ),
-            environment={
-                "BUCKET_NAME": bucket_name,
-                "REDSHIFT_HOST": ns.redshift.instance.cluster_endpoint.hostname,
-            },
-            secrets={
-                "REDSHIFT_USER": ecs.Secret.from_secrets_manager(
-                    ns.redshift.redshift_secret, field="username"
+            environment=environment,
+            secrets=secrets,
+        )
+
+        if os.environ.get("DBT_RUNNER_ENABLED") == "true":
+            # Long-lived dbt process serving the runs queued by Airflow
+            runner_task = ecs.FargateTaskDefinition(
+                self,
+                "dbt-runner-cdk",
+                family="dbt-runner-cdk",
+                cpu=1024,
+                memory_limit_mib=2048,
+                task_role=ns.airflow_cluster.airflow_task_role,
+                execution_role=ns.airflow_cluster.task_execution_role,
+            )
+            runner_task.add_container(
+                "dbt-runner-cdk-container",
+                image=ecs.ContainerImage.from_ecr_repository(
+                    ns.ecr.dbt_repo,
+                    os.environ.get("IMAGE_TAG", "latest"),
                 ),
-                "REDSHIFT_PASSWORD": ecs.Secret.from_secrets_manager(
-                    ns.redshift.redshift_secret, field="password"
+                command=["python", "/scripts/dbt_runner.py"],
+                logging=ecs.AwsLogDriver(
+                    stream_prefix="ecs", log_group=ns.airflow_cluster.dbt_log_group
                 ),
-            },
-        )
+                environment={
+                    **environment,
+                    "REDIS_HOST": ns.redis.instance.attr_redis_endpoint_address,
+                    "DBT_RUNNER_REDIS_DB": str(DBT_RUNNER_REDIS_DB),
+                },
+                secrets=secrets,
+            )
+            ecs.FargateService(
+                self,
+                "dbtRunnerService",
+                service_name="dbt_runner_cdk",
+                cluster=ns.airflow_cluster.instance,
+                task_definition=runner_task,
+                # A runner builds one command at a time: the runners bound
+                # how many models of a DAG run build at once
+                desired_count=int(os.environ.get("DBT_RUNNER_COUNT", "2")),
+                security_group=ns.vpc.airflow_sg,
+                assign_public_ip=False,
+                capacity_provider_strategies=capacity_provider_strategies(
+                    os.environ.get("DBT_RUNNER_CAPACITY_PROVIDERS", "")
+                ),
+            )
@@ -1,6 +1,6 @@
 import os
 import secrets
-from aws_cdk import aws_s3 as s3, core
+from aws_cdk import aws_s3 as s3, aws_s3_notifications as s3n, aws_sns as sns, core
 
 
 class S3Stack(core.Stack):
@@ -22,6 +22,17 @@ class S3Stack(core.Stack):
             versioned=False,
         )
 
+        # Notify Airflow services about DAG changes
+        self.dags_topic = sns.Topic(
+            self, "dags-updates", topic_name="airflow-dags-updates"
+        )
+        for event in (s3.EventType.OBJECT_CREATED, s3.EventType.OBJECT_REMOVED):
+            self._instance.add_event_notification(
+                event,
+                s3n.SnsDestination(self.dags_topic),
+                s3.NotificationKeyFilter(prefix="airflow_dags/"),
+            )
+
     @property
     def instance(self) -> core.Resource:
         return self._instance
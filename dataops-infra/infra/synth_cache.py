@@ -0,0 +1,178 @@
+"""Cache of synthesized cloud assemblies, keyed by a hash of the app inputs.
+
+The key covers app.py and the stacks/ package, cdk.json and requirements,
+the environment variables read by the stacks, and the context passed by
+the CDK CLI (which includes the selected stacks). An entry holds the whole
+assembly of the selection, not one entry per stack. Variables are found in the syntax tree of
+the stacks; when a module reads a key it cannot name, the whole environment
+is part of the key. When an assembly for the key is cached, it is copied
+to the output directory and the app exits without loading the CDK
+libraries.
+
+Set CDK_SYNTH_CACHE_DIR to move the cache, or to an empty value to disable
+it.
+"""
+import ast
+import hashlib
+import os
+import shutil
+import sys
+from typing import Iterator, Optional, Set
+
+INFRA_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get(
+    "CDK_SYNTH_CACHE_DIR", os.path.join(INFRA_DIR, ".synth_cache")
+)
+ENTRIES_TO_KEEP = 10
+# Set by the CDK CLI for the app, next to CDK_OUTDIR
+CLI_ENV = ["CDK_CONTEXT_JSON", "CDK_DEFAULT_ACCOUNT", "CDK_DEFAULT_REGION"]
+
+
+# Files of the app, other files under infra/ (a venv, cdk.out) are not read
+APP_FILES = ["app.py", "cdk.json", "requirements.txt"]
+STACKS_DIR = os.path.join(INFRA_DIR, "stacks")
+
+
+def _inputs() -> Iterator[str]:
+    for name in APP_FILES:
+        yield os.path.join(INFRA_DIR, name)
+    for root, dirs, files in os.walk(STACKS_DIR):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__" and d[0] != ".")
+        for name in sorted(files):
+            if name.endswith(".py"):
+                yield os.path.join(root, name)
+
+
+def _is_environ(node: ast.AST) -> bool:
+    return (
+        isinstance(node, ast.Attribute)
+        and node.attr == "environ"
+        and isinstance(node.value, ast.Name)
+        and node.value.id == "os"
+    )
+
+
+def _strings(node: ast.AST) -> Optional[Set[str]]:
+    """The string, or the strings of a literal tuple, list or set."""
+    try:
+        value = ast.literal_eval(node)
+    except ValueError:
+        return None
+    if isinstance(value, str):
+        return {value}
+    if isinstance(value, (tuple, list, set)) and all(
+        isinstance(item, str) for item in value
+    ):
+        return set(value)
+    return None
+
+
+def env_vars(source: str) -> Optional[Set[str]]:
+    """Names of the environment variables read by a module, through
+    os.environ[...], os.environ.get(...) or os.getenv(...). A key is either
+    a string or a loop variable over strings. Returns None when the module
+    reads a key it cannot name, or uses os.environ as a whole."""
+    tree = ast.parse(source)
+    # Loop variables over literal strings, like `for name in ("A", "B")`
+    loops = {}
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.For, ast.comprehension)) and isinstance(
+            node.target, ast.Name
+        ):
+            strings = _strings(node.iter)
+            if strings is not None:
+                loops.setdefault(node.target.id, set()).update(strings)
+
+    keys = []
+    read_by_key = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Subscript) and _is_environ(node.value):
+            key = node.slice
+            # ast.Index wraps the key up to Python 3.8
+            keys.append(key.value if isinstance(key, ast.Index) else key)
+            read_by_key.add(id(node.value))
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            getenv = isinstance(node.func.value, ast.Name) and (
+                node.func.value.id == "os" and node.func.attr == "getenv"
+            )
+            if getenv or (node.func.attr == "get" and _is_environ(node.func.value)):
+                keys.append(node.args[0] if node.args else None)
+                read_by_key.add(id(node.func.value))
+    # Any other use, like dict(os.environ), depends on every variable
+    if any(
+        _is_environ(node) and id(node) not in read_by_key for node in ast.walk(tree)
+    ):
+        return None
+
+    names: Set[str] = set()
+    for key in keys:
+        found = None
+        if isinstance(key, ast.Name):
+            found = loops.get(key.id)
+        elif key is not None:
+            found = _strings(key)
+        if found is None:
+            return None
+        names |= found
+    return names
+
+
+def input_hash() -> str:
+    digest = hashlib.sha256()
+    names: Optional[Set[str]] = set(CLI_ENV)
+    for path in _inputs():
+        with open(path, "rb") as f:
+            content = f.read()
+        if path.endswith(".py") and names is not None:
+            found = env_vars(content.decode("utf-8", "replace"))
+            names = None if found is None else names | found
+        digest.update(os.path.relpath(path, INFRA_DIR).encode() + b"\0")
+        digest.update(hashlib.sha256(content).digest())
+    for name in sorted(os.environ if names is None else names):
+        digest.update(f"{name}={os.environ.get(name)}\0".encode())
+    return digest.hexdigest()
+
+
+def _out_dir() -> Optional[str]:
+    # Only the CDK CLI (or a caller setting CDK_OUTDIR) tells where to write
+    return os.environ.get("CDK_OUTDIR") if CACHE_DIR else None
+
+
+def restore() -> bool:
+    """Copy the cached assembly for the current inputs to the output
+    directory, returning whether there was one."""
+    out_dir = _out_dir()
+    if not out_dir:
+        return False
+    entry = os.path.join(CACHE_DIR, input_hash())
+    if not os.path.isdir(entry):
+        return False
+    for root, _, files in os.walk(entry):
+        target = os.path.join(out_dir, os.path.relpath(root, entry))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            shutil.copy2(os.path.join(root, name), target)
+    os.utime(entry)
+    print(
+        f"Reused synthesized assembly {os.path.basename(entry)[:12]}", file=sys.stderr
+    )
+    return True
+
+
+def save(assembly_dir: str) -> None:
+    if not _out_dir():
+        return
+    entry = os.path.join(CACHE_DIR, input_hash())
+    tmp_entry = f"{entry}.tmp{os.getpid()}"
+    shutil.copytree(assembly_dir, tmp_entry)
+    if os.path.isdir(entry):
+        shutil.rmtree(tmp_entry)
+    else:
+        os.replace(tmp_entry, entry)
+
+    entries = sorted(
+        (os.path.join(CACHE_DIR, name) for name in os.listdir(CACHE_DIR)),
+        key=os.path.getmtime,
+    )
+    for path in entries[:-ENTRIES_TO_KEEP]:
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,161 @@
+"""Local stand-in for the ECS API calls of the dbt tasks.
+
+    $ python loadtest/ecs_stub.py --port 5001 --task-seconds 30
+
+Answers RunTask, DescribeTasks and StopTask like ECS does for a Fargate
+task whose essential container exits with 0 after --task-seconds (instead
+of running dbt), so EcsRunTaskOperator and EcsTaskSensor run unchanged
+against it. Tasks started with a capacity provider strategy land on a
+provider picked by weight, and --spot-interruption-rate of the FARGATE_SPOT
+tasks are reclaimed halfway, to exercise the on-demand fallback. Point the aws_ecs connection at it with the `host` extra:
+
+    AIRFLOW_CONN_AWS_ECS="aws://testing:testing@/?region_name=us-east-1&host=http%3A%2F%2Flocalhost%3A5001"
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+REGION = "us-east-1"
+ACCOUNT = "123456789012"
+
+
+class EcsStub:
+    def __init__(self, task_seconds: float, spot_interruption_rate: float = 0) -> None:
+        self.task_seconds = task_seconds
+        self.spot_interruption_rate = spot_interruption_rate
+        self.tasks: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def run_task(self, request: dict) -> dict:
+        arn = f"arn:aws:ecs:{REGION}:{ACCOUNT}:task/{request.get('cluster', 'default')}/{uuid.uuid4().hex}"
+        overrides = request.get("overrides", {}).get("containerOverrides", [])
+        strategy = request.get("capacityProviderStrategy")
+        provider = "FARGATE"
+        if strategy:
+            provider = random.choices(
+                [item["capacityProvider"] for item in strategy],
+                [item.get("weight", 0) or 0.001 for item in strategy],
+            )[0]
+        now = time.time()
+        task = {
+            "taskArn": arn,
+            "clusterArn": f"arn:aws:ecs:{REGION}:{ACCOUNT}:cluster/{request.get('cluster', 'default')}",
+            "taskDefinitionArn": request["taskDefinition"],
+            "launchType": "FARGATE",
+            "capacityProviderName": provider,
+            "cpu": "512",
+            "memory": "1024",
+            "startedBy": request.get("startedBy", ""),
+            "overrides": request.get("overrides", {}),
+            "createdAt": now,
+            "pullStartedAt": now,
+            "startedAt": now,
+            "interrupted": provider == "FARGATE_SPOT"
+            and random.random() < self.spot_interruption_rate,
+            "containers": [
+                {"name": override["name"], "lastStatus": "RUNNING"}
+                for override in overrides
+            ],
+        }
+        with self.lock:
+            self.tasks[arn] = task
+        return {"tasks": [self.describe(task)], "failures": []}
+
+    def describe(self, task: dict) -> dict:
+        elapsed = time.time() - task["createdAt"]
+        if "stoppedReason" not in task and task["interrupted"]:
+            if elapsed >= self.task_seconds / 2:
+                task["stoppedReason"] = "Your Spot Task was interrupted."
+                task["stopCode"] = "SpotInterruption"
+                task["stoppedAt"] = time.time()
+                for container in task["containers"]:
+                    container.update(lastStatus="STOPPED", exitCode=143)
+        elif "stoppedReason" not in task and elapsed >= self.task_seconds:
+            task["stoppedReason"] = "Essential container in task exited"
+            task["stopCode"] = "EssentialContainerExited"
+            task["stoppedAt"] = time.time()
+            for container in task["containers"]:
+                container.update(lastStatus="STOPPED", exitCode=0)
+        status = "STOPPED" if "stoppedReason" in task else "RUNNING"
+        task = {key: value for key, value in task.items() if key != "interrupted"}
+        return {**task, "lastStatus": status, "desiredStatus": status}
+
+    def describe_tasks(self, request: dict) -> dict:
+        with self.lock:
+            found = [self.tasks[arn] for arn in request["tasks"] if arn in self.tasks]
+            tasks = [self.describe(task) for task in found]
+        failures = [
+            {"arn": arn, "reason": "MISSING"}
+            for arn in request["tasks"]
+            if arn not in self.tasks
+        ]
+        return {"tasks": tasks, "failures": failures}
+
+    def stop_task(self, request: dict) -> dict:
+        with self.lock:
+            task = self.tasks[request["task"]]
+            task["stoppedReason"] = request.get("reason", "Task stopped by user")
+            task["stopCode"] = "UserInitiated"
+            task["stoppedAt"] = time.time()
+            for container in task["containers"]:
+                container.update(lastStatus="STOPPED", exitCode=143)
+            return {"task": self.describe(task)}
+
+
+def handler(stub: EcsStub):
+    actions = {
+        "RunTask": stub.run_task,
+        "DescribeTasks": stub.describe_tasks,
+        "StopTask": stub.stop_task,
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            # X-Amz-Target: AmazonEC2ContainerServiceV20141113.RunTask
+            action = self.headers.get("X-Amz-Target", "").rsplit(".", 1)[-1]
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if action in actions:
+                status, response = 200, actions[action](json.loads(body or b"{}"))
+            else:
+                status, response = 400, {
+                    "__type": "InvalidAction",
+                    "message": f"{action} is not supported by the ECS stub",
+                }
+            payload = json.dumps(response, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/x-amz-json-1.1")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument(
+        "--task-seconds", type=float, default=30, help="run time of every task"
+    )
+    parser.add_argument(
+        "--spot-interruption-rate",
+        type=float,
+        default=0,
+        help="share of the FARGATE_SPOT tasks interrupted",
+    )
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(
+        (args.host, args.port),
+        handler(EcsStub(args.task_seconds, args.spot_interruption_rate)),
+    )
+    server.serve_forever()
@@ -0,0 +1,139 @@
+"""Measure the metadata DB cost of Airflow task starts, direct and pooled.
+
+    $ python loadtest/metadb_task_start.py \\
+        --dsn "host=localhost dbname=airflow user=airflow" \\
+        --pooled-dsn "host=localhost port=6432 dbname=airflow user=airflow" \\
+        --concurrency 8 --concurrency 64 --tasks 400
+
+`airflow run` disables the SQLAlchemy pool, so every session of a starting
+task opens its own connection: the `--local` job registers itself, checks
+the task dependencies and marks the task running, then the `--raw` process
+reloads the task instance. Each simulated start opens --sessions
+connections in turn, each running one such transaction against a scratch
+table. Starts run --concurrency at a time and their p50, p95 and max
+latencies are printed per DSN, with the starts that failed to connect
+(for instance on max_connections).
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import psycopg2
+
+TABLE = "loadtest_task_instance"
+
+
+def setup(dsn: str, tasks: int) -> None:
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cursor.execute(
+            f"""
+            CREATE TABLE {TABLE} (
+                task_id int PRIMARY KEY,
+                state text,
+                pid int,
+                try_number int,
+                start_date timestamp
+            )
+            """
+        )
+        cursor.execute(
+            f"INSERT INTO {TABLE} SELECT i, 'queued', NULL, 0, NULL"
+            " FROM generate_series(0, %s) i",
+            (tasks,),
+        )
+    conn.close()
+
+
+def teardown(dsn: str) -> None:
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    conn.close()
+
+
+def task_start(dsn: str, task_id: int, sessions: int) -> Optional[float]:
+    started = time.perf_counter()
+    for _ in range(sessions):
+        try:
+            conn = psycopg2.connect(dsn)
+        except psycopg2.OperationalError:
+            return None
+        try:
+            with conn, conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT state, try_number FROM {TABLE}"
+                    " WHERE task_id = %s FOR UPDATE",
+                    (task_id,),
+                )
+                cursor.execute(
+                    f"UPDATE {TABLE} SET state = 'running', pid = %s,"
+                    " try_number = try_number + 1, start_date = now()"
+                    " WHERE task_id = %s",
+                    (os.getpid(), task_id),
+                )
+        finally:
+            conn.close()
+    return time.perf_counter() - started
+
+
+def benchmark(dsn: str, concurrency: int, tasks: int, sessions: int) -> Dict:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(
+            executor.map(lambda i: task_start(dsn, i, sessions), range(tasks))
+        )
+    elapsed = time.perf_counter() - started
+    latencies: List[float] = sorted(r for r in results if r is not None)
+    if not latencies:
+        return {"failed": tasks}
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "max": latencies[-1],
+        "starts_per_second": len(latencies) / elapsed,
+        "failed": tasks - len(latencies),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", required=True, help="metadata DB, direct")
+    parser.add_argument("--pooled-dsn", help="the same database through PgBouncer")
+    parser.add_argument("--concurrency", type=int, action="append")
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args()
+
+    targets = {"direct": args.dsn}
+    if args.pooled_dsn:
+        targets["pgbouncer"] = args.pooled_dsn
+    setup(args.dsn, args.tasks)
+    try:
+        results = {
+            f"{name} x{concurrency}": benchmark(
+                dsn, concurrency, args.tasks, args.sessions
+            )
+            for concurrency in args.concurrency or [8, 64]
+            for name, dsn in targets.items()
+        }
+    finally:
+        teardown(args.dsn)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results.items():
+            if "p50" not in result:
+                print(f"{name}: all {result['failed']} starts failed")
+                continue
+            print(
+                "{name}: p50 {p50:.3f}s p95 {p95:.3f}s max {max:.3f}s, "
+                "{starts_per_second:.0f} starts/s, {failed} failed".format(
+                    name=name, **result
+                )
+            )
@@ -0,0 +1,564 @@
+"""Measure Airflow scheduler and executor throughput on a local stack.
+
+docker-compose.yml next to this script runs the webserver, scheduler and
+both worker services from images/airflow against local stand-ins: Postgres
+for the metadata DB, Redis for the broker, moto for S3 and CloudWatch and
+ecs_stub.py for ECS. Their environment is taken from the synthesized
+`airflow` stack, so the containers run with what fargate_services/airflow.py
+configures, the AWS endpoints and secrets aside:
+
+    $ (cd infra && cdk synth airflow)
+    $ python loadtest/scheduler_throughput.py env
+    $ docker-compose -f loadtest/docker-compose.yml up -d --build
+    $ python loadtest/scheduler_throughput.py dags --dags 20 --models 10
+    $ python loadtest/scheduler_throughput.py run --label baseline --output baseline.json
+    $ python loadtest/scheduler_throughput.py compare baseline.json pooled.json
+
+`dags` writes N synthetic DAGs shaped like redshift_transformations (a bash
+task, M dbt models as ECS run tasks and sensors in layers of --width, the
+save-state run and sensor, a Python check and a final bash task) and
+uploads them with the dataops package to the DAGs prefix of the local
+bucket, where sync_dags.py picks them up. `run` triggers --runs runs of
+every DAG at once, waits for them and reports, from the metadata DB:
+
+* scheduling delay: from the time a task instance could run (its upstream
+  tasks finished, its DAG run started or its sensor's reschedule date) to
+  the time the scheduler queued it;
+* queued to running: from queued to started on a worker, for task
+  instances that were not rescheduled;
+* reschedule delay: from a sensor's reschedule date to its next poke;
+* throughput: task instances finished per minute, overall and at peak.
+
+Results are saved with the shape of the DAGs and the environment of every
+service, and `compare` prints several results side by side with the
+settings that differ between them.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import boto3
+import psycopg2
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+DATAOPS_PACKAGE = os.path.join(
+    LOADTEST_DIR, "..", "..", "analytics", "airflow_dags", "dataops"
+)
+ENV_DIR = os.path.join(LOADTEST_DIR, "env")
+DAGS_DIR = os.path.join(LOADTEST_DIR, "dags")
+SHAPE_FILE = "loadtest.json"
+RUN_ID_PREFIX = "loadtest__"
+
+# Task definition families of the airflow stack -> docker-compose services
+SERVICES = {
+    "webserver-cdk": "webserver",
+    "scheduler-cdk": "scheduler",
+    "worker-cdk": "worker",
+    "worker-ecs-dispatch-cdk": "worker-ecs-dispatch",
+    "pgbouncer-cdk": "pgbouncer",
+}
+# Values resolved by CloudFormation (endpoints, ARNs) and Cloud Map names,
+# replaced by the docker-compose services
+LOCAL_VALUES = {
+    "AIRFLOW_DATABASE_HOST": "postgres",
+    "AIRFLOW_DATABASE_NAME": "airflow",
+    "REDIS_HOST": "redis",
+    "AIRFLOW_CONN_DBT_RUNNER_REDIS": "redis://redis:6379?db=2",
+    "BUCKET_NAME": "loadtest",
+}
+LOCAL_HOSTS = {"pgbouncer.airflow": "pgbouncer", "webserver.airflow": "webserver"}
+# SQS notifications are not emulated, sync_dags.py polls the bucket instead
+DROPPED = {"DAGS_SYNC_QUEUE_URL"}
+
+DAG_TEMPLATE = '''"""Synthetic DAG generated by loadtest/scheduler_throughput.py."""
+from datetime import datetime
+
+from airflow import DAG
+from airflow.operators.bash_operator import BashOperator
+from airflow.operators.python_operator import PythonOperator
+
+from dataops.ecs import EcsRunTaskOperator, EcsTaskSensor
+
+UPSTREAM = {upstream!r}
+
+dag = DAG(
+    "{dag_id}",
+    default_args={{"owner": "airflow", "retries": 0}},
+    start_date=datetime(2021, 1, 1),
+    schedule_interval=None,
+    is_paused_upon_creation=False,
+)
+
+
+def check(**context):
+    pass
+
+
+def task(task_id):
+    if task_id.endswith("_wait"):
+        return EcsTaskSensor(task_id=task_id, dag=dag, run_task_id=task_id[:-5])
+    if task_id == "dbt_regression_check":
+        return PythonOperator(
+            task_id=task_id, dag=dag, python_callable=check, provide_context=True
+        )
+    if task_id.startswith("dbt_"):
+        return EcsRunTaskOperator(
+            task_id=task_id,
+            dag=dag,
+            aws_conn_id="aws_ecs",
+            cluster="MyCluster",
+            task_definition="dbt-cdk",
+            launch_type="FARGATE",
+            overrides={{
+                "containerOverrides": [
+                    {{"name": "dbt-cdk-container", "command": ["dbt", "run"]}},
+                ],
+            }},
+        )
+    return BashOperator(task_id=task_id, bash_command="echo 1", dag=dag)
+
+
+tasks = {{task_id: task(task_id) for task_id in UPSTREAM}}
+for task_id, upstream in UPSTREAM.items():
+    for parent in upstream:
+        tasks[parent] >> tasks[task_id]
+'''
+
+
+def stack_environment(template_path: str) -> Dict[str, Dict[str, str]]:
+    """Return the container environment of every Airflow service of the
+    synthesized stack, with local values for the deploy-time ones."""
+    with open(template_path) as f:
+        resources = json.load(f)["Resources"]
+    environments = {service: {} for service in SERVICES.values()}
+    for resource in resources.values():
+        properties = resource.get("Properties", {})
+        service = SERVICES.get(properties.get("Family"))
+        if resource["Type"] != "AWS::ECS::TaskDefinition" or service is None:
+            continue
+        for variable in properties["ContainerDefinitions"][0].get("Environment", []):
+            name, value = variable["Name"], variable["Value"]
+            if name in DROPPED:
+                continue
+            if name in LOCAL_VALUES:
+                value = LOCAL_VALUES[name]
+            elif not isinstance(value, str):
+                print(f"{service}: no local value for {name}, skipped", file=sys.stderr)
+                continue
+            environments[service][name] = LOCAL_HOSTS.get(value, value)
+    return environments
+
+
+def write_env(template_path: str, env_dir: str) -> None:
+    os.makedirs(env_dir, exist_ok=True)
+    for service, environment in stack_environment(template_path).items():
+        with open(os.path.join(env_dir, f"{service}.env"), "w") as f:
+            for name, value in sorted(environment.items()):
+                f.write(f"{name}={value}\n")
+
+
+def dag_shape(models: int, width: int) -> Dict[str, List[str]]:
+    """Upstream task ids of every task of a synthetic DAG. Each dbt model
+    depends on every model of the previous layer."""
+    upstream = {"run_bash_echo": []}
+    previous = ["run_bash_echo"]
+    for start in range(0, models, width):
+        layer = []
+        for index in range(start, min(start + width, models)):
+            task_id = f"dbt_model_{index:03d}"
+            upstream[task_id] = previous
+            upstream[f"{task_id}_wait"] = [task_id]
+            layer.append(f"{task_id}_wait")
+        previous = layer
+    upstream["dbt_save_state"] = previous
+    upstream["dbt_save_state_wait"] = ["dbt_save_state"]
+    upstream["dbt_regression_check"] = ["dbt_save_state_wait"]
+    upstream["post_dbt"] = ["dbt_regression_check"]
+    return upstream
+
+
+def write_dags(dags_dir: str, dags: int, models: int, width: int) -> dict:
+    shutil.rmtree(dags_dir, ignore_errors=True)
+    shutil.copytree(
+        DATAOPS_PACKAGE,
+        os.path.join(dags_dir, "dataops"),
+        ignore=shutil.ignore_patterns("__pycache__"),
+    )
+    upstream = dag_shape(models, width)
+    shape = {
+        "dags": [f"loadtest_{index:03d}" for index in range(dags)],
+        "models": models,
+        "width": width,
+        "upstream": upstream,
+    }
+    for dag_id in shape["dags"]:
+        with open(os.path.join(dags_dir, f"{dag_id}.py"), "w") as f:
+            f.write(DAG_TEMPLATE.format(dag_id=dag_id, upstream=upstream))
+    with open(os.path.join(dags_dir, SHAPE_FILE), "w") as f:
+        json.dump(shape, f, indent=2)
+    return shape
+
+
+def upload_dags(s3, dags_dir: str, bucket: str, prefix: str) -> None:
+    try:
+        s3.create_bucket(Bucket=bucket)
+    except s3.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    stale = s3.list_objects_v2(Bucket=bucket, Prefix=prefix).get("Contents", [])
+    for obj in stale:
+        s3.delete_object(Bucket=bucket, Key=obj["Key"])
+    for path in glob.glob(os.path.join(dags_dir, "**", "*.py"), recursive=True):
+        key = prefix + os.path.relpath(path, dags_dir).replace(os.sep, "/")
+        s3.upload_file(path, bucket, key)
+
+
+def wait_for_dags(conn, dag_ids: List[str], timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM dag"
+                " WHERE dag_id = ANY(%s) AND is_active AND NOT is_paused",
+                (dag_ids,),
+            )
+            parsed = cursor.fetchone()[0]
+        if parsed == len(dag_ids):
+            return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{parsed}/{len(dag_ids)} DAGs parsed in {timeout}s")
+        time.sleep(2)
+
+
+def trigger(conn, dag_ids: List[str], runs: int, label: str) -> str:
+    """Create `runs` DAG runs of every DAG at once, like `airflow trigger_dag`.
+    The scheduler creates their task instances."""
+    prefix = f"{RUN_ID_PREFIX}{label}_{datetime.now(timezone.utc):%Y%m%dT%H%M%S}_"
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT now()")
+        now = cursor.fetchone()[0]
+        for run in range(runs):
+            for dag_id in dag_ids:
+                cursor.execute(
+                    "INSERT INTO dag_run (dag_id, execution_date, start_date, state,"
+                    " run_id, external_trigger) VALUES (%s, %s, %s, 'running', %s, true)",
+                    (
+                        dag_id,
+                        now + timedelta(microseconds=run),
+                        now,
+                        f"{prefix}{run}",
+                    ),
+                )
+    return prefix
+
+
+def wait_for_runs(conn, prefix: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT state, count(*) FROM dag_run WHERE run_id LIKE %s"
+                " GROUP BY state",
+                (prefix + "%",),
+            )
+            states = dict(cursor.fetchall())
+        print(
+            " ".join(f"{state}={count}" for state, count in sorted(states.items())),
+            file=sys.stderr,
+        )
+        if not states.get("running"):
+            return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"DAG runs still running after {timeout}s")
+        time.sleep(10)
+
+
+def fetch_runs(conn, prefix: str) -> dict:
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT dag_id, execution_date, start_date, end_date, state"
+            " FROM dag_run WHERE run_id LIKE %s",
+            (prefix + "%",),
+        )
+        runs = {(row[0], row[1]): row[2:] for row in cursor.fetchall()}
+        cursor.execute(
+            "SELECT ti.dag_id, ti.execution_date, ti.task_id, ti.state,"
+            " ti.queued_dttm, ti.start_date, ti.end_date"
+            " FROM task_instance ti JOIN dag_run dr"
+            " ON dr.dag_id = ti.dag_id AND dr.execution_date = ti.execution_date"
+            " WHERE dr.run_id LIKE %s",
+            (prefix + "%",),
+        )
+        task_instances = cursor.fetchall()
+        cursor.execute(
+            "SELECT tr.dag_id, tr.execution_date, tr.task_id, tr.start_date,"
+            " tr.reschedule_date FROM task_reschedule tr JOIN dag_run dr"
+            " ON dr.dag_id = tr.dag_id AND dr.execution_date = tr.execution_date"
+            " WHERE dr.run_id LIKE %s ORDER BY tr.id",
+            (prefix + "%",),
+        )
+        reschedules: Dict[tuple, List[tuple]] = {}
+        for dag_id, execution_date, task_id, start, reschedule in cursor.fetchall():
+            key = (dag_id, execution_date, task_id)
+            reschedules.setdefault(key, []).append((start, reschedule))
+    return {"runs": runs, "task_instances": task_instances, "reschedules": reschedules}
+
+
+def percentiles(samples: List[float]) -> Optional[Dict[str, float]]:
+    if not samples:
+        return None
+    samples = sorted(samples)
+
+    def at(fraction: float) -> float:
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+    return {
+        "count": len(samples),
+        "p50": statistics.median(samples),
+        "p95": at(0.95),
+        "p99": at(0.99),
+        "max": samples[-1],
+    }
+
+
+def measure(data: dict, upstream: Dict[str, List[str]]) -> dict:
+    ends = {
+        (dag_id, execution_date, task_id): end_date
+        for dag_id, execution_date, task_id, _, _, _, end_date in data["task_instances"]
+    }
+    scheduling, queued, rescheduled, finished = [], [], [], []
+    states = Counter()
+    for row in data["task_instances"]:
+        dag_id, execution_date, task_id, state, queued_at, started, ended = row
+        states[state] += 1
+        key = (dag_id, execution_date, task_id)
+        pokes = data["reschedules"].get(key, [])
+        if ended is not None:
+            finished.append(ended)
+        if queued_at is None:
+            continue
+        if pokes:
+            ready = pokes[-1][1]
+        elif upstream[task_id]:
+            parents = [ends.get((dag_id, execution_date, p)) for p in upstream[task_id]]
+            if None in parents:
+                continue
+            ready = max(parents)
+        else:
+            ready = data["runs"][(dag_id, execution_date)][0]
+        scheduling.append((queued_at - ready).total_seconds())
+        if started is not None and not pokes:
+            queued.append((started - queued_at).total_seconds())
+        for (_, reschedule), (next_start, _) in zip(pokes, pokes[1:]):
+            rescheduled.append((next_start - reschedule).total_seconds())
+
+    run_starts = [start for start, _, _ in data["runs"].values()]
+    run_durations = [
+        (end - start).total_seconds()
+        for start, end, _ in data["runs"].values()
+        if end is not None
+    ]
+    result = {
+        "dag_runs": Counter(state for _, _, state in data["runs"].values()),
+        "task_instances": states,
+        "scheduling_delay": percentiles(scheduling),
+        "queued_to_running": percentiles(queued),
+        "reschedule_delay": percentiles(rescheduled),
+        "dag_run_duration": percentiles(run_durations),
+    }
+    if finished:
+        elapsed = (max(finished) - min(run_starts)).total_seconds()
+        per_minute = Counter(end.replace(second=0, microsecond=0) for end in finished)
+        result["throughput"] = {
+            "task_instances_per_minute": len(finished) / elapsed * 60,
+            "peak_task_instances_per_minute": max(per_minute.values()),
+            "elapsed": elapsed,
+        }
+    return result
+
+
+def read_env(env_dir: str) -> Dict[str, Dict[str, str]]:
+    environments = {}
+    for path in sorted(glob.glob(os.path.join(env_dir, "*.env"))):
+        with open(path) as f:
+            lines = [line.strip() for line in f if "=" in line]
+        service = os.path.basename(path)[: -len(".env")]
+        environments[service] = dict(line.split("=", 1) for line in lines)
+    return environments
+
+
+def flatten(config: dict, prefix: str = "") -> Dict[str, str]:
+    flat = {}
+    for key, value in config.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = json.dumps(value)
+    return flat
+
+
+def compare(results: List[dict]) -> None:
+    labels = [result["label"] for result in results]
+    rows = [("", labels)]
+    for metric in (
+        "scheduling_delay",
+        "queued_to_running",
+        "reschedule_delay",
+        "dag_run_duration",
+    ):
+        for stat in ("p50", "p95", "p99", "max"):
+            rows.append(
+                (
+                    f"{metric} {stat} (s)",
+                    [
+                        f"{r['results'][metric][stat]:.2f}"
+                        if r["results"].get(metric)
+                        else "-"
+                        for r in results
+                    ],
+                )
+            )
+    for stat in ("task_instances_per_minute", "peak_task_instances_per_minute"):
+        rows.append(
+            (
+                stat.replace("_", " "),
+                [
+                    f"{r['results']['throughput'][stat]:.1f}"
+                    if "throughput" in r["results"]
+                    else "-"
+                    for r in results
+                ],
+            )
+        )
+    width = max(len(name) for name, _ in rows)
+    columns = [max(len(label), 8) for label in labels]
+    for name, values in rows:
+        cells = (value.rjust(column) for value, column in zip(values, columns))
+        print(f"{name.ljust(width)}  " + "  ".join(cells))
+
+    configs = [flatten(result["config"]) for result in results]
+    keys = sorted(set().union(*configs))
+    differences = [
+        key for key in keys if len({config.get(key) for config in configs}) > 1
+    ]
+    if differences:
+        print("\nsettings that differ:")
+        for key in differences:
+            values = ", ".join(
+                f"{label}={config.get(key, '(unset)')}"
+                for label, config in zip(labels, configs)
+            )
+            print(f"  {key}: {values}")
+
+
+def print_result(result: dict) -> None:
+    for metric in (
+        "scheduling_delay",
+        "queued_to_running",
+        "reschedule_delay",
+        "dag_run_duration",
+    ):
+        values = result["results"].get(metric)
+        if values:
+            print(
+                "{metric}: p50 {p50:.2f}s p95 {p95:.2f}s p99 {p99:.2f}s max {max:.2f}s"
+                " ({count} samples)".format(metric=metric, **values)
+            )
+    throughput = result["results"].get("throughput")
+    if throughput:
+        print(
+            "throughput: {task_instances_per_minute:.1f} task instances/min,"
+            " peak {peak_task_instances_per_minute}/min"
+            " over {elapsed:.0f}s".format(**throughput)
+        )
+    print(f"task instances: {dict(result['results']['task_instances'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    env_parser = subparsers.add_parser("env", help="write the service environments")
+    env_parser.add_argument(
+        "--template",
+        default=os.path.join(
+            LOADTEST_DIR, "..", "infra", "cdk.out", "airflow.template.json"
+        ),
+    )
+    env_parser.add_argument("--env-dir", default=ENV_DIR)
+
+    dags_parser = subparsers.add_parser("dags", help="generate and upload DAGs")
+    dags_parser.add_argument("--dags", type=int, default=10)
+    dags_parser.add_argument("--models", type=int, default=8, help="per DAG")
+    dags_parser.add_argument("--width", type=int, default=4, help="models per layer")
+    dags_parser.add_argument("--dags-dir", default=DAGS_DIR)
+    dags_parser.add_argument("--bucket", default=LOCAL_VALUES["BUCKET_NAME"])
+    dags_parser.add_argument("--prefix", default="airflow_dags/")
+    dags_parser.add_argument("--s3-endpoint-url", default="http://localhost:5000")
+
+    run_parser = subparsers.add_parser("run", help="trigger the DAGs and measure")
+    run_parser.add_argument(
+        "--dsn",
+        default="host=localhost port=5432 dbname=airflow user=airflow password=airflow",
+    )
+    run_parser.add_argument("--runs", type=int, default=1, help="per DAG")
+    run_parser.add_argument("--label", default="run")
+    run_parser.add_argument("--output", help="save the results as JSON")
+    run_parser.add_argument("--dags-dir", default=DAGS_DIR)
+    run_parser.add_argument("--env-dir", default=ENV_DIR)
+    run_parser.add_argument("--timeout", type=float, default=3600)
+
+    compare_parser = subparsers.add_parser("compare", help="compare saved results")
+    compare_parser.add_argument("results", nargs="+")
+    args = parser.parse_args()
+
+    if args.action == "env":
+        write_env(args.template, args.env_dir)
+    elif args.action == "dags":
+        write_dags(args.dags_dir, args.dags, args.models, args.width)
+        s3 = boto3.client(
+            "s3",
+            endpoint_url=args.s3_endpoint_url,
+            aws_access_key_id="testing",
+            aws_secret_access_key="testing",
+            region_name="us-east-1",
+        )
+        upload_dags(s3, args.dags_dir, args.bucket, args.prefix)
+    elif args.action == "run":
+        with open(os.path.join(args.dags_dir, SHAPE_FILE)) as f:
+            shape = json.load(f)
+        conn = psycopg2.connect(args.dsn)
+        conn.autocommit = True
+        wait_for_dags(conn, shape["dags"], args.timeout)
+        prefix = trigger(conn, shape["dags"], args.runs, args.label)
+        wait_for_runs(conn, prefix, args.timeout)
+        result = {
+            "label": args.label,
+            "config": {
+                "dags": len(shape["dags"]),
+                "models": shape["models"],
+                "width": shape["width"],
+                "runs": args.runs,
+                "task_seconds": os.environ.get("LOADTEST_TASK_SECONDS", "30"),
+                "environment": read_env(args.env_dir),
+            },
+            "results": measure(fetch_runs(conn, prefix), shape["upstream"]),
+        }
+        conn.close()
+        print_result(result)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2, default=str)
+    else:
+        results = []
+        for path in args.results:
+            with open(path) as f:
+                results.append(json.load(f))
+        compare(results)
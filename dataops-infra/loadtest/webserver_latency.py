@@ -0,0 +1,117 @@
+"""Measure Airflow webserver cold start and page latency.
+
+    $ python loadtest/webserver_latency.py http://localhost:8080 \\
+        --start "airflow webserver -p 8080" --requests 20
+
+With --start, the command is launched and the time until /health answers,
+and until the first page renders, is reported as the cold start. Each path
+is then requested --requests times and its p50, p95 and max latencies are
+printed. Paths default to the RBAC UI of the bitnami images; pass --cookie
+with a session cookie when the UI requires a login.
+"""
+import argparse
+import json
+import os
+import shlex
+import signal
+import statistics
+import subprocess
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+DEFAULT_PATHS = [
+    "/home",
+    "/tree?dag_id=redshift_transformations",
+    "/graph?dag_id=redshift_transformations",
+]
+
+
+def fetch(url: str, cookie: Optional[str] = None, timeout: float = 60) -> float:
+    request = urllib.request.Request(url)
+    if cookie:
+        request.add_header("Cookie", cookie)
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+    return time.perf_counter() - started
+
+
+def wait_until_up(url: str, started: float, timeout: float) -> float:
+    while time.perf_counter() - started < timeout:
+        try:
+            fetch(url, timeout=5)
+            return time.perf_counter() - started
+        except OSError:  # refused, reset or timed out while booting
+            time.sleep(0.2)
+    raise TimeoutError(f"{url} did not answer within {timeout}s")
+
+
+def cold_start(
+    base_url: str,
+    started: float,
+    first_path: str,
+    cookie: Optional[str],
+    timeout: float,
+) -> Dict[str, float]:
+    health = wait_until_up(base_url + "/health", started, timeout)
+    fetch(base_url + first_path, cookie)
+    return {"health": health, "first_page": time.perf_counter() - started}
+
+
+def latencies(url: str, requests: int, cookie: Optional[str]) -> Dict[str, float]:
+    samples: List[float] = [fetch(url, cookie) for _ in range(requests)]
+    samples.sort()
+    return {
+        "p50": statistics.median(samples),
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max": samples[-1],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base_url")
+    parser.add_argument("--start", help="command starting the webserver")
+    parser.add_argument("--path", action="append", dest="paths")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--cookie")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args()
+
+    base_url = args.base_url.rstrip("/")
+    paths = args.paths or DEFAULT_PATHS
+    results = {}
+    process = None
+    try:
+        if args.start:
+            started = time.perf_counter()
+            process = subprocess.Popen(shlex.split(args.start), start_new_session=True)
+            results["cold_start"] = cold_start(
+                base_url, started, paths[0], args.cookie, args.timeout
+            )
+        results["latency"] = {
+            path: latencies(base_url + path, args.requests, args.cookie)
+            for path in paths
+        }
+    finally:
+        if process is not None:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        if "cold_start" in results:
+            print(
+                "cold start: health {health:.2f}s, first page {first_page:.2f}s".format(
+                    **results["cold_start"]
+                )
+            )
+        for path, latency in results["latency"].items():
+            print(
+                "{path}: p50 {p50:.3f}s p95 {p95:.3f}s max {max:.3f}s".format(
+                    path=path, **latency
+                )
+            )
@@ -0,0 +1,80 @@
+"""Benchmark CDK synthesis of the infra app.
+
+    $ python scripts/benchmark_synth.py --runs 3
+    $ python scripts/benchmark_synth.py --selection airflow --selection dbt
+
+Runs infra/app.py like the CDK CLI does, for every stack selection, with
+an empty template cache (cold) and with the cache primed (warm), and
+prints the median wall time of each.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+INFRA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "infra")
+DEFAULT_SELECTIONS = ["all", "airflow", "dbt"]
+
+
+def synth(selection: str, cache_dir: str) -> float:
+    with open(os.path.join(INFRA_DIR, "cdk.json")) as f:
+        context = json.load(f).get("context", {})
+    if selection != "all":
+        context["stacks"] = selection
+    with tempfile.TemporaryDirectory() as out_dir:
+        env = dict(
+            os.environ,
+            CDK_OUTDIR=out_dir,
+            CDK_CONTEXT_JSON=json.dumps(context),
+            CDK_SYNTH_CACHE_DIR=cache_dir,
+        )
+        started = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "app.py"],
+            cwd=INFRA_DIR,
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        return time.perf_counter() - started
+
+
+def benchmark(selection: str, runs: int) -> Dict[str, float]:
+    cold = []
+    warm = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cold.append(synth(selection, cache_dir))
+            warm.append(synth(selection, cache_dir))
+    return {"cold": statistics.median(cold), "warm": statistics.median(warm)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--selection",
+        action="append",
+        dest="selections",
+        help='comma-separated stacks, or "all"',
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args()
+
+    results = {
+        selection: benchmark(selection, args.runs)
+        for selection in args.selections or DEFAULT_SELECTIONS
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for selection, result in results.items():
+            print(
+                f"{selection}: cold {result['cold']:.2f}s, warm {result['warm']:.2f}s"
+            )
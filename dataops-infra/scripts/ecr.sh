@@ -13,6 +13,10 @@ docker push $ECR_URI/airflow_scheduler_cdk:latest
 docker build -t airflow_worker_cdk -f images/airflow/worker.Dockerfile images/airflow/
 docker tag airflow_worker_cdk:latest $ECR_URI/airflow_worker_cdk:latest
 docker push $ECR_URI/airflow_worker_cdk:latest
+# Push PgBouncer image
+docker build -t pgbouncer_cdk images/pgbouncer/
+docker tag pgbouncer_cdk:latest $ECR_URI/pgbouncer_cdk:latest
+docker push $ECR_URI/pgbouncer_cdk:latest
 # Push DBT image
 docker build -t dbt_cdk images/dbt/
 docker tag dbt_cdk:latest $ECR_URI/dbt_cdk:latest
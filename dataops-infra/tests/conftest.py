@@ -0,0 +1,53 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The image scripts and the CDK app are run as scripts, not installed
+for path in (
+    "infra",
+    "images/airflow/scripts",
+    "images/dbt/scripts",
+    "loadtest",
+):
+    sys.path.insert(0, os.path.join(ROOT, path))
+
+# Airflow reads its settings once, on import: keep the tests on their own
+# SQLite metadata DB
+AIRFLOW_HOME = tempfile.mkdtemp(prefix="airflow_home")
+os.environ["AIRFLOW_HOME"] = AIRFLOW_HOME
+os.environ["AIRFLOW__CORE__SQL_ALCHEMY_CONN"] = f"sqlite:///{AIRFLOW_HOME}/airflow.db"
+os.environ["AIRFLOW__CORE__LOAD_EXAMPLES"] = "False"
+os.environ["AIRFLOW__CORE__STORE_SERIALIZED_DAGS"] = "True"
+
+# Local Postgres the SQL fixtures are loaded into, like the dbt local target
+POSTGRES_DSN = os.environ.get(
+    "POSTGRES_TEST_DSN", "host=localhost user=postgres dbname=dbt"
+)
+BUCKET_NAME = "dataops-tests"
+
+
+@pytest.fixture
+def postgres():
+    """Connection to the local Postgres, skipping the test without one."""
+    psycopg2 = pytest.importorskip("psycopg2")
+    try:
+        conn = psycopg2.connect(POSTGRES_DSN, connect_timeout=5)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"No local Postgres at {POSTGRES_DSN!r}: {e}")
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def s3():
+    """S3 client on moto's in-memory S3, with an empty BUCKET_NAME."""
+    boto3 = pytest.importorskip("boto3")
+    moto = pytest.importorskip("moto")
+    with moto.mock_s3():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET_NAME)
+        yield client
@@ -0,0 +1,82 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("redis")
+fakeredis = pytest.importorskip("fakeredis")
+import airflow_metrics  # noqa: E402
+
+QUEUES = ["default", "dbt"]
+
+
+@pytest.fixture
+def broker():
+    return fakeredis.FakeStrictRedis()
+
+
+@pytest.fixture
+def metadata_db(postgres):
+    """A task_instance table with the columns the metrics read, shadowing
+    any other for the connection."""
+    with postgres.cursor() as cursor:
+        cursor.execute("CREATE TEMP TABLE task_instance (queue text, state text)")
+        cursor.execute(
+            "INSERT INTO task_instance VALUES"
+            " ('default', 'queued'), ('default', 'running'),"
+            " ('default', 'success'), ('heavy', 'queued'), ('dbt', 'failed')"
+        )
+    yield postgres
+    with postgres.cursor() as cursor:
+        cursor.execute("DROP TABLE pg_temp.task_instance")
+
+
+def test_pending_tasks_counts_the_broker_queues(broker):
+    broker.rpush("default", "task-1", "task-2")
+    broker.rpush("unwatched", "task-3")
+
+    assert airflow_metrics.pending_tasks(broker, QUEUES) == {"default": 2, "dbt": 0}
+
+
+def test_in_flight_tasks_counts_queued_and_running(metadata_db):
+    in_flight = airflow_metrics.in_flight_tasks(metadata_db, QUEUES)
+
+    # dbt only has a finished task, heavy is not watched but has tasks
+    assert in_flight == {"default": 2, "dbt": 0, "heavy": 1}
+
+
+def test_metric_data_publishes_totals_and_every_queue():
+    data = airflow_metrics.metric_data(
+        {"default": 2, "dbt": 0}, {"default": 2, "dbt": 0, "heavy": 1}
+    )
+
+    totals = [(d["MetricName"], d["Value"]) for d in data if "Dimensions" not in d]
+    assert totals == [("PendingTasks", 2), ("InFlightTasks", 3)]
+    per_queue = [
+        (d["MetricName"], d["Dimensions"][0]["Value"], d["Value"])
+        for d in data
+        if "Dimensions" in d
+    ]
+    # Queues without tasks get zero rows, so their alarms can scale in
+    assert per_queue == [
+        ("PendingTasks", "dbt", 0),
+        ("PendingTasks", "default", 2),
+        ("InFlightTasks", "dbt", 0),
+        ("InFlightTasks", "default", 2),
+        ("InFlightTasks", "heavy", 1),
+    ]
+
+
+def test_metric_data_adds_the_pool_metrics():
+    pools = {
+        "PoolClientsActive": 4,
+        "PoolClientsWaiting": 1,
+        "PoolServersActive": 2,
+        "PoolServersIdle": 0,
+        "PoolMaxWait": 0.25,
+    }
+
+    data = airflow_metrics.metric_data({"default": 0}, {"default": 0}, pools)
+
+    units = {d["MetricName"]: d["Unit"] for d in data if d["MetricName"] in pools}
+    assert units == {
+        name: "Seconds" if name == "PoolMaxWait" else "Count" for name in pools
+    }
@@ -0,0 +1,92 @@
+"""The runner swaps dbt 0.19.2 internals to keep the parsed project between
+runs: these tests fail when an upgrade moves them."""
+import inspect
+import os
+import shutil
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import ROOT
+
+PROJECT_DIR = os.path.join(os.path.dirname(ROOT), "analytics", "dbt_dags")
+# dbt reads the profiles folder on import
+os.environ.setdefault("DBT_PROFILES_DIR", os.path.join(PROJECT_DIR, "config"))
+
+pytest.importorskip("dbt")
+pytest.importorskip("redis")
+import dbt.task.runnable  # noqa: E402
+from dbt.logger import log_manager  # noqa: E402
+
+import dbt_runner  # noqa: E402
+
+
+class Loaded(Exception):
+    pass
+
+
+@pytest.fixture
+def patched(monkeypatch):
+    """Restore what DbtRunner swaps once the test is over."""
+    monkeypatch.setattr(
+        dbt.task.runnable, "get_full_manifest", dbt.task.runnable.get_full_manifest
+    )
+    monkeypatch.setattr(log_manager, "set_path", log_manager.set_path)
+
+
+def test_get_full_manifest_signature():
+    signature = inspect.signature(dbt.task.runnable.get_full_manifest)
+
+    assert list(signature.parameters) == ["config", "reset"]
+    reset = signature.parameters["reset"]
+    assert reset.kind == inspect.Parameter.KEYWORD_ONLY and reset.default is False
+
+
+def test_tasks_load_the_manifest_through_the_module_global(patched, monkeypatch):
+    def get_full_manifest(config, *, reset=False):
+        raise Loaded(config)
+
+    monkeypatch.setattr(dbt.task.runnable, "get_full_manifest", get_full_manifest)
+    task = SimpleNamespace(config="config")
+
+    with pytest.raises(Loaded):
+        dbt.task.runnable.ManifestTask.load_manifest(task)
+
+
+def test_log_manager_file_handler():
+    assert callable(log_manager.set_path)
+    assert isinstance(log_manager._file_handler.initialized, bool)
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch, postgres):
+    """Copy of the dbt project, on the local target."""
+    if not os.path.isdir(PROJECT_DIR):
+        pytest.skip("No dbt project next to the infrastructure")
+    project_dir = tmp_path / "dbt_dags"
+    shutil.copytree(
+        PROJECT_DIR, project_dir, ignore=shutil.ignore_patterns("target", "logs")
+    )
+    monkeypatch.chdir(project_dir)
+    monkeypatch.setenv("DBT_LOCAL_DBNAME", postgres.info.dbname)
+    monkeypatch.setattr(dbt_runner, "SYNC", False)
+    monkeypatch.setattr(dbt_runner, "TARGET", "local")
+    return project_dir
+
+
+def test_runner_parses_the_project_once(patched, project):
+    runner = dbt_runner.DbtRunner(None)
+    loads = []
+    load = runner.cache._load
+    runner.cache._load = lambda config, **kwargs: loads.append(1) or load(
+        config, **kwargs
+    )
+    request = {"id": "1", "command": ["dbt", "ls", "--resource-type", "model"]}
+
+    assert runner.run(request)["success"]
+    assert runner.run({**request, "id": "2"})["success"]
+    assert len(loads) == 1
+
+    (project / "models" / "new_model.sql").write_text("select 1 as id")
+    assert runner.run({**request, "id": "3"})["success"]
+    assert len(loads) == 2
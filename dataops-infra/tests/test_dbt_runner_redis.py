@@ -0,0 +1,71 @@
+import json
+import os
+import subprocess
+import sys
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from conftest import ROOT
+
+# Default of images/dbt/scripts/dbt_runner.py, set by the stack too
+RUNNER_DB = 2
+
+
+def hook_db(monkeypatch, uri: str):
+    redis_hook = pytest.importorskip("airflow.contrib.hooks.redis_hook")
+    monkeypatch.setenv("AIRFLOW_CONN_DBT_RUNNER_REDIS", uri)
+    conn = redis_hook.RedisHook(redis_conn_id="dbt_runner_redis").get_conn()
+    return conn.connection_pool.connection_kwargs["db"]
+
+
+def test_loadtest_connection_uses_the_runner_db(monkeypatch):
+    pytest.importorskip("psycopg2")
+    from scheduler_throughput import LOCAL_VALUES
+
+    uri = LOCAL_VALUES["AIRFLOW_CONN_DBT_RUNNER_REDIS"]
+    assert int(hook_db(monkeypatch, uri)) == RUNNER_DB
+
+
+def test_redis_hook_ignores_the_database_path(monkeypatch):
+    # Why the connections pass the database as the db extra
+    assert hook_db(monkeypatch, "redis://localhost:6379/2") is None
+
+
+def environment(template: dict, family: str) -> dict:
+    for resource in template["Resources"].values():
+        if resource["Type"] != "AWS::ECS::TaskDefinition":
+            continue
+        if resource["Properties"].get("Family") == family:
+            container = resource["Properties"]["ContainerDefinitions"][0]
+            return {e["Name"]: e["Value"] for e in container["Environment"]}
+    raise KeyError(family)
+
+
+def test_stack_connection_and_runner_share_the_db(tmp_path):
+    pytest.importorskip("aws_cdk.core")
+    env = dict(
+        os.environ,
+        CDK_OUTDIR=str(tmp_path),
+        CDK_CONTEXT_JSON=json.dumps({"stacks": "airflow,dbt"}),
+        CDK_SYNTH_CACHE_DIR="",
+        DBT_RUNNER_ENABLED="true",
+        AWS_REGION="eu-west-1",
+        BUCKET_NAME="dataops-tests",
+        FERNET_SECRET_ARN="arn:aws:secretsmanager:eu-west-1:123456789012:secret:f",
+    )
+    subprocess.run(
+        [sys.executable, "app.py"], cwd=os.path.join(ROOT, "infra"), env=env, check=True
+    )
+    templates = {
+        name: json.loads((tmp_path / f"{name}.template.json").read_text())
+        for name in ("airflow", "dbt")
+    }
+
+    # The host is resolved by CloudFormation, the database is not
+    parts = environment(templates["airflow"], "worker-cdk")[
+        "AIRFLOW_CONN_DBT_RUNNER_REDIS"
+    ]["Fn::Join"][1]
+    query = parse_qs(urlsplit(f"redis://redis{parts[-1]}").query)
+    runner = environment(templates["dbt"], "dbt-runner-cdk")
+    assert query["db"] == [runner["DBT_RUNNER_REDIS_DB"]] == [str(RUNNER_DB)]
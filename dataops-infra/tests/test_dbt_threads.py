@@ -0,0 +1,196 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("psycopg2")
+import dbt_threads  # noqa: E402
+from conftest import BUCKET_NAME, ROOT  # noqa: E402
+
+WLM_FIXTURE = os.path.join(ROOT, "images", "dbt", "fixtures", "redshift_wlm.sql")
+
+
+def model(name, *parents, materialized="table"):
+    return {
+        "name": name,
+        "resource_type": "model",
+        "config": {"materialized": materialized},
+        "depends_on": {"nodes": [f"model.dataops.{parent}" for parent in parents]},
+    }
+
+
+# Three staging models feeding two marts
+MANIFEST = {
+    "nodes": {
+        f"model.dataops.{node['name']}": node
+        for node in [
+            model("stg_a"),
+            model("stg_b"),
+            model("stg_c"),
+            model("sales", "stg_a", "stg_b"),
+            model("margins", "stg_c"),
+        ]
+    }
+}
+
+
+@pytest.fixture
+def wlm_dsn(postgres):
+    with postgres.cursor() as cursor, open(WLM_FIXTURE) as f:
+        cursor.execute(f.read())
+    return postgres.dsn
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """Work directory holding the manifest, where target/ is written."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "manifest.json").write_text(json.dumps(MANIFEST))
+    return tmp_path
+
+
+@pytest.mark.parametrize(
+    "command, models",
+    [
+        (["dbt", "run"], None),
+        (["dbt", "run", "-m", "sales"], ["sales"]),
+        (
+            ["dbt", "run", "--models", "stg_a", "stg_b", "--full-refresh"],
+            ["stg_a", "stg_b"],
+        ),
+        (["dbt", "run", "-m", "stg_a+"], None),
+        (["dbt", "run", "-m", "tag:daily"], None),
+    ],
+)
+def test_selected_models(command, models):
+    assert dbt_threads.selected_models(command) == models
+
+
+def test_graph_width():
+    assert dbt_threads.graph_width(MANIFEST) == 3
+    assert dbt_threads.graph_width(MANIFEST, ["sales", "margins"]) == 2
+    assert dbt_threads.graph_width(MANIFEST, ["sales"]) == 1
+
+
+def test_graph_width_skips_ephemeral_models():
+    # stg_d is inlined into orders, which then starts with the staging models
+    manifest = {
+        "nodes": dict(
+            MANIFEST["nodes"],
+            **{
+                f"model.dataops.{node['name']}": node
+                for node in [
+                    model("stg_d", materialized="ephemeral"),
+                    model("orders", "stg_d"),
+                ]
+            },
+        )
+    }
+
+    assert dbt_threads.graph_width(manifest) == 4
+    assert dbt_threads.graph_width(manifest, ["stg_d", "sales"]) == 1
+
+
+def test_profile_threads(tmp_path):
+    (tmp_path / "dbt_project.yml").write_text("name: dataops\nprofile: default\n")
+    (tmp_path / "config").mkdir()
+    (tmp_path / "config" / "profiles.yml").write_text(
+        "default:\n"
+        "  outputs:\n"
+        "    dev: {type: redshift, threads: 4}\n"
+        "    local: {type: postgres, threads: 2}\n"
+        "  target: dev\n"
+    )
+
+    assert dbt_threads.profile_threads(str(tmp_path), "config") == 4
+    assert dbt_threads.profile_threads(str(tmp_path), "config", "local") == 2
+
+
+def test_observe_queue_reads_the_wlm_fixture(postgres, wlm_dsn):
+    observation = dbt_threads.observe_queue(postgres)
+
+    # The user queries of the last hour, not the short query queue's
+    assert observation["queries"] == 15
+    assert observation["queue_wait_p90"] == pytest.approx(15.604418)
+    # The etl and default queues have 4 and 2 slots
+    assert observation["slots"] == 2
+
+
+@pytest.mark.parametrize(
+    "wait, previous, allowance",
+    [
+        (None, None, 8),
+        (1.0, None, 8),
+        (1.0, {"allowance": 3}, 4),
+        (9.0, {"allowance": 6}, 3),
+        (9.0, {"allowance": 1}, 1),
+        (1.0, {"allowance": 8}, 8),
+    ],
+)
+def test_decide(wait, previous, allowance):
+    observation = {"queue_wait_p90": wait, "slots": None}
+    decision = dbt_threads.decide(3, observation, previous, max_threads=8, target=5)
+
+    assert decision["allowance"] == allowance
+    assert decision["threads"] == min(allowance, 3)
+
+
+def test_decide_stays_within_the_queue_slots():
+    decision = dbt_threads.decide(None, {"queue_wait_p90": 1.0, "slots": 2}, None)
+
+    assert decision["allowance"] == 2
+
+
+@pytest.fixture
+def previous(s3):
+    s3.put_object(
+        Bucket=BUCKET_NAME,
+        Key=dbt_threads.DECISION_KEY,
+        Body=json.dumps({"allowance": 6}),
+    )
+
+
+def test_plan_run_decides_once_for_the_dag_run(s3, previous, wlm_dsn, project):
+    decision = dbt_threads.plan_run(
+        "manifest.json", "manual__1", s3, BUCKET_NAME, wlm_dsn
+    )
+
+    # The p90 queue wait of the fixture is over the target: halved
+    assert decision["allowance"] == 2
+    assert decision["threads"] == 2
+    assert decision["width"] == 3
+    for key in (dbt_threads.DECISION_KEY, "dbt_artifacts/manual__1/threads.json"):
+        stored = json.loads(s3.get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read())
+        assert stored["allowance"] == 2
+
+
+def test_commands_of_a_planned_run_share_its_allowance(s3, previous, wlm_dsn, project):
+    dbt_threads.plan_run("manifest.json", "manual__1", s3, BUCKET_NAME, wlm_dsn)
+    shared = s3.get_object(Bucket=BUCKET_NAME, Key=dbt_threads.DECISION_KEY)
+
+    for command, threads in [
+        (["dbt", "run", "-m", "stg_a"], 1),
+        (["dbt", "run", "-m", "sales", "margins"], 2),
+        (["dbt", "run"], 2),
+    ]:
+        decision = dbt_threads.choose_threads(
+            command, "manifest.json", s3, BUCKET_NAME, wlm_dsn, run_id="manual__1"
+        )
+        assert decision["threads"] == threads
+        assert decision["allowance"] == 2
+
+    # Only the plan wrote the decision shared by all runs
+    after = s3.get_object(Bucket=BUCKET_NAME, Key=dbt_threads.DECISION_KEY)
+    assert after["ETag"] == shared["ETag"]
+    with open("target/threads.json") as f:
+        assert json.load(f)["reason"] == "allowance of run manual__1"
+
+
+def test_commands_without_a_plan_decide_for_themselves(s3, wlm_dsn, project):
+    decision = dbt_threads.choose_threads(
+        ["dbt", "run"], "manifest.json", s3, BUCKET_NAME, wlm_dsn, run_id="manual__2"
+    )
+
+    assert decision["reason"] == "p90 queue wait 15.6s over 5.0s"
+    stored = s3.get_object(Bucket=BUCKET_NAME, Key=dbt_threads.DECISION_KEY)
+    assert json.loads(stored["Body"].read())["threads"] == decision["threads"]
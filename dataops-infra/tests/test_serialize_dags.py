@@ -0,0 +1,82 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("airflow")
+from airflow.models.serialized_dag import SerializedDagModel  # noqa: E402
+from airflow.utils import db  # noqa: E402
+
+import serialize_dags  # noqa: E402
+
+DAG_FILE = """
+import json
+import os
+
+from airflow import DAG
+from airflow.operators.dummy_operator import DummyOperator
+from airflow.utils.dates import days_ago
+
+with open(os.path.join(os.path.dirname(__file__), "dbt", "manifest.json")) as f:
+    models = json.load(f)
+
+dag = DAG("manifest_dag", start_date=days_ago(1), schedule_interval=None)
+for model in models:
+    DummyOperator(task_id=model, dag=dag)
+"""
+
+
+@pytest.fixture(scope="module", autouse=True)
+def metadata_db():
+    db.resetdb(rbac=False)
+
+
+@pytest.fixture
+def dags_folder(tmp_path):
+    (tmp_path / "dbt").mkdir()
+    (tmp_path / "dbt" / "manifest.json").write_text(json.dumps(["a", "b"]))
+    (tmp_path / "manifest_dag.py").write_text(DAG_FILE)
+    return str(tmp_path)
+
+
+def serialized_task_ids(dag_id):
+    return sorted(SerializedDagModel.get(dag_id).dag.task_ids)
+
+
+def test_new_file_is_serialized_once(dags_folder):
+    dag_file = os.path.join(dags_folder, "manifest_dag.py")
+    assert serialize_dags.stale_files(dags_folder) == {dag_file: "new"}
+    assert serialize_dags.serialize(dags_folder) == 0
+    assert serialize_dags.stale_files(dags_folder) == {}
+    assert serialized_task_ids("manifest_dag") == ["a", "b"]
+
+
+def test_changed_dependency_makes_the_dag_files_stale(dags_folder):
+    dag_file = os.path.join(dags_folder, "manifest_dag.py")
+    serialize_dags.serialize(dags_folder)
+    assert serialize_dags.stale_files(dags_folder) == {}
+
+    with open(os.path.join(dags_folder, "dbt", "manifest.json"), "w") as f:
+        json.dump(["a", "b", "c"], f)
+    assert serialize_dags.stale_files(dags_folder) == {dag_file: "dependencies changed"}
+    assert serialize_dags.serialize(dags_folder) == 0
+    assert serialize_dags.stale_files(dags_folder) == {}
+    assert serialized_task_ids("manifest_dag") == ["a", "b", "c"]
+
+
+def test_changed_dag_file(dags_folder):
+    dag_file = os.path.join(dags_folder, "manifest_dag.py")
+    serialize_dags.serialize(dags_folder)
+    with open(dag_file, "a") as f:
+        f.write("DummyOperator(task_id='extra', dag=dag)\n")
+    assert serialize_dags.stale_files(dags_folder) == {dag_file: "changed"}
+    serialize_dags.serialize(dags_folder)
+    assert "extra" in serialized_task_ids("manifest_dag")
+
+
+def test_bytecode_is_not_a_dependency(dags_folder):
+    serialize_dags.serialize(dags_folder)
+    os.makedirs(os.path.join(dags_folder, "__pycache__"))
+    with open(os.path.join(dags_folder, "__pycache__", "x.pyc"), "wb") as f:
+        f.write(b"\0")
+    assert serialize_dags.stale_files(dags_folder) == {}
@@ -0,0 +1,92 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+import source_fingerprint  # noqa: E402
+
+SOURCE = "source.dataops.tickit.sales"
+FINGERPRINT = {"rows": 172456, "written": "2021-03-01 10:00:00", "max_key": 172456}
+
+
+def model(name, *parents, materialized="table", checksum=None):
+    return {
+        "name": name,
+        "resource_type": "model",
+        "checksum": {"checksum": checksum or name},
+        "config": {"materialized": materialized},
+        "depends_on": {"macros": [], "nodes": list(parents)},
+    }
+
+
+def manifest(eph_checksum="eph"):
+    # sales -> stg_sales (ephemeral) -> daily_sales -> sales_eph (ephemeral)
+    #   -> top_days
+    nodes = {
+        "model.dataops.stg_sales": model(
+            "stg_sales", SOURCE, materialized="ephemeral", checksum=eph_checksum
+        ),
+        "model.dataops.daily_sales": model("daily_sales", "model.dataops.stg_sales"),
+        "model.dataops.sales_eph": model(
+            "sales_eph", "model.dataops.daily_sales", materialized="ephemeral"
+        ),
+        "model.dataops.top_days": model("top_days", "model.dataops.sales_eph"),
+    }
+    return {
+        "nodes": nodes,
+        "sources": {SOURCE: {"name": "sales"}},
+        "macros": {},
+    }
+
+
+def builds(graph, built_at="2021-03-01T11:00:00"):
+    return {
+        node["name"]: {
+            "model": node["name"],
+            "built_at": built_at,
+            "definition": source_fingerprint.definition_hash(graph, node),
+            "sources": {SOURCE: FINGERPRINT},
+        }
+        for node in graph["nodes"].values()
+        if node["config"]["materialized"] != "ephemeral"
+    }
+
+
+def test_lineage_walks_through_ephemeral_models():
+    upstream = source_fingerprint.lineage(manifest())
+
+    assert sorted(upstream) == ["model.dataops.daily_sales", "model.dataops.top_days"]
+    assert upstream["model.dataops.daily_sales"] == ({SOURCE}, set())
+    assert upstream["model.dataops.top_days"] == (
+        {SOURCE},
+        {"model.dataops.daily_sales"},
+    )
+
+
+def test_children_of_ephemeral_models_are_skipped():
+    graph = manifest()
+    reasons = source_fingerprint.build_reasons(
+        graph, {SOURCE: FINGERPRINT}, builds(graph)
+    )
+
+    assert reasons == {"daily_sales": None, "top_days": None}
+
+
+def test_source_change_reaches_through_ephemeral_models():
+    graph = manifest()
+    changed = {**FINGERPRINT, "rows": 172500}
+    reasons = source_fingerprint.build_reasons(graph, {SOURCE: changed}, builds(graph))
+
+    assert reasons == {
+        "daily_sales": "source sales changed",
+        "top_days": "source sales changed",
+    }
+
+
+def test_ephemeral_definition_is_part_of_its_children():
+    recorded = builds(manifest())
+    graph = manifest(eph_checksum="eph, edited")
+    reasons = source_fingerprint.build_reasons(graph, {SOURCE: FINGERPRINT}, recorded)
+
+    assert reasons == {
+        "daily_sales": "definition changed",
+        "top_days": "upstream model daily_sales is built",
+    }
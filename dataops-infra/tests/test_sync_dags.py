@@ -0,0 +1,143 @@
+import importlib
+import json
+import os
+
+import pytest
+
+moto = pytest.importorskip("moto")
+import boto3  # noqa: E402
+from botocore.exceptions import ClientError  # noqa: E402
+
+import sync_dags  # noqa: E402
+from conftest import BUCKET_NAME  # noqa: E402
+
+
+@pytest.fixture
+def dags(tmp_path, monkeypatch):
+    """DAGs folder and sync state of a single container."""
+    monkeypatch.setattr(sync_dags, "BUCKET_NAME", BUCKET_NAME)
+    monkeypatch.setattr(sync_dags, "DAGS_FOLDER", str(tmp_path / "dags"))
+    monkeypatch.setattr(sync_dags, "STATE_DIR", str(tmp_path / "state"))
+    return tmp_path / "dags"
+
+
+@pytest.fixture
+def sqs(monkeypatch):
+    with moto.mock_sqs():
+        client = boto3.client("sqs", region_name="us-east-1")
+        queue_url = client.create_queue(QueueName="airflow-scheduler-dags-sync")[
+            "QueueUrl"
+        ]
+        monkeypatch.setattr(sync_dags, "QUEUE_URL", queue_url)
+        yield client
+
+
+def notify(sqs, event, key):
+    record = {
+        "eventName": event,
+        "eventTime": "2021-03-01T10:00:00.000Z",
+        "s3": {"object": {"key": key}},
+    }
+    sqs.send_message(
+        QueueUrl=sync_dags.QUEUE_URL, MessageBody=json.dumps({"Records": [record]})
+    )
+
+
+def test_reconcile_downloads_changed_objects(s3, dags):
+    s3.put_object(Bucket=BUCKET_NAME, Key="airflow_dags/a.py", Body=b"a = 1")
+    s3.put_object(Bucket=BUCKET_NAME, Key="airflow_dags/dbt/manifest.json", Body=b"{}")
+    sync = sync_dags.DagSync(s3)
+    sync.reconcile()
+    manifest = os.stat(dags / "dbt" / "manifest.json")
+
+    s3.put_object(Bucket=BUCKET_NAME, Key="airflow_dags/a.py", Body=b"a = 2")
+    sync.reconcile()
+
+    assert (dags / "a.py").read_text() == "a = 2"
+    # The unchanged object is linked from the previous release
+    assert os.stat(dags / "dbt" / "manifest.json").st_ino == manifest.st_ino
+    assert os.path.islink(dags)
+
+
+def test_notifications_publish_created_and_removed_objects(s3, sqs, dags):
+    s3.put_object(Bucket=BUCKET_NAME, Key="airflow_dags/a.py", Body=b"a = 1")
+    sync = sync_dags.DagSync(s3, sqs)
+    sync.reconcile()
+
+    s3.put_object(Bucket=BUCKET_NAME, Key="airflow_dags/b.py", Body=b"b = 1")
+    s3.delete_object(Bucket=BUCKET_NAME, Key="airflow_dags/a.py")
+    notify(sqs, "ObjectCreated:Put", "airflow_dags/b.py")
+    notify(sqs, "ObjectRemoved:Delete", "airflow_dags/a.py")
+    sync._handle_notifications()
+
+    assert sorted(os.listdir(dags)) == ["b.py"]
+    messages = sqs.receive_message(QueueUrl=sync_dags.QUEUE_URL).get("Messages")
+    assert not messages
+
+
+def test_notifications_trust_s3_over_the_event(s3, sqs, dags):
+    sync = sync_dags.DagSync(s3, sqs)
+    sync.reconcile()
+
+    # Created then removed before the sync read the notification
+    notify(sqs, "ObjectCreated:Put", "airflow_dags/gone.py")
+    sync._handle_notifications()
+
+    assert os.listdir(dags) == []
+
+
+class Stop(BaseException):
+    """Ends listen(), which only stops on what it does not catch."""
+
+
+class FlakyQueue:
+    """The queue of `sqs`, failing its first receive while a DAG is being
+    deployed, and stopping the listener once the DAG is published."""
+
+    def __init__(self, sqs, s3, dags):
+        self.sqs = sqs
+        self.s3 = s3
+        self.dags = dags
+        self.receives = 0
+
+    def receive_message(self, **kwargs):
+        self.receives += 1
+        if self.receives == 1:
+            self.s3.put_object(
+                Bucket=BUCKET_NAME, Key="airflow_dags/b.py", Body=b"b = 1"
+            )
+            notify(self.sqs, "ObjectCreated:Put", "airflow_dags/b.py")
+            raise ClientError({"Error": {"Code": "InternalError"}}, "ReceiveMessage")
+        if (self.dags / "b.py").exists():
+            raise Stop
+        return self.sqs.receive_message(**dict(kwargs, WaitTimeSeconds=0))
+
+    def delete_message_batch(self, **kwargs):
+        return self.sqs.delete_message_batch(**kwargs)
+
+
+def test_listen_keeps_syncing_after_an_error(s3, sqs, dags, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(sync_dags.time, "sleep", sleeps.append)
+
+    with pytest.raises(Stop):
+        sync_dags.DagSync(s3, FlakyQueue(sqs, s3, dags)).listen()
+
+    # Published from the notification, the next listing is minutes away
+    assert sleeps == [sync_dags.BACKOFF_SECONDS]
+    assert os.listdir(dags) == ["b.py"]
+    assert not sqs.receive_message(QueueUrl=sync_dags.QUEUE_URL).get("Messages")
+
+
+@pytest.mark.parametrize("queue_url, interval", [(None, 60), ("https://q", 300)])
+def test_poll_interval(monkeypatch, queue_url, interval):
+    monkeypatch.delenv("DAGS_SYNC_POLL_INTERVAL", raising=False)
+    if queue_url:
+        monkeypatch.setenv("DAGS_SYNC_QUEUE_URL", queue_url)
+    else:
+        monkeypatch.delenv("DAGS_SYNC_QUEUE_URL", raising=False)
+    try:
+        assert importlib.reload(sync_dags).POLL_INTERVAL == interval
+    finally:
+        monkeypatch.undo()
+        importlib.reload(sync_dags)
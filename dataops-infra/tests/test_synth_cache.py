@@ -0,0 +1,54 @@
+import pytest
+
+synth_cache = pytest.importorskip("synth_cache")
+
+
+@pytest.mark.parametrize(
+    "source, names",
+    [
+        ('os.environ.get("A")', {"A"}),
+        ('os.environ["A"]', {"A"}),
+        ('os.getenv("A", "1")', {"A"}),
+        ('os.environ.get(\n    "A",\n    "1",\n)', {"A"}),
+        ('{name: os.environ[name] for name in ("A", "B")}', {"A", "B"}),
+        (
+            '[os.environ.get(name) for name in ["A", "B"] if os.environ.get(name)]',
+            {"A", "B"},
+        ),
+        ("os.environ[name]", None),
+        ("os.environ.get(prefix + 'A')", None),
+        ("dict(os.environ)", None),
+        ("x = 1", set()),
+    ],
+)
+def test_env_vars(source, names):
+    assert synth_cache.env_vars(f"import os\n{source}\n") == names
+
+
+def test_input_hash_covers_stack_variables(monkeypatch):
+    before = synth_cache.input_hash()
+    # Read by a multi-line os.environ.get and by a comprehension in the stacks
+    for name in ("AIRFLOW_PGBOUNCER_POOL_SIZE", "FARGATE_VCPU_HOUR"):
+        monkeypatch.setenv(name, "7")
+        after = synth_cache.input_hash()
+        assert after != before
+        before = after
+    monkeypatch.setenv("NOT_READ_BY_THE_STACKS", "1")
+    assert synth_cache.input_hash() == before
+
+
+def test_input_hash_ignores_files_outside_the_app(tmp_path, monkeypatch):
+    for name in synth_cache.APP_FILES:
+        (tmp_path / name).write_text("")
+    (tmp_path / "stacks").mkdir()
+    (tmp_path / "stacks" / "stack.py").write_text('import os\nos.environ.get("A")\n')
+    monkeypatch.setattr(synth_cache, "INFRA_DIR", str(tmp_path))
+    monkeypatch.setattr(synth_cache, "STACKS_DIR", str(tmp_path / "stacks"))
+    before = synth_cache.input_hash()
+
+    # Like pip's build_env.py in the venv the Makefile creates
+    venv = tmp_path / "venv" / "lib"
+    venv.mkdir(parents=True)
+    (venv / "build_env.py").write_text("import os\nenv = dict(os.environ)\n")
+    monkeypatch.setenv("NOT_READ_BY_THE_STACKS", "1")
+    assert synth_cache.input_hash() == before